@@ -0,0 +1,187 @@
+import asyncio
+import json
+import subprocess
+import time
+from pathlib import Path
+from unittest import mock
+
+from jupyter_server.utils import url_path_join
+from tornado.httpclient import HTTPClientError
+
+from jupyterlab_gallery.git_utils import AsyncGitRunner, has_updates
+from jupyterlab_gallery.gitpuller import Update
+from jupyterlab_gallery.manager import GalleryManager
+
+
+async def open_stream(jp_serverapp, jp_base_url, http_server_client, on_event):
+    """Connect to the pull progress stream, calling `on_event` for each event."""
+    token = jp_serverapp.identity_provider.token
+    connected = asyncio.Event()
+
+    def on_chunk(chunk: bytes):
+        received = time.perf_counter()
+        for line in chunk.decode().splitlines():
+            if line.startswith("data: "):
+                event = json.loads(line[len("data: ") :])
+                if event["phase"] == "connected":
+                    connected.set()
+                else:
+                    on_event(event, received)
+
+    stream = asyncio.ensure_future(
+        http_server_client.fetch(
+            url_path_join(jp_base_url, "jupyterlab-gallery", "pull"),
+            headers={"Authorization": f"token {token}"},
+            streaming_callback=on_chunk,
+            request_timeout=0,
+            raise_error=False,
+        )
+    )
+    await asyncio.wait_for(connected.wait(), timeout=10)
+    return stream
+
+
+async def test_exhibits_latency(
+    request, jp_serverapp, jp_fetch, tmp_path, benchmark_results
+):
+    n_exhibits = request.config.getoption("bench_exhibits")
+    n_clients = request.config.getoption("bench_clients")
+    repeat = request.config.getoption("bench_repeat")
+    exhibits = [
+        {
+            "git": f"https://example.com/org/exhibit-{i}.git",
+            "homepage": f"https://github.com/org/exhibit-{i}",
+            "title": f"Exhibit {i}",
+            "description": "An exhibit " * 20,
+        }
+        for i in range(n_exhibits)
+    ]
+    # half of the exhibits are cloned
+    for i in range(0, n_exhibits, 2):
+        (tmp_path / f"exhibit-{i}" / ".git").mkdir(parents=True)
+        (tmp_path / f"exhibit-{i}" / ".git" / "HEAD").write_text("ref: main\n")
+
+    async def client(samples: list[float], headers: dict):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            try:
+                await jp_fetch("jupyterlab-gallery", "exhibits", headers=headers)
+            except HTTPClientError as e:
+                assert e.code == 304
+            samples.append(time.perf_counter() - start)
+
+    with mock.patch.object(GalleryManager, "exhibits", exhibits), mock.patch.object(
+        GalleryManager, "destination", str(tmp_path)
+    ):
+        start = time.perf_counter()
+        response = await jp_fetch("jupyterlab-gallery", "exhibits")
+        cold = time.perf_counter() - start
+        etag = response.headers["ETag"]
+
+        samples: list[float] = []
+        await asyncio.gather(*[client(samples, {}) for _ in range(n_clients)])
+        conditional: list[float] = []
+        await asyncio.gather(
+            *[client(conditional, {"If-None-Match": etag}) for _ in range(n_clients)]
+        )
+
+    benchmark_results.record(
+        "exhibits_latency",
+        samples,
+        exhibits=n_exhibits,
+        clients=n_clients,
+        cold=cold,
+    )
+    benchmark_results.record(
+        "exhibits_latency_not_modified",
+        conditional,
+        exhibits=n_exhibits,
+        clients=n_clients,
+    )
+
+
+async def test_pull_clone_time(
+    jp_serverapp,
+    jp_fetch,
+    jp_base_url,
+    http_server_client,
+    bench_remote,
+    benchmark_results,
+):
+    events = []
+    finished = asyncio.Event()
+
+    def on_event(event, received):
+        events.append(event)
+        if event["phase"] in {"finished", "error"}:
+            finished.set()
+
+    stream = await open_stream(jp_serverapp, jp_base_url, http_server_client, on_event)
+    with mock.patch.object(GalleryManager, "exhibits", [{"git": bench_remote}]):
+        start = time.perf_counter()
+        await jp_fetch(
+            "jupyterlab-gallery",
+            "pull",
+            method="POST",
+            body=json.dumps({"exhibit_id": 0}),
+        )
+        await asyncio.wait_for(finished.wait(), timeout=600)
+        duration = time.perf_counter() - start
+    stream.cancel()
+
+    assert events[-1]["phase"] == "finished", events[-1]
+    benchmark_results.record(
+        "pull_clone",
+        [duration],
+        progress_events=sum(event["phase"] == "progress" for event in events),
+    )
+
+
+async def test_progress_stream_latency(
+    request,
+    jp_serverapp,
+    jp_base_url,
+    http_server_client,
+    benchmark_results,
+):
+    repeat = request.config.getoption("bench_repeat")
+    n_clients = request.config.getoption("bench_clients")
+    latencies: list[float] = []
+    received_all = asyncio.Event()
+
+    def on_event(event, received):
+        sent = float(event["output"]["message"])
+        latencies.append(received - sent)
+        if len(latencies) == repeat * n_clients:
+            received_all.set()
+
+    streams = [
+        await open_stream(jp_serverapp, jp_base_url, http_server_client, on_event)
+        for _ in range(n_clients)
+    ]
+    bus = jp_serverapp.web_app.settings["progress_bus"]
+    for i in range(repeat):
+        bus.publish(0, Update(progress=i / repeat, message=str(time.perf_counter())))
+        await asyncio.sleep(0.01)
+    await asyncio.wait_for(received_all.wait(), timeout=60)
+    for stream in streams:
+        stream.cancel()
+
+    benchmark_results.record("progress_stream_latency", latencies, clients=n_clients)
+
+
+async def test_has_updates_cost(request, tmp_path, bench_remote, benchmark_results):
+    repeat = request.config.getoption("bench_repeat")
+    clone = tmp_path / "clone"
+    subprocess.run(
+        ["git", "clone", "--quiet", bench_remote, str(clone)],
+        check=True,
+    )
+    runner = AsyncGitRunner()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        assert not await has_updates(Path(clone), runner=runner)
+        samples.append(time.perf_counter() - start)
+
+    benchmark_results.record("has_updates", samples)
@@ -0,0 +1,181 @@
+import json
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("gallery benchmarks")
+    group.addoption(
+        "--bench-json",
+        default="benchmark-results.json",
+        help="Path of the JSON file to write benchmark results to",
+    )
+    group.addoption(
+        "--bench-commits", type=int, default=20, help="Commits in the remote"
+    )
+    group.addoption(
+        "--bench-files", type=int, default=50, help="Files written by each commit"
+    )
+    group.addoption(
+        "--bench-blob-size", type=int, default=4096, help="Size of each file in bytes"
+    )
+    group.addoption(
+        "--bench-exhibits", type=int, default=50, help="Number of configured exhibits"
+    )
+    group.addoption(
+        "--bench-clients", type=int, default=10, help="Number of concurrent clients"
+    )
+    group.addoption(
+        "--bench-repeat", type=int, default=20, help="Repetitions of each measurement"
+    )
+    group.addoption(
+        "--bench-git-daemon",
+        action="store_true",
+        help="Serve the remote with `git daemon` instead of file://",
+    )
+
+
+def summarize(samples: list[float]) -> dict:
+    """Summary statistics of timings (in seconds)."""
+    ordered = sorted(samples)
+    return {
+        "n": len(ordered),
+        "mean": statistics.mean(ordered),
+        "median": statistics.median(ordered),
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "min": ordered[0],
+        "max": ordered[-1],
+    }
+
+
+class BenchmarkResults(dict):
+    def record(self, name: str, samples: list[float], **extra):
+        """Record timings (in seconds) of a benchmark with extra values."""
+        self[name] = {**summarize(samples), **extra}
+
+
+@pytest.fixture(scope="session")
+def benchmark_results(request):
+    """Collects results of all benchmarks and writes them as JSON at the end."""
+    results = BenchmarkResults()
+    yield results
+    git_version = subprocess.run(
+        ["git", "--version"], capture_output=True, text=True
+    ).stdout.strip()
+    try:
+        from jupyterlab_gallery import __version__
+    except ImportError:
+        __version__ = "unknown"
+    report = {
+        "metadata": {
+            "jupyterlab_gallery": __version__,
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "git": git_version,
+            "timestamp": time.time(),
+            "options": {
+                name: request.config.getoption(name)
+                for name in [
+                    "bench_commits",
+                    "bench_files",
+                    "bench_blob_size",
+                    "bench_exhibits",
+                    "bench_clients",
+                    "bench_repeat",
+                    "bench_git_daemon",
+                ]
+            },
+        },
+        "benchmarks": results,
+    }
+    path = Path(request.config.getoption("bench_json"))
+    path.write_text(json.dumps(report, indent=2))
+
+
+def build_repository(path: Path, commits: int, files: int, blob_size: int):
+    """Create a bare repository of given size using `git fast-import`."""
+    subprocess.run(
+        ["git", "init", "--bare", "--initial-branch=main", str(path)],
+        check=True,
+        capture_output=True,
+    )
+    subprocess.run(
+        ["git", "config", "uploadpack.allowFilter", "true"], cwd=path, check=True
+    )
+    rng = random.Random(0)
+    stream = bytearray()
+    for i in range(commits):
+        message = f"commit {i}".encode()
+        stream += b"commit refs/heads/main\n"
+        stream += f"mark :{i + 1}\n".encode()
+        stream += (
+            f"committer bench <bench@example.com> {1700000000 + i} +0000\n".encode()
+        )
+        stream += f"data {len(message)}\n".encode() + message + b"\n"
+        if i:
+            stream += f"from :{i}\n".encode()
+        for j in range(files):
+            # incompressible content, so that transfer sizes are realistic
+            content = rng.randbytes(blob_size)
+            stream += f"M 100644 inline data/{j % 100}/file-{j}.bin\n".encode()
+            stream += f"data {len(content)}\n".encode() + content + b"\n"
+    subprocess.run(
+        ["git", "fast-import", "--quiet"],
+        cwd=path,
+        input=bytes(stream),
+        check=True,
+    )
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture(scope="session")
+def bench_remote(request, tmp_path_factory):
+    """URL of a local remote repository with the configured size."""
+    config = request.config
+    base = tmp_path_factory.mktemp("bench-remote")
+    build_repository(
+        base / "exhibit.git",
+        commits=config.getoption("bench_commits"),
+        files=config.getoption("bench_files"),
+        blob_size=config.getoption("bench_blob_size"),
+    )
+    if not config.getoption("bench_git_daemon"):
+        yield (base / "exhibit.git").as_uri()
+        return
+    port = free_port()
+    daemon = subprocess.Popen(
+        [
+            "git",
+            "daemon",
+            "--reuseaddr",
+            "--export-all",
+            "--listen=127.0.0.1",
+            f"--port={port}",
+            f"--base-path={base}",
+            str(base),
+        ]
+    )
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+        yield f"git://127.0.0.1:{port}/exhibit.git"
+    finally:
+        daemon.terminate()
+        daemon.wait()
@@ -1,3 +1,5 @@
+import subprocess
+
 import pytest
 
 pytest_plugins = ("pytest_jupyter.jupyter_server",)
@@ -6,3 +8,56 @@ pytest_plugins = ("pytest_jupyter.jupyter_server",)
 @pytest.fixture
 def jp_server_config(jp_server_config):
     return {"ServerApp": {"jpserver_extensions": {"jupyterlab_gallery": True}}}
+
+
+def git(*args, cwd):
+    subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True)
+
+
+class GitRemote:
+    """A bare repository with a working copy used to push new commits."""
+
+    def __init__(self, path, name: str = "remote"):
+        self.path = path / f"{name}.git"
+        self.author = path / "author"
+        self.path.mkdir()
+        git("init", "--bare", "--initial-branch=main", cwd=self.path)
+        # allow partial clones over file://
+        git("config", "uploadpack.allowFilter", "true", cwd=self.path)
+        git("clone", str(self.path), str(self.author), cwd=path)
+        git("checkout", "-b", "main", cwd=self.author)
+
+    @property
+    def url(self) -> str:
+        return self.path.as_uri()
+
+    def push_commit(self, name: str):
+        (self.author / name).parent.mkdir(parents=True, exist_ok=True)
+        (self.author / name).write_text(name)
+        git("add", name, cwd=self.author)
+        git(
+            "-c",
+            "user.name=test",
+            "-c",
+            "user.email=test@example.com",
+            "commit",
+            "-m",
+            name,
+            cwd=self.author,
+        )
+        git("push", "origin", "main", cwd=self.author)
+
+
+@pytest.fixture
+def make_git_remote(tmp_path_factory):
+    def make_git_remote(name: str = "remote") -> GitRemote:
+        remote = GitRemote(tmp_path_factory.mktemp(name), name=name)
+        remote.push_commit("first")
+        return remote
+
+    return make_git_remote
+
+
+@pytest.fixture
+def git_remote(make_git_remote):
+    return make_git_remote()
@@ -8,7 +8,16 @@ except ImportError:
 
     warnings.warn("Importing 'jupyterlab_gallery' outside a proper installation.")
     __version__ = "dev"
-from .app import GalleryApp
+
+
+def __getattr__(name):
+    # the server extension (and with it jupyter_server) is imported on first
+    # use, so that listing lab extensions does not pay for it
+    if name == "GalleryApp":
+        from .app import GalleryApp
+
+        return GalleryApp
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def _jupyter_labextension_paths():
@@ -16,4 +25,6 @@ def _jupyter_labextension_paths():
 
 
 def _jupyter_server_extension_points():
+    from .app import GalleryApp
+
     return [{"module": "jupyterlab_gallery", "app": GalleryApp}]
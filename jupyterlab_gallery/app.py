@@ -1,7 +1,23 @@
+import asyncio
+import os
+from typing import Optional
+
 from jupyter_server.extension.application import ExtensionApp
 from jupyter_server.serverapp import ServerApp
-from .handlers import ExhibitsHandler, GalleryHandler, PullHandler
+from tornado.ioloop import IOLoop
+from traitlets.config import Config
+
+from .handlers import (
+    BatchPullHandler,
+    ExhibitsHandler,
+    GalleryHandler,
+    IconHandler,
+    MetricsHandler,
+    PullHandler,
+    TimelinesHandler,
+)
 from .manager import GalleryManager
+from .prefetch import ExhibitPrefetcher
 
 
 class GalleryApp(ExtensionApp):
@@ -11,6 +27,10 @@ class GalleryApp(ExtensionApp):
         ("jupyterlab-gallery/gallery", GalleryHandler),
         ("jupyterlab-gallery/exhibits", ExhibitsHandler),
         ("jupyterlab-gallery/pull", PullHandler),
+        ("jupyterlab-gallery/batch-pull", BatchPullHandler),
+        ("jupyterlab-gallery/metrics", MetricsHandler),
+        ("jupyterlab-gallery/debug/timelines", TimelinesHandler),
+        ("jupyterlab-gallery/icons/([0-9a-f]+)", IconHandler),
     ]
 
     default_url = "/jupyterlab-gallery/gallery"
@@ -19,9 +39,89 @@ class GalleryApp(ExtensionApp):
     def initialize_settings(self):
         self.log.info("Configured gallery manager")
         gallery_manager = GalleryManager(
-            log=self.log, root_dir=self.serverapp.root_dir, config=self.config
+            log=self.log,
+            root_dir=self.serverapp.root_dir,
+            base_url=self.serverapp.base_url,
+            config=self.config,
+        )
+        # a restarted server knows which exhibits have updates without checking
+        gallery_manager.load_state()
+        self.settings.update(
+            {
+                "gallery_manager": gallery_manager,
+                # pulls and maintenance of a repository must not overlap
+                "repo_locks": gallery_manager.repo_locks,
+                "timelines": gallery_manager.timelines,
+            }
         )
-        self.settings.update({"gallery_manager": gallery_manager})
+        # run once the server started the event loop (jupyter_server
+        # before 2.16 does not call `_start_jupyter_server_extension`)
+        IOLoop.current().add_callback(self._start_background_tasks)
+
+    _config_watcher: Optional[asyncio.Task] = None
+
+    async def _start_background_tasks(self):
+        # prefetching runs in the background, the server is ready without waiting
+        ExhibitPrefetcher(
+            settings=self.serverapp.web_app.settings,
+            gallery_manager=self.settings["gallery_manager"],
+        ).start()
+        self.settings["gallery_manager"].start_update_checks()
+        self.settings["gallery_manager"].start_shared_cache_updates()
+        self.settings["gallery_manager"].start_maintenance()
+        if self.settings["gallery_manager"].config_reload_interval > 0:
+            self._config_watcher = asyncio.create_task(self._watch_config())
+
+    async def stop_extension(self):
+        if self._config_watcher is not None:
+            self._config_watcher.cancel()
+        await self.settings["gallery_manager"].stop_update_checks()
+
+    def _config_files_state(self) -> list[tuple[str, int]]:
+        """Paths and modification times of the gallery configuration files."""
+        state = []
+        for directory in self.config_file_paths:
+            for extension in [".py", ".json"]:
+                path = os.path.join(directory, self.config_file_name + extension)
+                try:
+                    state.append((path, os.stat(path).st_mtime_ns))
+                except OSError:
+                    pass
+        return state
+
+    def reload_config(self):
+        """Apply the configuration files to the gallery manager again."""
+        config = Config()
+        for loaded, _ in self._load_config_files(
+            self.config_file_name,
+            path=self.config_file_paths,
+            log=self.log,
+            raise_config_file_errors=True,
+        ):
+            config.merge(loaded)
+        gallery_manager = self.settings["gallery_manager"]
+        exhibits = gallery_manager.exhibits
+        gallery_manager.update_config(config)
+        if gallery_manager.exhibits != exhibits:
+            self.log.info("Gallery exhibits changed, notifying clients")
+            bus = self.serverapp.web_app.settings.get("progress_bus")
+            # without a bus no client is listening
+            if bus is not None:
+                bus.publish_exhibits_changed(gallery_manager.state_version)
+
+    async def _watch_config(self):
+        state = self._config_files_state()
+        while True:
+            await asyncio.sleep(self.settings["gallery_manager"].config_reload_interval)
+            new_state = self._config_files_state()
+            if new_state == state:
+                continue
+            state = new_state
+            try:
+                self.reload_config()
+            except Exception as e:
+                # e.g. a file saved half-way; retried when it changes again
+                self.log.warning(f"Could not reload gallery configuration: {e}")
 
     def initialize_handlers(self):
         # setting nbapp is needed for nbgitpuller
@@ -1,10 +1,15 @@
-from contextlib import contextmanager
 from pathlib import Path
-from subprocess import run
-from threading import Lock
-from typing import Optional
+from typing import NamedTuple, Optional
+import asyncio
+import hashlib
+import json
 import re
 import os
+import signal
+import time
+
+from .state import atomic_write
+from .timeline import Timeline
 
 
 def extract_repository_owner(git_url: str) -> str:
@@ -19,51 +24,296 @@ def extract_repository_name(git_url: str) -> str:
     return fragment
 
 
-def has_updates(repo_path: Path) -> bool:
-    try:
-        run(
-            "git fetch origin $(git branch --show-current) --quiet",
-            cwd=repo_path,
-            shell=True,
+class GitResult(NamedTuple):
+    returncode: int
+    stdout: str
+    stderr: str
+
+
+class GitTimeoutError(TimeoutError):
+    pass
+
+
+class AsyncGitRunner:
+    """Run git commands as asyncio subprocesses (without a shell).
+
+    At most `concurrency` git processes are started at the same time;
+    a process exceeding its timeout or whose caller is cancelled is killed.
+    """
+
+    def __init__(self, concurrency: int = 4, timeout: Optional[float] = 60):
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(
+        self,
+        *args: str,
+        cwd: Path,
+        env: Optional[dict[str, str]] = None,
+        timeout: Optional[float] = None,
+    ) -> GitResult:
+        timeout = self.timeout if timeout is None else timeout
+        async with self._semaphore:
+            process = await asyncio.create_subprocess_exec(
+                "git",
+                *args,
+                cwd=cwd,
+                env={**os.environ, **env} if env else None,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                # allows to kill helpers (such as git-remote-https) along with git
+                start_new_session=os.name == "posix",
+            )
+            try:
+                stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+            except asyncio.TimeoutError:
+                await _kill(process)
+                raise GitTimeoutError(
+                    f"git {args[0]} did not complete within {timeout} seconds"
+                )
+            except asyncio.CancelledError:
+                await _kill(process)
+                raise
+        return GitResult(
+            returncode=process.returncode,
+            stdout=stdout.decode("utf-8"),
+            stderr=stderr.decode("utf-8"),
         )
-        result = run(
-            "git status -b --porcelain -u n --ignored n",
-            cwd=repo_path,
-            capture_output=True,
-            shell=True,
+
+
+# seconds given to git to remove its lock files before it is killed
+KILL_GRACE_PERIOD = 2.0
+
+
+def _signal(process: asyncio.subprocess.Process, signum: int):
+    try:
+        if os.name == "posix":
+            os.killpg(process.pid, signum)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+
+
+async def _kill(process: asyncio.subprocess.Process):
+    """Terminate git, killing it unless it exits within the grace period.
+
+    Git removes its lock files (e.g. `commit-graph-chain.lock` during
+    maintenance) when terminated, but leaves them behind when killed.
+    """
+    if process.returncode is None:
+        _signal(process, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(process.wait(), KILL_GRACE_PERIOD)
+        except asyncio.TimeoutError:
+            _signal(process, signal.SIGKILL)
+            await process.wait()
+
+
+class UpdateCheck(NamedTuple):
+    updates_available: bool
+    # head of the remote branch, if known
+    remote_sha: Optional[str] = None
+
+
+async def check_updates(
+    repo_path: Path,
+    runner: AsyncGitRunner,
+    env: Optional[dict[str, str]] = None,
+    timeline: Optional[Timeline] = None,
+) -> UpdateCheck:
+    """Fetch the current branch and compare it with the local HEAD."""
+
+    async def run(*args: str, env: Optional[dict[str, str]] = None) -> GitResult:
+        result = await runner.run(*args, cwd=repo_path, env=env)
+        # otherwise a stale remote-tracking branch would be compared
+        if result.returncode != 0:
+            raise RuntimeError(f"git {args[0]} failed: {result.stderr.strip()}")
+        return result
+
+    try:
+        branch = await run("branch", "--show-current")
+        if not branch.stdout.strip():
+            # detached HEAD, there is no branch to compare with
+            return UpdateCheck(updates_available=False)
+        if timeline:
+            timeline.mark("fetch")
+        await run("fetch", "origin", branch.stdout.strip(), "--quiet", env=env)
+        if timeline:
+            timeline.mark("status")
+        result = await run(
+            "status",
+            "-b",
+            "--porcelain",
+            "--untracked-files=no",
+            "--ignored=no",
         )
+        fetch_head = await run("rev-parse", "--verify", "--quiet", "FETCH_HEAD")
     except FileNotFoundError:
-        return False
+        return UpdateCheck(updates_available=False)
+    remote_sha = fetch_head.stdout.strip() or None
     data = re.match(
         r"^## (.*?)( \[(ahead (?P<ahead>\d+))?(, )?(behind (?P<behind>\d+))?\])?$",
-        result.stdout.decode("utf-8"),
+        result.stdout.splitlines()[0] if result.stdout else "",
     )
     if not data:
-        return False
-    return data["behind"] is not None
+        return UpdateCheck(updates_available=False, remote_sha=remote_sha)
+    return UpdateCheck(
+        updates_available=data["behind"] is not None, remote_sha=remote_sha
+    )
+
+
+async def has_updates(
+    repo_path: Path,
+    runner: AsyncGitRunner,
+    env: Optional[dict[str, str]] = None,
+) -> bool:
+    check = await check_updates(repo_path, runner=runner, env=env)
+    return check.updates_available
+
 
+class RemoteRefCache:
+    """Branch heads of remote repositories, queried once per URL and `ttl` seconds.
 
-_git_credential_lock = Lock()
+    Concurrent lookups of the same URL share a single `git ls-remote`.
+    If `path` is given, results are also stored in (and read from) this
+    directory, so that servers sharing it (e.g. on one node) query each
+    remote only once.
+    """
 
+    def __init__(self, ttl: float = 60, path: Optional[Path] = None):
+        self.ttl = ttl
+        self.path = Path(path) if path else None
+        self._refs: dict[str, tuple[float, dict[str, str]]] = {}
+        self._pending: dict[str, asyncio.Future] = {}
 
-@contextmanager
-def git_credentials(token: Optional[str], account: Optional[str]):
-    if token and account:
-        _git_credential_lock.acquire()
+    async def get(
+        self,
+        url: str,
+        runner: AsyncGitRunner,
+        cwd: Path,
+        env: Optional[dict[str, str]] = None,
+    ) -> dict[str, str]:
+        """Map of branch names to commit hashes of the remote at `url`."""
+        cached = self._refs.get(url) or self._read(url)
+        if cached and time.time() - cached[0] < self.ttl:
+            return cached[1]
+        if url not in self._pending:
+            self._pending[url] = asyncio.ensure_future(
+                self._query(url, runner=runner, cwd=cwd, env=env)
+            )
+            self._pending[url].add_done_callback(
+                lambda _, url=url: self._pending.pop(url, None)
+            )
+        return await asyncio.shield(self._pending[url])
+
+    async def _query(
+        self,
+        url: str,
+        runner: AsyncGitRunner,
+        cwd: Path,
+        env: Optional[dict[str, str]],
+    ) -> dict[str, str]:
+        result = await runner.run("ls-remote", "--heads", "--", url, cwd=cwd, env=env)
+        if result.returncode != 0:
+            raise RuntimeError(f"git ls-remote failed: {result.stderr.strip()}")
+        refs = {}
+        for line in result.stdout.splitlines():
+            sha, _, ref = line.partition("\t")
+            if ref.startswith("refs/heads/"):
+                refs[ref[len("refs/heads/") :]] = sha
+        self._refs[url] = (time.time(), refs)
+        self._write(url, refs)
+        return refs
+
+    def _file(self, url: str) -> Path:
+        return self.path / (hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+    def _read(self, url: str) -> Optional[tuple[float, dict[str, str]]]:
+        if self.path is None:
+            return None
         try:
-            path = Path(__file__).parent
-            os.environ["GIT_ASKPASS"] = str(path / "git_askpass.py")
-            os.environ["GIT_PULLER_ACCOUNT"] = account
-            os.environ["GIT_PULLER_TOKEN"] = token
-            # do not prompt user if askpass fails as this would
-            # dead lock execution!
-            os.environ["GIT_TERMINAL_PROMPT"] = "0"
-            yield
-        finally:
-            del os.environ["GIT_PULLER_ACCOUNT"]
-            del os.environ["GIT_PULLER_TOKEN"]
-            del os.environ["GIT_TERMINAL_PROMPT"]
-            del os.environ["GIT_ASKPASS"]
-            _git_credential_lock.release()
-    else:
-        yield
+            file = self._file(url)
+            return file.stat().st_mtime, json.loads(file.read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, url: str, refs: dict[str, str]):
+        if self.path is None:
+            return
+        try:
+            self.path.mkdir(parents=True, exist_ok=True)
+            atomic_write(self._file(url), json.dumps(refs))
+        except OSError:
+            pass
+
+
+async def check_remote_updates(
+    repo_path: Path,
+    url: str,
+    runner: AsyncGitRunner,
+    ref_cache: RemoteRefCache,
+    env: Optional[dict[str, str]] = None,
+    timeline: Optional[Timeline] = None,
+) -> UpdateCheck:
+    """Compare the remote branch head with the local HEAD without fetching.
+
+    Unlike `check_updates` this downloads no objects and leaves the
+    repository (including FETCH_HEAD) untouched.
+    """
+    try:
+        branch = await runner.run("branch", "--show-current", cwd=repo_path)
+        head = await runner.run("rev-parse", "HEAD", cwd=repo_path)
+    except FileNotFoundError:
+        return UpdateCheck(updates_available=False)
+    if timeline:
+        timeline.mark("ls-remote")
+    refs = await ref_cache.get(url, runner=runner, cwd=repo_path, env=env)
+    remote_sha = refs.get(branch.stdout.strip())
+    if remote_sha is None or remote_sha == head.stdout.strip():
+        return UpdateCheck(updates_available=False, remote_sha=remote_sha)
+    # the remote head may be a commit we already have (e.g. local commits
+    # on top of it); otherwise it is new
+    if timeline:
+        timeline.mark("merge-base")
+    ancestor = await runner.run(
+        "merge-base",
+        "--is-ancestor",
+        remote_sha,
+        "HEAD",
+        cwd=repo_path,
+        # do not download missing commits in partial clones
+        env={"GIT_NO_LAZY_FETCH": "1"},
+    )
+    return UpdateCheck(
+        updates_available=ancestor.returncode != 0, remote_sha=remote_sha
+    )
+
+
+async def has_remote_updates(
+    repo_path: Path,
+    url: str,
+    runner: AsyncGitRunner,
+    ref_cache: RemoteRefCache,
+    env: Optional[dict[str, str]] = None,
+) -> bool:
+    check = await check_remote_updates(
+        repo_path, url=url, runner=runner, ref_cache=ref_cache, env=env
+    )
+    return check.updates_available
+
+
+def credentials_env(token: Optional[str], account: Optional[str]) -> dict[str, str]:
+    """Environment variables making git authenticate with given credentials."""
+    if not (token and account):
+        return {}
+    path = Path(__file__).parent
+    return {
+        "GIT_ASKPASS": str(path / "git_askpass.py"),
+        "GIT_PULLER_ACCOUNT": account,
+        "GIT_PULLER_TOKEN": token,
+        # do not prompt user if askpass fails as this would
+        # dead lock execution!
+        "GIT_TERMINAL_PROMPT": "0",
+    }
@@ -6,106 +6,197 @@
 # - restricting which repositories can be cloned
 # - reconnecting to the event stream when refreshing the browser
 # - handling multiple waiting pulls
-from tornado import gen, web, locks
+from tornado import web
 import asyncio
-import logging
 import traceback
 
 import threading
 import json
 import os
-from queue import Queue, Empty
-from collections import defaultdict
-from typing import Optional, TypedDict
+import signal
+import subprocess
+import time
+from contextlib import contextmanager
+from collections import deque
+from functools import partial
+from typing import (
+    Any,
+    Callable,
+    NamedTuple,
+    Optional,
+    TypedDict,
+    Union,
+)
 
-import git
 from jupyter_server.base.handlers import JupyterHandler
-from nbgitpuller.pull import GitPuller
 from tornado.iostream import StreamClosedError
 
-from .git_utils import git_credentials
+from .state import KeyedLocks, StateStore
+from .timeline import Timeline, TimelineLog
+from .metrics import (
+    EVENT_STREAMS,
+    GIT_OPERATION_DURATION,
+    GIT_OPERATION_FAILURES,
+    LOCK_WAIT_DURATION,
+    PROGRESS_QUEUE_DEPTH,
+)
+
+
+class ProgressThrottle:
+    """Coalesce frequent progress updates.
+
+    An update is emitted only if at least `min_interval` seconds passed
+    and progress advanced by at least `min_delta` since the last emitted
+    update, unless it is forced (e.g. on phase transitions).
+    """
+
+    def __init__(self, min_interval: float = 0.1, min_delta: float = 0.01):
+        self.min_interval = min_interval
+        self.min_delta = min_delta
+        self._last_time: Optional[float] = None
+        self._last_progress = 0.0
+
+    def should_emit(self, progress: float, force: bool = False) -> bool:
+        now = time.monotonic()
+        if not force and self._last_time is not None:
+            if now - self._last_time < self.min_interval:
+                return False
+            if abs(progress - self._last_progress) < self.min_delta:
+                return False
+        self._last_time = now
+        self._last_progress = progress
+        return True
+
+
+class OutputCoalescer:
+    """Join text output lines of a pull published within `min_interval` seconds.
+
+    The first line after a quiet period is published at once; lines
+    following it are held for at most `min_interval` seconds, even if
+    git prints nothing else meanwhile. Any other update (progress,
+    exceptions) flushes pending lines first, so the order of events
+    is preserved. Must be created on the event loop.
+    """
+
+    def __init__(self, publish: Callable[[Any], None], min_interval: float = 0.1):
+        self.min_interval = min_interval
+        self._publish = publish
+        self._loop = asyncio.get_running_loop()
+        self._pending: list[str] = []
+        self._last_flush = float("-inf")
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def publish(self, update):
+        """Publish an update; must be called from the event loop."""
+        if isinstance(update, str):
+            self._pending.append(update)
+            wait = self._last_flush + self.min_interval - time.monotonic()
+            if wait > 0:
+                if self._timer is None:
+                    self._timer = self._loop.call_later(wait, self.flush)
+                return
+        self.flush()
+        if not isinstance(update, str):
+            self._publish(update)
+
+    def publish_threadsafe(self, update):
+        """Publish an update from a worker thread."""
+        self._loop.call_soon_threadsafe(self.publish, update)
+
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._pending:
+            self._publish("".join(self._pending))
+            self._pending = []
+            self._last_flush = time.monotonic()
+
+
+class PullCancelledError(Exception):
+    """The pull was cancelled on request."""
+
+
+class PullTimeoutError(TimeoutError):
+    pass
+
+
+# seconds given to git to remove its lock files before it is killed
+KILL_GRACE_PERIOD = 2.0
+
+
+def _signal_process_group(process: subprocess.Popen, signum: int):
+    try:
+        if os.name == "posix":
+            # also stops helpers (such as git-remote-https) started by git
+            os.killpg(process.pid, signum)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+
+
+def _kill_process_group(process: subprocess.Popen):
+    """Terminate the process group, killing it unless it exits in time.
+
+    Git removes its lock files (such as `.git/index.lock`) when
+    terminated, but leaves them behind when killed.
+    """
+    _signal_process_group(process, signal.SIGTERM)
+    if os.name != "posix":
+        return
+
+    def kill():
+        if process.poll() is None:
+            _signal_process_group(process, signal.SIGKILL)
+
+    timer = threading.Timer(KILL_GRACE_PERIOD, kill)
+    timer.daemon = True
+    timer.start()
+
+
+class PullCancellation:
+    """Stops a pull running in a worker thread, from any thread.
+
+    Git processes of the pull are killed and the pulling thread
+    raises the error passed to `cancel` at the next check.
+    """
 
-
-class CloneProgress(git.RemoteProgress):
     def __init__(self):
-        self.queue = Queue()
-        self.max_stage = 0.01
-        self.prev_stage = 0
-        super().__init__()
-
-    def update(self, op_code: int, cur_count, max_count=None, message=""):
-        if op_code & git.RemoteProgress.BEGIN:
-            new_stage = None
-            if op_code & git.RemoteProgress.COUNTING:
-                new_stage = 0.05
-            elif op_code & git.RemoteProgress.COMPRESSING:
-                new_stage = 0.10
-            elif op_code & git.RemoteProgress.RECEIVING:
-                new_stage = 0.90
-            elif op_code & git.RemoteProgress.RESOLVING:
-                new_stage = 1
-
-            if new_stage:
-                self.prev_stage = self.max_stage
-                self.max_stage = new_stage
-
-        if isinstance(cur_count, (int, float)) and isinstance(max_count, (int, float)):
-            progress = self.prev_stage + cur_count / max_count * (
-                self.max_stage - self.prev_stage
-            )
-            self.queue.put(
-                Update(
-                    progress=progress,
-                    message=message,
-                )
-            )
-            # self.queue.join()
+        self.error: Optional[Exception] = None
+        # whether the pulling thread started
+        self.started = False
+        self._processes: set[subprocess.Popen] = set()
+        self._lock = threading.Lock()
 
-
-class ProgressGitPuller(GitPuller):
-    def __init__(
-        self, git_url, repo_dir, token: Optional[str], account: Optional[str], **kwargs
-    ):
-        self._token = token
-        self._account = account
-        # it will attempt to resolve default branch which requires credentials too
-        with git_credentials(token=self._token, account=self._account):
-            super().__init__(git_url, repo_dir, **kwargs)
-
-    def initialize_repo(self):
-        logging.info("Repo {} doesn't exist. Cloning...".format(self.repo_dir))
-        progress = CloneProgress()
-
-        def clone_task():
-            with git_credentials(token=self._token, account=self._account):
-                try:
-                    git.Repo.clone_from(
-                        self.git_url,
-                        self.repo_dir,
-                        branch=self.branch_name,
-                        depth=self.depth,
-                        progress=progress,
-                    )
-                except Exception as e:
-                    progress.queue.put(e)
-                finally:
-                    progress.queue.put(None)
-
-        threading.Thread(target=clone_task).start()
-        # TODO: add configurable timeout
-        # timeout = 60
-
-        while True:
-            item = progress.queue.get(True)  # , timeout)
-            if item is None:
-                break
-            yield item
-
-        logging.info("Repo {} initialized".format(self.repo_dir))
-
-    def update(self):
-        with git_credentials(token=self._token, account=self._account):
-            yield from super().update()
+    @property
+    def cancelled(self) -> bool:
+        return self.error is not None
+
+    def cancel(self, error: Optional[Exception] = None):
+        with self._lock:
+            if self.error is None:
+                self.error = error or PullCancelledError("Pull cancelled")
+            processes = list(self._processes)
+        for process in processes:
+            _kill_process_group(process)
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+    @contextmanager
+    def track(self, process: subprocess.Popen):
+        with self._lock:
+            self._processes.add(process)
+            cancelled = self.cancelled
+        if cancelled:
+            _kill_process_group(process)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._processes.discard(process)
 
 
 class Update(TypedDict):
@@ -113,35 +204,208 @@ class Update(TypedDict):
     message: str
 
 
-class SyncHandlerBase(JupyterHandler):
+class ProgressEvent(NamedTuple):
+    id: int
+    message: dict
+
+
+class ActivePull(NamedTuple):
+    exhibit_id: int
+    # resolves to True if the pull succeeded
+    task: asyncio.Task
+    cancellation: PullCancellation
+
+
+def _to_message(exhibit_id: int, progress) -> dict:
+    if progress is None:
+        return {"phase": "finished", "exhibit_id": exhibit_id}
+    if isinstance(progress, dict):
+        return {
+            "output": progress,
+            "phase": "progress",
+            "exhibit_id": exhibit_id,
+        }
+    if isinstance(progress, PullCancelledError):
+        return {
+            "phase": "cancelled",
+            "exhibit_id": exhibit_id,
+            "message": str(progress),
+        }
+    if isinstance(progress, Exception):
+        return {
+            "phase": "error",
+            "exhibit_id": exhibit_id,
+            "message": str(progress),
+            "output": "\n".join(
+                [
+                    line.strip()
+                    for line in traceback.format_exception(
+                        type(progress), progress, progress.__traceback__
+                    )
+                ]
+            ),
+        }
+    return {
+        "output": progress,
+        "phase": "syncing",
+        "exhibit_id": exhibit_id,
+    }
+
+
+class ProgressBus:
+    """Fan out pull progress to the connected event streams.
+
+    Progress is published as `Update`, a text line, an exception or
+    `None` (once the pull finished). Every event gets a monotonically
+    increasing id and the last `history_size` events of each exhibit
+    are kept, so that a reconnecting client can resume after the id it
+    received last. Each subscriber gets its own bounded queue; when a
+    slow subscriber lets its queue fill up the oldest event is dropped.
+    Nothing runs while there is nothing to publish.
+
+    Histories of at most `max_keys` exhibits or
+    batches are kept, for `ttl` seconds after their last event.
+    """
+
+    def __init__(
+        self,
+        max_queue_size: int = 1000,
+        history_size: int = 100,
+        max_keys: int = 1000,
+        ttl: Optional[float] = 3600,
+    ):
+        self.max_queue_size = max_queue_size
+        self.history_size = history_size
+        # keyed by exhibit id, or ("batch", batch id) for batch results
+        self._history: StateStore[Union[int, tuple], deque[ProgressEvent]] = StateStore(
+            max_keys, ttl=ttl
+        )
+        self._last_id = 0
+        self._subscribers: set[asyncio.Queue] = set()
+        PROGRESS_QUEUE_DEPTH.set_function(self.queued_messages)
+
+    def queued_messages(self) -> int:
+        return sum(queue.qsize() for queue in self._subscribers)
+
+    def publish(self, exhibit_id: int, progress):
+        """Publish progress; must be called from the event loop."""
+        self._publish(exhibit_id, _to_message(exhibit_id, progress))
+
+    def publish_batch_result(self, batch_id: int, msg: dict):
+        """Publish the aggregate result of a batch of pulls."""
+        self._publish(("batch", batch_id), msg)
+
+    def publish_exhibits_changed(self, version: int):
+        """Notify clients that the configured exhibits changed."""
+        self._publish(("exhibits",), {"phase": "exhibits-changed", "version": version})
+
+    def _publish(self, key, msg: dict):
+        self._last_id += 1
+        event = ProgressEvent(id=self._last_id, message=msg)
+        history = self._history.get(key) or deque(maxlen=self.history_size)
+        history.append(event)
+        # (re-)setting the history postpones its expiry
+        self._history[key] = history
+        for queue in self._subscribers:
+            self._put(queue, event)
+
+    def subscribe(self, last_event_id: Optional[int] = None) -> asyncio.Queue:
+        """Subscribe to events published after `last_event_id`.
+
+        Without `last_event_id` (or if it comes from before a server restart)
+        only the latest event of each exhibit is replayed.
+        """
+        if last_event_id is not None and last_event_id <= self._last_id:
+            replay = sorted(
+                event
+                for history in self._history.values()
+                for event in history
+                if event.id > last_event_id
+            )
+        else:
+            replay = sorted(history[-1] for history in self._history.values())
+        queue = asyncio.Queue(maxsize=self.max_queue_size)
+        for event in replay:
+            self._put(queue, event)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        if queue in self._subscribers:
+            self._subscribers.discard(queue)
+            # wake up the reader so that it can stop
+            self._put(queue, None)
+
+    def _put(self, queue: asyncio.Queue, event: Optional[ProgressEvent]):
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(event)
+
+
+class PullMixin:
+    """Pulls coordinated through the server-wide state in `settings`.
+
+    Used by the pull handlers, as well as outside of requests (prefetching).
+    """
+
+    settings: dict
+
+    # number of pulls which may run at the same time, server-wide
+    max_concurrent_pulls = 1
+    # minimum seconds and progress fraction between two progress events
+    progress_min_interval = 0.1
+    progress_min_delta = 0.01
+    # number of events kept for each exhibit to replay on reconnection
+    progress_history_size = 100
+    # number of exhibits for which progress is kept and for how long
+    progress_state_max_size = 1000
+    progress_state_ttl = 3600
+    # number of timelines of recent operations kept, and seconds
+    # from which an operation is logged with its timeline
+    timeline_history_size = 100
+    slow_operation_threshold = 10.0
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        if "pull_status_queues" not in self.settings:
-            self.settings["pull_status_queues"] = defaultdict(Queue)
-
-        if "last_message" not in self.settings:
-            self.settings["last_message"] = {}
+        if "progress_bus" not in self.settings:
+            self.settings["progress_bus"] = ProgressBus(
+                history_size=self.progress_history_size,
+                max_keys=self.progress_state_max_size,
+                ttl=self.progress_state_ttl,
+            )
 
-        # We use this lock to make sure that only one sync operation
-        # can be happening at a time. Git doesn't like concurrent use!
-        if "git_lock" not in self.settings:
-            self.settings["git_lock"] = locks.Lock()
+        # Git does not like concurrent use of the same repository,
+        # but different repositories can be pulled in parallel;
+        # we lock each repository directory separately and only
+        # limit the total number of pulls.
+        if "repo_locks" not in self.settings:
+            self.settings["repo_locks"] = KeyedLocks()
+
+        if "timelines" not in self.settings:
+            self.settings["timelines"] = TimelineLog(
+                max_size=self.timeline_history_size,
+                slow_threshold=self.slow_operation_threshold,
+            )
 
-        if "enqueue_task" not in self.settings:
-            task = asyncio.create_task(self._enqueue_messages())
-            self.settings["enqueue_task"] = task
-            task.add_done_callback(lambda task: self.settings.pop("enqueue_task"))
+        if "active_pulls" not in self.settings:
+            self.settings["active_pulls"] = {}
 
-    def get_login_url(self):
-        # raise on failed auth, not redirect
-        # can't redirect EventStream to login
-        # same as Jupyter's APIHandler
-        raise web.HTTPError(403)
+        if "pull_semaphore" not in self.settings:
+            self.settings["pull_semaphore"] = asyncio.Semaphore(
+                self.max_concurrent_pulls
+            )
 
     @property
-    def git_lock(self):
-        return self.settings["git_lock"]
+    def progress_bus(self) -> ProgressBus:
+        return self.settings["progress_bus"]
+
+    def on_pull_finished(self, exhibit_id: int, succeeded: bool):
+        """Called once a pull completed, whether it succeeded or not."""
+
+    def repo_lock(self, repo_dir: str):
+        """Context manager holding the lock of the repository in `repo_dir`."""
+        return self.settings["repo_locks"].hold(os.path.realpath(repo_dir))
 
     async def _pull(
         self,
@@ -152,117 +416,248 @@ class SyncHandlerBase(JupyterHandler):
         account: Optional[str],
         branch: Optional[str],
         depth: Optional[int],
-    ):
-        q = self.settings["pull_status_queues"][exhibit_id]
-        try:
-            q.put_nowait(Update(progress=0.01, message="Waiting for a lock"))
-            await self.git_lock.acquire(5)
-            q.put_nowait(Update(progress=0.02, message="Lock acquired"))
-        except gen.TimeoutError:
-            q.put_nowait(
-                gen.TimeoutError(
-                    "Another git operations is currently running, try again in a few minutes"
+        reference: Optional[str] = None,
+        dissociate: bool = False,
+        filter_spec: Optional[str] = None,
+        sparse_paths: Optional[list[str]] = None,
+        timeout: Optional[float] = None,
+        connect_timeout: Optional[float] = None,
+        snapshot: Optional[str] = None,
+    ) -> Optional[asyncio.Task]:
+        """Start pulling the repository in the background.
+
+        Returns the task performing the pull (resolving to whether it
+        succeeded) or None if the directory is being pulled for another exhibit.
+        The pull fails if it takes longer than `timeout` seconds (excluding
+        time waiting for other pulls) or if git does not connect to the remote
+        within `connect_timeout` seconds. A new clone is restored from
+        `snapshot` (a git bundle or a tarball of a clone) if given.
+        """
+        bus = self.progress_bus
+        # The default working directory is the directory from which Jupyter
+        # server is launched, which is not the same as the root notebook
+        # directory assuming either --notebook-dir= is used from the
+        # command line or c.NotebookApp.notebook_dir is set in the jupyter
+        # configuration. This line assures that all repos are cloned
+        # relative to server_root_dir/<optional NBGITPULLER_PARENTPATH>,
+        # so that all repos are always in scope after cloning. Sometimes
+        # server_root_dir will include things like `~` and so the path
+        # must be expanded.
+        repo_parent_dir = os.path.join(
+            os.path.expanduser(self.settings["server_root_dir"]),
+            os.getenv("NBGITPULLER_PARENTPATH", ""),
+        )
+        repo_dir = os.path.join(repo_parent_dir, targetpath or repo.split("/")[-1])
+
+        active_pulls = self.settings["active_pulls"]
+        resolved_dir = os.path.realpath(repo_dir)
+        if resolved_dir in active_pulls:
+            active_pull = active_pulls[resolved_dir]
+            if active_pull.exhibit_id != exhibit_id:
+                bus.publish(
+                    exhibit_id,
+                    RuntimeError(
+                        f"{targetpath} is currently being pulled for another exhibit"
+                    ),
                 )
+                return None
+            # the client joins the progress stream of the running pull
+            return active_pull.task
+
+        exhibit_label = os.path.basename(resolved_dir)
+        cancellation = PullCancellation()
+
+        async def run_pull() -> bool:
+            semaphore = self.settings["pull_semaphore"]
+            operation = "pull" if os.path.exists(repo_dir) else "clone"
+            succeeded = False
+            timeline = Timeline(operation, exhibit_label)
+            timeline.mark("queued")
+            output = OutputCoalescer(
+                partial(bus.publish, exhibit_id),
+                min_interval=self.progress_min_interval,
             )
-            return
-
-        try:
-            # The default working directory is the directory from which Jupyter
-            # server is launched, which is not the same as the root notebook
-            # directory assuming either --notebook-dir= is used from the
-            # command line or c.NotebookApp.notebook_dir is set in the jupyter
-            # configuration. This line assures that all repos are cloned
-            # relative to server_root_dir/<optional NBGITPULLER_PARENTPATH>,
-            # so that all repos are always in scope after cloning. Sometimes
-            # server_root_dir will include things like `~` and so the path
-            # must be expanded.
-            repo_parent_dir = os.path.join(
-                os.path.expanduser(self.settings["server_root_dir"]),
-                os.getenv("NBGITPULLER_PARENTPATH", ""),
+            try:
+                if self.settings["repo_locks"].locked(resolved_dir) or (
+                    semaphore.locked()
+                ):
+                    output.publish(
+                        Update(
+                            progress=0.01, message="Waiting for other pulls to finish"
+                        ),
+                    )
+                waiting_since = time.monotonic()
+                async with semaphore, self.repo_lock(repo_dir):
+                    LOCK_WAIT_DURATION.labels(exhibit_label).observe(
+                        time.monotonic() - waiting_since
+                    )
+                    output.publish(Update(progress=0.02, message="Lock acquired"))
+                    timeline.mark("start")
+
+                    def pull():
+                        timer = None
+                        if timeout:
+                            timer = threading.Timer(
+                                timeout,
+                                cancellation.cancel,
+                                [
+                                    PullTimeoutError(
+                                        f"Pull did not complete within {timeout} seconds"
+                                    )
+                                ],
+                            )
+                            timer.start()
+                        try:
+                            pull_with_progress()
+                        finally:
+                            if timer:
+                                timer.cancel()
+
+                    def pull_with_progress():
+                        # GitPython and nbgitpuller are only imported when needed
+                        from .puller import ProgressGitPuller
+
+                        gp = ProgressGitPuller(
+                            repo,
+                            repo_dir,
+                            branch=branch,
+                            depth=depth,
+                            parent=self.settings["nbapp"],
+                            # our additions
+                            token=token,
+                            account=account,
+                            progress_min_interval=self.progress_min_interval,
+                            progress_min_delta=self.progress_min_delta,
+                            reference=reference,
+                            dissociate=dissociate,
+                            filter_spec=filter_spec,
+                            sparse_paths=sparse_paths,
+                            cancellation=cancellation,
+                            connect_timeout=connect_timeout,
+                            snapshot=snapshot,
+                            timeline=timeline,
+                        )
+                        updates = gp.pull()
+                        try:
+                            for update in updates:
+                                cancellation.check()
+                                output.publish_threadsafe(update)
+                        finally:
+                            # lets the puller clean up an interrupted update
+                            # while the repository is still locked
+                            updates.close()
+
+                    # once started, the pull thread is stopped through `cancellation`
+                    cancellation.started = True
+                    with GIT_OPERATION_DURATION.labels(operation, exhibit_label).time():
+                        await asyncio.get_running_loop().run_in_executor(None, pull)
+                # Sentinel when we're done
+                output.publish(None)
+                succeeded = True
+                return True
+            except asyncio.CancelledError:
+                if not cancellation.cancelled:
+                    raise
+                # cancelled while waiting for other pulls
+                output.publish(cancellation.error)
+                return False
+            except PullCancelledError as e:
+                output.publish(e)
+                return False
+            except Exception as e:
+                GIT_OPERATION_FAILURES.labels(operation, exhibit_label).inc()
+                output.publish(e)
+                return False
+            finally:
+                del active_pulls[resolved_dir]
+                if succeeded:
+                    timeline.finish("succeeded")
+                elif isinstance(cancellation.error, PullCancelledError):
+                    timeline.finish("cancelled")
+                else:
+                    timeline.finish("failed")
+                self.settings["timelines"].record(timeline)
+                self.on_pull_finished(exhibit_id, succeeded)
+
+        task = asyncio.create_task(run_pull())
+        active_pulls[resolved_dir] = ActivePull(
+            exhibit_id=exhibit_id, task=task, cancellation=cancellation
+        )
+        self.settings.setdefault("pull_tasks", set()).add(task)
+        task.add_done_callback(self.settings["pull_tasks"].discard)
+        return task
+
+    def _cancel_pull(self, exhibit_id: int) -> bool:
+        """Cancel the running pull of the exhibit; False if there is none.
+
+        Git processes are killed, a partial clone is removed and the
+        `cancelled` phase is published once the pull stopped.
+        """
+        for active_pull in self.settings["active_pulls"].values():
+            if active_pull.exhibit_id != exhibit_id:
+                continue
+            active_pull.cancellation.cancel()
+            if not active_pull.cancellation.started:
+                active_pull.task.cancel()
+            return True
+        return False
+
+    def _pull_batch(self, pulls: dict[int, dict], parallelism: int) -> int:
+        """Pull many exhibits, at most `parallelism` at a time.
+
+        `pulls` maps exhibit ids to keyword arguments of `_pull`. Progress of
+        each exhibit is published as usual and once all pulls completed
+        a single `batch-finished` event is published. Returns the batch id.
+        """
+        batch_id = self.settings["batch_counter"] = (
+            self.settings.get("batch_counter", 0) + 1
+        )
+        semaphore = asyncio.Semaphore(parallelism)
+
+        async def run_one(exhibit_id: int, options: dict) -> bool:
+            async with semaphore:
+                task = await self._pull(exhibit_id=exhibit_id, **options)
+                return task is not None and await task
+
+        async def run_batch():
+            exhibit_ids = list(pulls)
+            results = await asyncio.gather(
+                *[run_one(exhibit_id, pulls[exhibit_id]) for exhibit_id in exhibit_ids]
             )
-            repo_dir = os.path.join(repo_parent_dir, targetpath or repo.split("/")[-1])
-
-            gp = ProgressGitPuller(
-                repo,
-                repo_dir,
-                branch=branch,
-                depth=depth,
-                parent=self.settings["nbapp"],
-                # our additions
-                token=token,
-                account=account,
+            self.progress_bus.publish_batch_result(
+                batch_id,
+                {
+                    "phase": "batch-finished",
+                    "batch_id": batch_id,
+                    "succeeded": [i for i, ok in zip(exhibit_ids, results) if ok],
+                    "failed": [i for i, ok in zip(exhibit_ids, results) if not ok],
+                },
             )
 
-            def pull():
-                try:
-                    for update in gp.pull():
-                        q.put_nowait(update)
-                    # Sentinel when we're done
-                    q.put_nowait(None)
-                except Exception as e:
-                    raise e
-
-            self.gp_thread = threading.Thread(target=pull)
-            self.gp_thread.start()
-        except Exception as e:
-            q.put_nowait(e)
-        finally:
-            self.git_lock.release()
+        task = asyncio.create_task(run_batch())
+        self.settings.setdefault("pull_tasks", set()).add(task)
+        task.add_done_callback(self.settings["pull_tasks"].discard)
+        return batch_id
+
+
+class SyncHandlerBase(PullMixin, JupyterHandler):
+    def get_login_url(self):
+        # raise on failed auth, not redirect
+        # can't redirect EventStream to login
+        # same as Jupyter's APIHandler
+        raise web.HTTPError(403)
 
-    async def emit(self, data: dict):
+    async def emit(self, data: dict, event_id: Optional[int] = None):
         serialized_data = json.dumps(data)
+        if event_id is not None:
+            self.write("id: {}\n".format(event_id))
         self.write("data: {}\n\n".format(serialized_data))
         await self.flush()
 
-    async def _enqueue_messages(self):
-        last_message = self.settings["last_message"]
-        queues = self.settings["pull_status_queues"]
-        while True:
-            empty_queues = 0
-            # copy to avoid error due to size change during iteration:
-            queues_view = queues.copy()
-            for exhibit_id, q in queues_view.items():
-                # try to consume next message
-                try:
-                    progress = q.get_nowait()
-                except Empty:
-                    empty_queues += 1
-                    continue
-
-                if progress is None:
-                    msg = {"phase": "finished", "exhibit_id": exhibit_id}
-                    del self.settings["pull_status_queues"][exhibit_id]
-                elif isinstance(progress, dict):
-                    msg = {
-                        "output": progress,
-                        "phase": "progress",
-                        "exhibit_id": exhibit_id,
-                    }
-                elif isinstance(progress, Exception):
-                    msg = {
-                        "phase": "error",
-                        "exhibit_id": exhibit_id,
-                        "message": str(progress),
-                        "output": "\n".join(
-                            [
-                                line.strip()
-                                for line in traceback.format_exception(
-                                    type(progress), progress, progress.__traceback__
-                                )
-                            ]
-                        ),
-                    }
-                else:
-                    msg = {
-                        "output": progress,
-                        "phase": "syncing",
-                        "exhibit_id": exhibit_id,
-                    }
-
-                last_message[exhibit_id] = msg
-
-            if empty_queues == len(queues_view):
-                await gen.sleep(0.1)
+    def on_connection_close(self):
+        subscription = getattr(self, "_subscription", None)
+        if subscription is not None:
+            self.progress_bus.unsubscribe(subscription)
 
     async def _stream(self):
         # We gonna send out event streams!
@@ -272,32 +667,31 @@ class SyncHandlerBase(JupyterHandler):
         # https://bugzilla.mozilla.org/show_bug.cgi?id=833462
         await self.emit({"phase": "connected"})
 
-        last_message = self.settings["last_message"]
-        last_message_sent = {}
-
-        # stream new messages as they are put on respective queues
-        while True:
-            messages_view = last_message.copy()
-            unchanged = 0
-            for exhibit_id, msg in messages_view.items():
-                # emit an update if anything changed
-                if last_message_sent.get(exhibit_id) == msg:
-                    unchanged += 1
-                    continue
-                last_message_sent[exhibit_id] = msg
-                try:
-                    await self.emit(msg)
-                except StreamClosedError as e:
-                    # this is expected to happen whenever client closes (e.g. user
-                    # closes the browser or refreshes the tab with JupterLab)
-                    if e.real_error:
-                        self.warn.info(
-                            f"git puller stream got closed with error {e.real_error}"
-                        )
-                    else:
-                        self.log.info("git puller stream closed")
-                    # return to stop reading messages, so that the next
-                    # client who connects can consume them
+        # sent by clients reconnecting to the stream
+        last_event_id = self.request.headers.get("Last-Event-ID")
+        try:
+            last_event_id = int(last_event_id) if last_event_id else None
+        except ValueError:
+            last_event_id = None
+
+        self._subscription = self.progress_bus.subscribe(last_event_id)
+        EVENT_STREAMS.inc()
+        try:
+            # stream new messages as they are published
+            while True:
+                event = await self._subscription.get()
+                if event is None:
                     return
-            if unchanged == len(messages_view):
-                await gen.sleep(0.1)
+                await self.emit(event.message, event_id=event.id)
+        except StreamClosedError as e:
+            # this is expected to happen whenever client closes (e.g. user
+            # closes the browser or refreshes the tab with JupterLab)
+            if e.real_error:
+                self.log.warning(
+                    f"git puller stream got closed with error {e.real_error}"
+                )
+            else:
+                self.log.info("git puller stream closed")
+        finally:
+            EVENT_STREAMS.dec()
+            self.progress_bus.unsubscribe(self._subscription)
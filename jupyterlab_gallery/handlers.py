@@ -1,9 +1,14 @@
+import base64
+import binascii
+import hashlib
 import json
-from typing import cast
+from typing import Optional, cast
 
-from jupyter_server.base.handlers import APIHandler
-from .gitpuller import SyncHandlerBase
+from jupyter_server.base.handlers import APIHandler, JupyterHandler
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from .gitpuller import PullMixin, SyncHandlerBase
 from .manager import GalleryManager
+from .metrics import REGISTRY
 import tornado
 
 
@@ -11,6 +16,17 @@ import tornado
 # we want an allow-list over block-list to avoid exposing PAT in case
 # if the author of the config makes a typo like `giit` instead of `git`.
 EXPOSED_EXHIBIT_KEYS = ["homepage", "title", "description", "icon"]
+# fields computed by the gallery manager (some from the filesystem)
+EXHIBIT_DATA_KEYS = [
+    "icon",
+    "localPath",
+    "prefetching",
+    "isCloned",
+    "lastUpdated",
+    "updatesAvailable",
+]
+# arguments selecting a page of exhibits rather than all of them
+PAGE_ARGUMENTS = ["q", "cloned", "updates_available", "fields", "limit", "cursor"]
 
 
 class BaseHandler(APIHandler):
@@ -28,6 +44,7 @@ class GalleryHandler(BaseHandler):
                     "title": self.gallery_manager.title,
                     "exhibitsConfigured": len(self.gallery_manager.exhibits) != 0,
                     "hideGalleryWithoutExhibits": self.gallery_manager.hide_gallery_without_exhibits,
+                    "prefetching": self.gallery_manager.prefetching,
                     "apiVersion": "1.0",
                 }
             )
@@ -35,20 +52,168 @@ class GalleryHandler(BaseHandler):
 
 
 class ExhibitsHandler(BaseHandler):
+    """All exhibits, or a page of these matching the query arguments.
+
+    - `q`: words which titles or descriptions must contain (as word prefixes)
+    - `cloned`, `updates_available`: `true` or `false` to filter by state
+    - `fields`: comma-separated fields to return (`id` is always returned)
+    - `limit`: maximum number of exhibits; `next_cursor` in the reply
+      is passed as `cursor` to get the next page (null on the last page)
+
+    The state of exhibits (which requires filesystem checks) is only
+    computed for exhibits which are considered for the page.
+    """
+
     @tornado.web.authenticated
-    def get(self):
-        self.finish(
-            json.dumps(
-                {
-                    "exhibits": [
-                        self._prepare_exhibit(exhibit_config, exhibit_id=i)
-                        for i, exhibit_config in enumerate(
-                            self.gallery_manager.exhibits
-                        )
-                    ]
-                }
+    async def get(self):
+        manager = self.gallery_manager
+        paged = any(
+            self.get_argument(name, None) is not None for name in PAGE_ARGUMENTS
+        )
+        if not paged:
+            manager.validate_exhibit_data()
+
+        # long polling: wait until the state changes from the version the client has
+        after_version = self.get_argument("after_version", None)
+        if after_version is not None:
+            try:
+                after_version = int(after_version)
+            except ValueError:
+                raise tornado.web.HTTPError(400, "after_version must be an integer")
+            await manager.wait_for_state_change(
+                after_version, timeout=manager.exhibits_long_poll_timeout
             )
+
+        if paged:
+            body = json.dumps(self._get_page())
+            etag = '"' + hashlib.sha1(body.encode("utf-8")).hexdigest() + '"'
+        else:
+            body, etag = self._get_response()
+        self.set_header("ETag", etag)
+        if self.check_etag_header():
+            self.set_status(304)
+            self.finish()
+            return
+        self.finish(body)
+
+    def _get_response(self) -> tuple[str, str]:
+        version = self.gallery_manager.state_version
+        cached = self.settings.get("exhibits_response")
+        if cached and cached[0] == version:
+            return cached[1:]
+        body = json.dumps(
+            {
+                "exhibits": [
+                    self._prepare_exhibit(exhibit_config, exhibit_id=i)
+                    for i, exhibit_config in self.gallery_manager.get_exhibits().items()
+                ],
+                "version": version,
+            }
         )
+        etag = '"' + hashlib.sha1(body.encode("utf-8")).hexdigest() + '"'
+        self.settings["exhibits_response"] = (version, body, etag)
+        return body, etag
+
+    def _get_bool_argument(self, name: str) -> Optional[bool]:
+        value = self.get_argument(name, None)
+        if value is None:
+            return None
+        if value not in ("true", "false"):
+            raise tornado.web.HTTPError(400, f"{name} must be true or false")
+        return value == "true"
+
+    def _get_page(self) -> dict:
+        manager = self.gallery_manager
+        cloned = self._get_bool_argument("cloned")
+        updates_available = self._get_bool_argument("updates_available")
+        fields = self.get_argument("fields", None)
+        if fields is not None:
+            fields = set(fields.split(",")) - {"id"}
+            unknown = fields - set(EXPOSED_EXHIBIT_KEYS) - set(EXHIBIT_DATA_KEYS)
+            if unknown:
+                raise tornado.web.HTTPError(
+                    400, f"Unknown fields: {', '.join(sorted(unknown))}"
+                )
+        try:
+            limit = int(self.get_argument("limit", 0))
+        except ValueError:
+            limit = -1
+        if limit < 0:
+            raise tornado.web.HTTPError(400, "limit must be a positive integer")
+        # version before computing the data, so that clients never miss a change
+        version = manager.state_version
+
+        exhibits = manager.get_exhibits()
+        exhibit_ids = list(exhibits)
+        query = self.get_argument("q", "")
+        if query:
+            matches = manager.search_index.search(query)
+            exhibit_ids = [i for i in exhibit_ids if i in matches]
+        start = self._decode_cursor(exhibit_ids)
+
+        state_filtered = cloned is not None or updates_available is not None
+        needs_data = (
+            fields is None or not fields.isdisjoint(EXHIBIT_DATA_KEYS) or state_filtered
+        )
+        page = []
+        next_cursor = None
+        last_position = start
+        for position in range(start, len(exhibit_ids)):
+            exhibit_id = exhibit_ids[position]
+            exhibit = exhibits[exhibit_id]
+            page_full = limit and len(page) == limit
+            if page_full and not state_filtered:
+                # any remaining exhibit is on the next page, no need for its state
+                next_cursor = self._encode_cursor(page[-1]["id"], last_position)
+                break
+            data = {}
+            if needs_data:
+                manager.validate_exhibit_data([exhibit])
+                data = manager.get_exhibit_data(exhibit)
+            if cloned is not None and data["isCloned"] != cloned:
+                continue
+            if (
+                updates_available is not None
+                and data.get("updatesAvailable") is not updates_available
+            ):
+                continue
+            if page_full:
+                next_cursor = self._encode_cursor(page[-1]["id"], last_position)
+                break
+            prepared = {
+                **{k: v for k, v in exhibit.items() if k in EXPOSED_EXHIBIT_KEYS},
+                **data,
+                "id": exhibit_id,
+            }
+            if fields is not None:
+                prepared = {
+                    k: v for k, v in prepared.items() if k in fields or k == "id"
+                }
+            page.append(prepared)
+            last_position = position
+        return {"exhibits": page, "version": version, "next_cursor": next_cursor}
+
+    @staticmethod
+    def _encode_cursor(after_id: int, position: int) -> str:
+        cursor = json.dumps({"after": after_id, "position": position})
+        return base64.urlsafe_b64encode(cursor.encode("utf-8")).decode("ascii")
+
+    def _decode_cursor(self, exhibit_ids: list[int]) -> int:
+        """Position in `exhibit_ids` at which the page given by `cursor` starts."""
+        cursor = self.get_argument("cursor", None)
+        if not cursor:
+            return 0
+        try:
+            decoded = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+            after_id, position = int(decoded["after"]), int(decoded["position"])
+        except (binascii.Error, ValueError, KeyError, TypeError):
+            raise tornado.web.HTTPError(400, "Invalid cursor")
+        # continue after the last exhibit of the previous page, even if
+        # exhibits were added or removed before it in the meantime;
+        # if it was removed, its successor took its position
+        if after_id in exhibit_ids:
+            return exhibit_ids.index(after_id) + 1
+        return min(position, len(exhibit_ids))
 
     def _prepare_exhibit(self, exhibit, exhibit_id: int) -> dict:
         exposed_config = {k: v for k, v in exhibit.items() if k in EXPOSED_EXHIBIT_KEYS}
@@ -59,34 +224,194 @@ class ExhibitsHandler(BaseHandler):
         }
 
 
-class PullHandler(BaseHandler, SyncHandlerBase):
-    @tornado.web.authenticated
-    async def post(self):
-        data = self.get_json_body()
-        exhibit_id = data["exhibit_id"]
-        try:
-            exhibit = self.gallery_manager.exhibits[exhibit_id]
-        except IndexError:
-            self.set_status(406)
-            self.finish(json.dumps({"message": f"exhibit_id {exhibit_id} not found"}))
+class GalleryPullMixin(PullMixin):
+    """Pull settings and hooks taken from the gallery manager."""
+
+    gallery_manager: GalleryManager
+
+    @property
+    def max_concurrent_pulls(self) -> int:
+        return self.gallery_manager.max_concurrent_pulls
+
+    def on_pull_finished(self, exhibit_id: int, succeeded: bool):
+        exhibit = self.gallery_manager.get_exhibit(exhibit_id)
+        if exhibit is None:
+            # removed from the configuration while being pulled
+            self.gallery_manager.invalidate_exhibit_data()
             return
+        if succeeded:
+            self.gallery_manager.record_pull(exhibit)
+        # also invalidates the cached exhibit data
+        self.gallery_manager.set_prefetching(
+            self.gallery_manager.get_local_path(exhibit), False
+        )
+
+    @property
+    def progress_min_interval(self) -> float:
+        return self.gallery_manager.progress_min_interval
+
+    @property
+    def progress_min_delta(self) -> float:
+        return self.gallery_manager.progress_min_delta
+
+    @property
+    def progress_history_size(self) -> int:
+        return self.gallery_manager.progress_history_size
+
+    @property
+    def progress_state_max_size(self) -> int:
+        return self.gallery_manager.state_max_size
 
+    @property
+    def progress_state_ttl(self) -> float:
+        return self.gallery_manager.progress_state_ttl
+
+    def _pull_options(self, exhibit) -> dict:
         branch = exhibit.get("branch")
         depth = exhibit.get("depth")
 
         if depth:
             depth = int(depth)
 
-        return await super()._pull(
+        return dict(
             repo=exhibit["git"],
             targetpath=str(self.gallery_manager.get_local_path(exhibit)),
-            exhibit_id=exhibit_id,
             account=exhibit.get("account"),
             token=exhibit.get("token"),
             branch=branch,
             depth=depth,
+            reference=self.gallery_manager.get_shared_cache_path(exhibit),
+            dissociate=self.gallery_manager.shared_cache_dissociate,
+            filter_spec=exhibit.get("filter"),
+            sparse_paths=exhibit.get("sparse_paths"),
+            snapshot=self.gallery_manager.get_snapshot_path(exhibit),
+            # 0 disables the timeout for the exhibit
+            timeout=(
+                self.gallery_manager.pull_timeout
+                if exhibit.get("timeout") is None
+                else exhibit["timeout"]
+            ),
+            connect_timeout=(
+                self.gallery_manager.pull_connect_timeout
+                if exhibit.get("connect_timeout") is None
+                else exhibit["connect_timeout"]
+            ),
         )
 
+
+class GalleryPullHandlerBase(BaseHandler, GalleryPullMixin, SyncHandlerBase):
+    pass
+
+
+class PullHandler(GalleryPullHandlerBase):
+    @tornado.web.authenticated
+    async def post(self):
+        data = self.get_json_body()
+        exhibit_id = data["exhibit_id"]
+        exhibit = self.gallery_manager.get_exhibit(exhibit_id)
+        if exhibit is None:
+            self.set_status(406)
+            self.finish(json.dumps({"message": f"exhibit_id {exhibit_id} not found"}))
+            return
+
+        await super()._pull(exhibit_id=exhibit_id, **self._pull_options(exhibit))
+
     @tornado.web.authenticated
     async def get(self):
         return await super()._stream()
+
+    @tornado.web.authenticated
+    def delete(self):
+        try:
+            exhibit_id = int(self.get_argument("exhibit_id"))
+        except ValueError:
+            raise tornado.web.HTTPError(400, "exhibit_id must be an integer")
+        if not self._cancel_pull(exhibit_id):
+            self.set_status(404)
+            self.finish(
+                json.dumps({"message": f"exhibit {exhibit_id} is not being pulled"})
+            )
+            return
+        self.set_status(202)
+        self.finish(json.dumps({"exhibit_id": exhibit_id}))
+
+
+class BatchPullHandler(GalleryPullHandlerBase):
+    @tornado.web.authenticated
+    async def post(self):
+        data = self.get_json_body()
+        exhibit_ids = data["exhibit_ids"]
+        exhibits = self.gallery_manager.get_exhibits()
+        if exhibit_ids == "all":
+            exhibit_ids = list(exhibits)
+        missing = [
+            exhibit_id
+            for exhibit_id in exhibit_ids
+            if not isinstance(exhibit_id, int) or exhibit_id not in exhibits
+        ]
+        if missing:
+            self.set_status(406)
+            self.finish(json.dumps({"message": f"exhibit_ids {missing} not found"}))
+            return
+
+        batch_id = self._pull_batch(
+            {
+                exhibit_id: self._pull_options(exhibits[exhibit_id])
+                for exhibit_id in exhibit_ids
+            },
+            parallelism=self.gallery_manager.batch_pull_concurrency,
+        )
+        self.finish(json.dumps({"batch_id": batch_id, "exhibit_ids": exhibit_ids}))
+
+
+class IconHandler(JupyterHandler):
+    # icons do not change often, but may change upstream;
+    # browsers revalidate them using the content-hash ETag
+    max_age = 7 * 24 * 60 * 60
+
+    @tornado.web.authenticated
+    async def get(self, key: str):
+        manager = cast(GalleryManager, self.settings["gallery_manager"])
+        icon = await manager.get_icon(key)
+        if icon is None:
+            raise tornado.web.HTTPError(404)
+        self.set_header("Content-Type", icon.content_type)
+        self.set_header("ETag", icon.etag)
+        self.set_header("Cache-Control", f"private, max-age={self.max_age}")
+        # do not let SVG icons run scripts in the server origin
+        self.set_header("Content-Security-Policy", "default-src 'none'; sandbox")
+        if self.check_etag_header():
+            self.set_status(304)
+            self.finish()
+            return
+        self.finish(icon.data)
+
+
+class MetricsHandler(JupyterHandler):
+    @tornado.web.authenticated
+    def get(self):
+        self.set_header("Content-Type", CONTENT_TYPE_LATEST)
+        self.finish(generate_latest(REGISTRY))
+
+
+class TimelinesHandler(BaseHandler):
+    """Timelines of recent pulls and update checks, most recent first.
+
+    Optionally filtered by `operation` (clone, pull or update-check) and
+    by `min_duration` (in seconds).
+    """
+
+    @tornado.web.authenticated
+    def get(self):
+        operation = self.get_argument("operation", None)
+        try:
+            min_duration = float(self.get_argument("min_duration", 0))
+        except ValueError:
+            raise tornado.web.HTTPError(400, "min_duration must be a number")
+        timelines = [
+            timeline.to_dict()
+            for timeline in self.gallery_manager.timelines.recent()
+            if (operation is None or timeline.operation == operation)
+            and timeline.duration >= min_duration
+        ]
+        self.finish(json.dumps({"timelines": timelines}))
@@ -0,0 +1,184 @@
+# Icons of exhibits are resolved on the server (from local files, data URIs
+# or remote URLs), stored in a size-bounded disk cache and served by
+# `IconHandler`, so that browsers do not need access to the internet.
+
+import base64
+import hashlib
+import io
+import json
+import mimetypes
+import os
+from pathlib import Path
+from typing import NamedTuple, Optional
+from urllib.parse import unquote_to_bytes
+
+from tornado.httpclient import AsyncHTTPClient
+from traitlets import Float
+from traitlets.config.configurable import LoggingConfigurable
+
+from .state import atomic_write
+
+
+class Icon(NamedTuple):
+    data: bytes
+    content_type: str
+    etag: str
+
+
+class IconFetcher(LoggingConfigurable):
+    """Fetches remote icons.
+
+    Subclass and set `GalleryManager.icon_fetcher_class` to fetch icons
+    differently, e.g. from an internal mirror.
+    """
+
+    timeout = Float(
+        help="Number of seconds after which fetching a remote icon is abandoned",
+        default_value=10,
+        config=True,
+    )
+
+    async def fetch(self, url: str) -> tuple[bytes, Optional[str]]:
+        """Return the content of the icon and its content type (if known)."""
+        response = await AsyncHTTPClient().fetch(
+            url, connect_timeout=self.timeout, request_timeout=self.timeout
+        )
+        return response.body, response.headers.get("Content-Type")
+
+
+_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+]
+
+
+def sniff_content_type(data: bytes, fallback: Optional[str] = None) -> str:
+    """Guess the content type of an image from its first bytes."""
+    for signature, content_type in _SIGNATURES:
+        if data.startswith(signature):
+            return content_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    head = data[:1024].lstrip().lower()
+    if head.startswith(b"<svg") or (head.startswith(b"<?xml") and b"<svg" in head):
+        return "image/svg+xml"
+    if fallback:
+        return fallback.split(";")[0].strip()
+    return "application/octet-stream"
+
+
+def decode_data_uri(uri: str) -> tuple[bytes, Optional[str]]:
+    """Decode `data:[<media type>][;base64],<data>` URI."""
+    header, _, payload = uri[len("data:") :].partition(",")
+    parameters = header.split(";")
+    content_type = parameters[0] or None
+    if "base64" in parameters[1:]:
+        return base64.b64decode(payload), content_type
+    return unquote_to_bytes(payload), content_type
+
+
+def make_thumbnail(data: bytes, content_type: str, max_size: int) -> tuple[bytes, str]:
+    """Downscale raster images larger than `max_size` pixels (requires Pillow).
+
+    Vector images and images which cannot be processed are returned as-is.
+    """
+    if content_type == "image/svg+xml":
+        return data, content_type
+    try:
+        from PIL import Image
+    except ImportError:
+        return data, content_type
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if max(image.size) <= max_size:
+                return data, content_type
+            image.thumbnail((max_size, max_size))
+            output = io.BytesIO()
+            image.save(output, format="PNG")
+    except Exception:
+        return data, content_type
+    return output.getvalue(), "image/png"
+
+
+class IconCache:
+    """Size-bounded on-disk cache of icons, evicting least recently used first.
+
+    Each icon is stored as a data file with a metadata file next to it;
+    the modification time of the data file is the time of the last use.
+    """
+
+    def __init__(self, path: Path, max_bytes: int):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+
+    def _files(self, key: str) -> tuple[Path, Path]:
+        return self.path / key, self.path / f"{key}.json"
+
+    def get(self, key: str) -> Optional[Icon]:
+        data_path, meta_path = self._files(key)
+        try:
+            data = data_path.read_bytes()
+            meta = json.loads(meta_path.read_text())
+        except (OSError, ValueError):
+            return None
+        # mark as recently used
+        os.utime(data_path)
+        return Icon(data=data, content_type=meta["content_type"], etag=meta["etag"])
+
+    def put(self, key: str, data: bytes, content_type: str) -> Icon:
+        self.path.mkdir(parents=True, exist_ok=True)
+        icon = Icon(
+            data=data,
+            content_type=content_type,
+            etag='"' + hashlib.sha256(data).hexdigest() + '"',
+        )
+        data_path, meta_path = self._files(key)
+        # readers (possibly in other processes) never see partial files
+        atomic_write(
+            meta_path, json.dumps({"content_type": content_type, "etag": icon.etag})
+        )
+        atomic_write(data_path, data)
+        self.evict()
+        return icon
+
+    def evict(self):
+        """Remove least recently used icons until the cache fits in `max_bytes`."""
+        entries = []
+        total = 0
+        for data_path in self.path.iterdir():
+            if data_path.suffix == ".json" or data_path.name.startswith("."):
+                continue
+            try:
+                stat = data_path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, data_path))
+            total += stat.st_size
+        for _, size, data_path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            for path in self._files(data_path.name):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+            total -= size
+
+
+async def load_icon(
+    source: str, fetcher: IconFetcher, root_dir: Optional[str] = None
+) -> tuple[bytes, str]:
+    """Read the icon from a data URI, a remote URL or a local file."""
+    if source.startswith("data:"):
+        data, content_type = decode_data_uri(source)
+    elif source.startswith(("http://", "https://")):
+        data, content_type = await fetcher.fetch(source)
+    else:
+        path = Path(source).expanduser()
+        if root_dir and not path.is_absolute():
+            path = Path(root_dir).expanduser() / path
+        data = path.read_bytes()
+        content_type, _ = mimetypes.guess_type(path.name)
+    return data, sniff_content_type(data, fallback=content_type)
@@ -1,32 +1,119 @@
-from collections import defaultdict
+from collections import Counter
 from datetime import datetime
+import hashlib
+import json
+import os
 from pathlib import Path
-from typing import Optional
-from threading import Thread
+from typing import NamedTuple, Optional
+import asyncio
+import random
+import time
 
 from traitlets.config.configurable import LoggingConfigurable
-from traitlets import Dict, List, Unicode, Bool, Int
+from jupyter_server.utils import url_path_join
+from traitlets import (
+    Dict,
+    Enum,
+    List,
+    Unicode,
+    Bool,
+    Int,
+    Float,
+    Type,
+    default,
+    observe,
+)
 
 from .git_utils import (
+    AsyncGitRunner,
+    RemoteRefCache,
+    credentials_env,
     extract_repository_owner,
     extract_repository_name,
-    git_credentials,
-    has_updates,
+    check_remote_updates,
+    check_updates,
+)
+from .search import ExhibitIndex
+from .icons import Icon, IconCache, IconFetcher, load_icon, make_thumbnail
+from .state import KeyedLocks, StateStore, atomic_write
+from .timeline import Timeline, TimelineLog
+from .metrics import (
+    GIT_OPERATION_DURATION,
+    GIT_OPERATION_FAILURES,
+    UPDATE_CHECK_LAST_SUCCESS,
 )
 
 
-class GalleryManager(LoggingConfigurable):
-    _has_updates: dict[str, Optional[bool]] = defaultdict(lambda: None)
+class UpdateState(NamedTuple):
+    """Update status of a cloned exhibit."""
+
+    # None until checked
+    updates_available: Optional[bool] = None
+    # time (`time.monotonic`) after which the exhibit is checked again
+    next_check: float = 0
+    # time (`time.time`) of the last successful check and the remote head it saw
+    checked_at: Optional[float] = None
+    remote_sha: Optional[str] = None
+    # time (`time.time`) of the last successful pull
+    last_pulled: Optional[float] = None
 
+
+class GalleryManager(LoggingConfigurable):
     def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+        # set up the state first, as observers run when config is applied
         self._background_tasks = set()
+        self._update_checks_pending: set[Path] = set()
+        # by local path, bounded as exhibits may come and go with config reloads
+        self._update_states: StateStore[Path, UpdateState] = StateStore()
+        self._git_runner: Optional[AsyncGitRunner] = None
+        self._ref_cache: Optional[RemoteRefCache] = None
+        self._update_scheduler: Optional[asyncio.Task] = None
+        # set to run the scheduler early, e.g. when an exhibit gets cloned
+        self._update_scheduler_wakeup: Optional[asyncio.Event] = None
+        self._shared_cache_task: Optional[asyncio.Task] = None
+        self._maintenance_task: Optional[asyncio.Task] = None
+        # index of the repository to maintain first in the next round
+        self._maintenance_cursor = 0
+        # locks of repositories by resolved path, shared with the pull handlers
+        self.repo_locks: KeyedLocks[str] = KeyedLocks()
+        # cached exhibit data, invalidated by bumping the state version
+        self._exhibit_data: dict[tuple, dict] = {}
+        # ids of exhibits by their identity, kept when the list changes
+        self._exhibit_ids: dict[tuple, int] = {}
+        self._next_exhibit_id = 0
+        # built on first search after the exhibits change
+        self._search_index: Optional[ExhibitIndex] = None
+        self._state_version = 0
+        self._state_changed: Optional[asyncio.Event] = None
+        # local paths of exhibits being cloned or updated at startup
+        self._prefetching: set[Path] = set()
+        # icon sources by cache key, and when resolving them last failed
+        self._icon_sources: StateStore[str, str] = StateStore()
+        self._icon_failures: StateStore[str, bool] = StateStore(
+            ttl=self._icon_retry_delay
+        )
+        self._icon_locks: KeyedLocks[str] = KeyedLocks()
+        self._icon_fetcher: Optional[IconFetcher] = None
+        super().__init__(*args, **kwargs)
+        for store in [self._update_states, self._icon_sources, self._icon_failures]:
+            store.max_size = self.state_max_size
+        # timelines of recent pulls and update checks, shared with the pull handlers
+        self.timelines = TimelineLog(
+            max_size=self.timeline_history_size,
+            slow_threshold=self.slow_operation_threshold,
+            log=self.log,
+        )
 
     root_dir = Unicode(
         config=False,
         allow_none=True,
     )
 
+    base_url = Unicode(
+        config=False,
+        default_value="/",
+    )
+
     exhibits = List(
         Dict(
             per_key_traits={
@@ -55,7 +142,44 @@ class GalleryManager(LoggingConfigurable):
                 "depth": Int(
                     default_value=None, help="Depth of the clone", allow_none=True
                 ),
-                # other ideas: `path_in_repository`, `documentation_url`
+                "filter": Unicode(
+                    default_value=None,
+                    help="Partial clone filter, e.g. `blob:none` or `blob:limit=1m`;"
+                    " filtered out objects are downloaded when needed",
+                    allow_none=True,
+                ),
+                "sparse_paths": List(
+                    Unicode(),
+                    default_value=None,
+                    help="Directories to check out (sparse checkout); by default all files",
+                    allow_none=True,
+                ),
+                "snapshot": Unicode(
+                    default_value=None,
+                    help="Path of a git bundle or a tarball of a clone (absolute or"
+                    " relative to the server root) to restore the first clone from;"
+                    " changes made since are then fetched from `git`",
+                    allow_none=True,
+                ),
+                "timeout": Float(
+                    default_value=None,
+                    help="Seconds after which pulling the exhibit is abandoned"
+                    " (defaults to `pull_timeout`, 0 for no limit)",
+                    allow_none=True,
+                ),
+                "connect_timeout": Float(
+                    default_value=None,
+                    help="Seconds after which pulling is abandoned unless git connected"
+                    " to the remote (defaults to `pull_connect_timeout`, 0 for no limit)",
+                    allow_none=True,
+                ),
+                "prefetch_priority": Int(
+                    default_value=None,
+                    help="Clone or update the exhibit in the background when the server"
+                    " starts; exhibits with higher priority are prefetched first",
+                    allow_none=True,
+                ),
+                # other ideas: `documentation_url`
             }
         ),
         config=True,
@@ -69,6 +193,15 @@ class GalleryManager(LoggingConfigurable):
         config=True,
     )
 
+    state_file = Unicode(
+        help=(
+            "Name of the file (in the destination directory) keeping the update status"
+            " of exhibits across server restarts; empty to not keep it"
+        ),
+        default_value=".jupyterlab-gallery-state.json",
+        config=True,
+    )
+
     title = Unicode(
         help="The the display name of the Gallery widget",
         default_value="Gallery",
@@ -81,33 +214,655 @@ class GalleryManager(LoggingConfigurable):
         config=True,
     )
 
+    max_concurrent_pulls = Int(
+        help="Maximum number of exhibits which can be cloned or updated at the same time",
+        default_value=2,
+        config=True,
+    )
+
+    batch_pull_concurrency = Int(
+        help=(
+            "Maximum number of exhibits pulled at the same time by a single batch pull"
+            " (max_concurrent_pulls still applies)"
+        ),
+        default_value=2,
+        config=True,
+    )
+
+    prefetch_concurrency = Int(
+        help="Maximum number of exhibits prefetched at the same time when the server starts",
+        default_value=1,
+        config=True,
+    )
+
+    pull_timeout = Float(
+        help="Number of seconds after which a clone or update is abandoned (0 for no limit)",
+        default_value=3600,
+        config=True,
+    )
+
+    pull_connect_timeout = Float(
+        help=(
+            "Number of seconds after which a clone or update is abandoned"
+            " unless git connected to the remote (0 for no limit)"
+        ),
+        default_value=60,
+        config=True,
+    )
+
+    progress_min_interval = Float(
+        help="Minimum number of seconds between two progress events sent to clients",
+        default_value=0.1,
+        config=True,
+    )
+
+    progress_min_delta = Float(
+        help="Minimum progress (as a fraction from 0 to 1) between two progress events",
+        default_value=0.01,
+        config=True,
+    )
+
+    progress_history_size = Int(
+        help="Number of progress events kept for each exhibit to replay to reconnecting clients",
+        default_value=100,
+        config=True,
+    )
+
+    update_check_interval = Float(
+        help="Minimum number of seconds between update checks of a cloned exhibit",
+        default_value=300,
+        config=True,
+    )
+
+    update_check_jitter = Float(
+        help="Fraction of the interval added at random to spread update checks over time",
+        default_value=0.1,
+        config=True,
+    )
+
+    update_check_concurrency = Int(
+        help="Maximum number of update checks (git fetch) running at the same time",
+        default_value=4,
+        config=True,
+    )
+
+    update_check_timeout = Float(
+        help="Number of seconds after which a git command of an update check is killed",
+        default_value=60,
+        config=True,
+    )
+
+    update_check_method = Enum(
+        ["ls-remote", "fetch"],
+        help=(
+            "How to check for updates: `ls-remote` compares the remote branch head"
+            " with the local HEAD without downloading anything, `fetch` fetches"
+            " the branch and compares with it"
+        ),
+        default_value="ls-remote",
+        config=True,
+    )
+
+    update_check_ref_cache_ttl = Float(
+        help="Number of seconds for which branch heads of a remote (from ls-remote) are reused",
+        default_value=60,
+        config=True,
+    )
+
+    update_check_ref_cache_dir = Unicode(
+        help=(
+            "Directory in which branch heads of remotes are cached, to share them"
+            " between servers (e.g. of users on the same node)"
+        ),
+        default_value=None,
+        allow_none=True,
+        config=True,
+    )
+
+    shared_cache_dir = Unicode(
+        help=(
+            "Directory with bare mirrors of exhibit repositories (e.g. on storage shared"
+            " between users) which clones borrow objects from via --reference-if-able"
+        ),
+        default_value=None,
+        allow_none=True,
+        config=True,
+    )
+
+    shared_cache_dissociate = Bool(
+        help=(
+            "Copy objects borrowed from the shared cache into each clone so that clones"
+            " do not break if the cache is removed (saves network but not disk space)"
+        ),
+        default_value=False,
+        config=True,
+    )
+
+    shared_cache_refresh_interval = Float(
+        help=(
+            "Number of seconds between fetches updating the mirrors in the shared cache;"
+            " 0 disables updating the cache from this server"
+        ),
+        default_value=0,
+        config=True,
+    )
+
+    exhibits_long_poll_timeout = Float(
+        help="Maximum number of seconds a request waiting for exhibit state changes is held",
+        default_value=30,
+        config=True,
+    )
+
+    icon_proxy = Bool(
+        help=(
+            "Serve exhibit icons from the server (resolving and caching them once)"
+            " rather than letting browsers fetch them"
+        ),
+        default_value=True,
+        config=True,
+    )
+
+    icon_cache_dir = Unicode(
+        help="Directory in which icons served by the server are cached",
+        config=True,
+    )
+
+    @default("icon_cache_dir")
+    def _default_icon_cache_dir(self):
+        cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+        return os.path.join(cache_home, "jupyterlab-gallery", "icons")
+
+    icon_cache_max_bytes = Int(
+        help="Maximum total size of cached icons; least recently used are removed first",
+        default_value=50 * 1024 * 1024,
+        config=True,
+    )
+
+    icon_max_size = Int(
+        help=(
+            "Downscale raster icons larger than this many pixels (requires Pillow);"
+            " 0 keeps the original size"
+        ),
+        default_value=0,
+        config=True,
+    )
+
+    icon_fetcher_class = Type(
+        help="Class fetching remote icons",
+        default_value=IconFetcher,
+        klass=IconFetcher,
+        config=True,
+    )
+
+    # seconds before resolving an icon which failed is attempted again
+    _icon_retry_delay = 300
+
+    maintenance_interval = Float(
+        help=(
+            "Number of seconds between rounds of maintenance (commit-graph, packing"
+            " loose objects, incremental repack) of cloned exhibits; 0 disables it"
+        ),
+        default_value=24 * 60 * 60,
+        config=True,
+    )
+
+    maintenance_budget = Float(
+        help=(
+            "Maximum number of seconds spent on maintenance in each round;"
+            " repositories not reached are maintained first in the next round"
+        ),
+        default_value=60,
+        config=True,
+    )
+
+    maintenance_tasks = List(
+        Unicode(),
+        help="Tasks of `git maintenance run` performed on cloned exhibits",
+        default_value=["commit-graph", "loose-objects", "incremental-repack"],
+        config=True,
+    )
+
+    config_reload_interval = Float(
+        help=(
+            "Number of seconds between checks whether `jupyter_gallery_config` files"
+            " changed, to apply the new configuration without restarting the server;"
+            " 0 disables reloading"
+        ),
+        default_value=0,
+        config=True,
+    )
+
+    state_max_size = Int(
+        help=(
+            "Maximum number of exhibits (or icons) for which state such as update"
+            " status or pull progress is kept; least recently updated are dropped"
+        ),
+        default_value=1000,
+        config=True,
+    )
+
+    slow_operation_threshold = Float(
+        help=(
+            "Number of seconds from which pulls and update checks are logged"
+            " with the timeline of their phases (0 to never log them)"
+        ),
+        default_value=10,
+        config=True,
+    )
+
+    timeline_history_size = Int(
+        help=(
+            "Number of recent pulls and update checks whose timelines are available"
+            " from the `jupyterlab-gallery/debug/timelines` endpoint"
+        ),
+        default_value=100,
+        config=True,
+    )
+
+    progress_state_ttl = Float(
+        help="Number of seconds for which progress of a pull is kept after its last event",
+        default_value=3600,
+        config=True,
+    )
+
+    @observe("exhibits")
+    def _exhibits_changed(self, change):
+        # keep the state of exhibits which did not change, drop the rest
+        exhibits = change["new"]
+        keys = {self._exhibit_data_key(exhibit) for exhibit in exhibits}
+        self._exhibit_data = {
+            key: data for key, data in self._exhibit_data.items() if key in keys
+        }
+        identities = {key for key, _ in self._identify_exhibits(exhibits)}
+        self._exhibit_ids = {
+            key: exhibit_id
+            for key, exhibit_id in self._exhibit_ids.items()
+            if key in identities
+        }
+        self._update_states.retain(
+            {self.get_local_path(exhibit) for exhibit in exhibits}
+        )
+        self._search_index = None
+        self._bump_state_version()
+        self._wake_update_scheduler()
+
+    @staticmethod
+    def _identify_exhibits(exhibits: list[dict]) -> list[tuple[tuple, dict]]:
+        """Pair exhibits with keys identifying them (git URL, branch and occurrence)."""
+        identified = []
+        occurrences: Counter[tuple] = Counter()
+        for exhibit in exhibits:
+            identity = (exhibit["git"], exhibit.get("branch"))
+            occurrences[identity] += 1
+            identified.append(((*identity, occurrences[identity]), exhibit))
+        return identified
+
+    def get_exhibits(self) -> dict[int, dict]:
+        """Configured exhibits by id, in the configuration order.
+
+        An exhibit keeps its id when exhibits are added, removed or reordered,
+        or when its settings other than `git` and `branch` change.
+        """
+        exhibits = {}
+        for key, exhibit in self._identify_exhibits(self.exhibits):
+            if key not in self._exhibit_ids:
+                self._exhibit_ids[key] = self._next_exhibit_id
+                self._next_exhibit_id += 1
+            exhibits[self._exhibit_ids[key]] = exhibit
+        return exhibits
+
+    def get_exhibit(self, exhibit_id: int) -> Optional[dict]:
+        return self.get_exhibits().get(exhibit_id)
+
+    @property
+    def search_index(self) -> ExhibitIndex:
+        """Index of exhibit titles and descriptions, by exhibit id."""
+        if self._search_index is None:
+            self._search_index = ExhibitIndex(self.get_exhibits())
+        return self._search_index
+
+    @property
+    def state_version(self) -> int:
+        """Version of the exhibits state, increased on every change."""
+        return self._state_version
+
+    def invalidate_exhibit_data(self, local_path: Optional[Path] = None):
+        """Drop cached data of exhibits cloned to `local_path` (or of all)."""
+        if local_path is None:
+            self._exhibit_data.clear()
+        else:
+            self._exhibit_data = {
+                key: data
+                for key, data in self._exhibit_data.items()
+                if data["localPath"] != str(local_path)
+            }
+        self._bump_state_version()
+
+    def _bump_state_version(self):
+        self._state_version += 1
+        if self._state_changed is not None:
+            self._state_changed.set()
+            self._state_changed = None
+
+    @property
+    def prefetching(self) -> bool:
+        """Whether exhibits are being cloned or updated at startup."""
+        return bool(self._prefetching)
+
+    def set_prefetching(self, local_path: Path, prefetching: bool):
+        """Mark the exhibit cloned to `local_path` as being prefetched (or not)."""
+        if prefetching:
+            self._prefetching.add(local_path)
+        else:
+            self._prefetching.discard(local_path)
+        self.invalidate_exhibit_data(local_path)
+
+    def validate_exhibit_data(self, exhibits: Optional[list[dict]] = None):
+        """Invalidate cached data of exhibits whose directory was created or removed.
+
+        Only the given exhibits are checked, if any.
+        """
+        if exhibits is None:
+            cached = list(self._exhibit_data.values())
+        else:
+            keys = [self._exhibit_data_key(exhibit) for exhibit in exhibits]
+            cached = [
+                self._exhibit_data[key] for key in keys if key in self._exhibit_data
+            ]
+        for data in cached:
+            if data["isCloned"] != Path(data["localPath"]).exists():
+                self.invalidate_exhibit_data(Path(data["localPath"]))
+
+    async def wait_for_state_change(self, version: int, timeout: float):
+        """Wait until the state version is greater than `version` or timeout."""
+        if self._state_version > version:
+            return
+        if self._state_changed is None:
+            self._state_changed = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._state_changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
     def get_local_path(self, exhibit) -> Path:
         clone_destination = Path(self.destination)
         repository_name = extract_repository_name(exhibit["git"])
         return clone_destination / repository_name
 
-    def _check_updates(self, exhibit):
+    def get_snapshot_path(self, exhibit) -> Optional[str]:
+        """Path of the snapshot to restore the exhibit from, if any."""
+        if not exhibit.get("snapshot"):
+            return None
+        return os.path.join(
+            os.path.expanduser(self.root_dir or ""),
+            os.path.expanduser(exhibit["snapshot"]),
+        )
+
+    def get_shared_cache_path(self, exhibit) -> Optional[Path]:
+        """Path of the mirror of the exhibit repository in the shared cache."""
+        if not self.shared_cache_dir:
+            return None
+        repository_name = extract_repository_name(exhibit["git"])
+        url_hash = hashlib.sha256(exhibit["git"].encode("utf-8")).hexdigest()[:12]
+        return Path(self.shared_cache_dir) / f"{repository_name}-{url_hash}.git"
+
+    async def update_shared_cache(self):
+        """Create or fetch mirrors of all exhibits in the shared cache."""
+        runner = AsyncGitRunner(concurrency=self.update_check_concurrency, timeout=None)
+
+        async def update_mirror(mirror: Path, exhibit):
+            env = credentials_env(
+                account=exhibit.get("account"), token=exhibit.get("token")
+            )
+            # clones borrow objects from the mirror without copying them, so
+            # objects must never be removed: no pruning and no automatic gc
+            if (mirror / "HEAD").exists():
+                result = await runner.run("fetch", "--no-auto-gc", cwd=mirror, env=env)
+            else:
+                mirror.parent.mkdir(parents=True, exist_ok=True)
+                result = await runner.run(
+                    "clone",
+                    "--mirror",
+                    "--config",
+                    "gc.auto=0",
+                    "--config",
+                    "gc.pruneExpire=never",
+                    "--config",
+                    "maintenance.auto=false",
+                    "--",
+                    exhibit["git"],
+                    str(mirror),
+                    cwd=mirror.parent,
+                    env=env,
+                )
+            if result.returncode != 0:
+                self.log.warning(
+                    f"Updating shared cache {mirror} failed: {result.stderr}"
+                )
+
+        # exhibits of the same repository (e.g. other branches) share a mirror
+        mirrors: dict[Path, dict] = {}
+        for exhibit in self.exhibits:
+            mirrors.setdefault(self.get_shared_cache_path(exhibit), exhibit)
+        results = await asyncio.gather(
+            *[update_mirror(mirror, exhibit) for mirror, exhibit in mirrors.items()],
+            return_exceptions=True,
+        )
+        for mirror, result in zip(mirrors, results):
+            if isinstance(result, Exception):
+                self.log.warning(f"Updating shared cache {mirror} failed: {result}")
+
+    def start_shared_cache_updates(self):
+        """Start the background loop keeping the shared cache fetched."""
+        if not self.shared_cache_dir or self.shared_cache_refresh_interval <= 0:
+            return
+        if self._shared_cache_task is None:
+            self._shared_cache_task = asyncio.create_task(
+                self._schedule_shared_cache_updates()
+            )
+
+    def get_repo_dir(self, exhibit) -> str:
+        """Resolved directory of the exhibit clone (as used by the pull handlers)."""
+        return os.path.realpath(
+            os.path.join(
+                os.path.expanduser(self.root_dir or ""),
+                os.getenv("NBGITPULLER_PARENTPATH", ""),
+                self.get_local_path(exhibit),
+            )
+        )
+
+    async def run_maintenance(self):
+        """Maintain cloned exhibits while the server is idle, within the budget.
+
+        A repository is maintained while holding its lock, so never at the
+        same time as a pull; maintenance only starts when no pull is running
+        or waiting.
+        """
+        repo_dirs = list(
+            dict.fromkeys(self.get_repo_dir(exhibit) for exhibit in self.exhibits)
+        )
+        if not repo_dirs:
+            return
+        start = self._maintenance_cursor % len(repo_dirs)
+        deadline = time.monotonic() + self.maintenance_budget
+        runner = AsyncGitRunner(concurrency=1, timeout=None)
+        for i in range(len(repo_dirs)):
+            repo_dir = repo_dirs[(start + i) % len(repo_dirs)]
+            # wait for pulls to finish
+            while len(self.repo_locks) and time.monotonic() < deadline:
+                await asyncio.sleep(1)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            self._maintenance_cursor = start + i + 1
+            if not os.path.exists(os.path.join(repo_dir, ".git")):
+                continue
+            label = os.path.basename(repo_dir)
+            async with self.repo_locks.hold(repo_dir):
+                try:
+                    with GIT_OPERATION_DURATION.labels("maintenance", label).time():
+                        result = await runner.run(
+                            "maintenance",
+                            "run",
+                            "--quiet",
+                            *[f"--task={task}" for task in self.maintenance_tasks],
+                            cwd=repo_dir,
+                            timeout=remaining,
+                        )
+                except Exception as e:
+                    result = None
+                    error = str(e)
+                else:
+                    error = result.stderr.strip()
+            if result is None or result.returncode != 0:
+                GIT_OPERATION_FAILURES.labels("maintenance", label).inc()
+                self.log.warning(f"Maintenance of {repo_dir} failed: {error}")
+
+    def start_maintenance(self):
+        """Start the background loop maintaining cloned exhibits."""
+        if self.maintenance_interval <= 0 or self._maintenance_task is not None:
+            return
+        self._maintenance_task = asyncio.create_task(self._schedule_maintenance())
+
+    async def _schedule_maintenance(self):
+        while True:
+            await asyncio.sleep(self.maintenance_interval)
+            await self.run_maintenance()
+
+    async def _schedule_shared_cache_updates(self):
+        while True:
+            await self.update_shared_cache()
+            await asyncio.sleep(self.shared_cache_refresh_interval)
+
+    async def _check_updates(self, exhibit):
         local_path = self.get_local_path(exhibit)
-        with git_credentials(
-            account=exhibit.get("account"), token=exhibit.get("token")
-        ):
-            self._has_updates[local_path] = has_updates(local_path)
+        exhibit_label = local_path.name
+        operation = self.update_check_method
+        timeline = Timeline("update-check", exhibit_label)
+        outcome = "failed"
+        try:
+            env = credentials_env(
+                account=exhibit.get("account"), token=exhibit.get("token")
+            )
+            with GIT_OPERATION_DURATION.labels(operation, exhibit_label).time():
+                if self.update_check_method == "ls-remote":
+                    timeline.mark("local-head")
+                    check = await check_remote_updates(
+                        local_path,
+                        url=exhibit["git"],
+                        runner=self._git_runner,
+                        ref_cache=self._ref_cache,
+                        env=env,
+                        timeline=timeline,
+                    )
+                else:
+                    # fetching must not overlap with a pull of the repository
+                    timeline.mark("repo-lock")
+                    async with self.repo_locks.hold(self.get_repo_dir(exhibit)):
+                        timeline.mark("local-head")
+                        check = await check_updates(
+                            local_path,
+                            runner=self._git_runner,
+                            env=env,
+                            timeline=timeline,
+                        )
+            outcome = "succeeded"
+            state = self._update_states.get(local_path, UpdateState())
+            self._update_states[local_path] = state._replace(
+                updates_available=check.updates_available,
+                checked_at=time.time(),
+                remote_sha=check.remote_sha,
+            )
+            UPDATE_CHECK_LAST_SUCCESS.labels(exhibit_label).set_to_current_time()
+            # fetching changes the last updated date
+            if (
+                operation == "fetch"
+                or state.updates_available != check.updates_available
+                or state.remote_sha != check.remote_sha
+            ):
+                self.invalidate_exhibit_data(local_path)
+        except Exception:
+            GIT_OPERATION_FAILURES.labels(operation, exhibit_label).inc()
+            raise
+        finally:
+            timeline.finish(outcome)
+            self.timelines.record(timeline)
+
+    def _exhibit_data_key(self, exhibit) -> tuple:
+        return (exhibit["git"], exhibit.get("homepage"), exhibit.get("icon"))
 
     def get_exhibit_data(self, exhibit):
-        data = {}
+        key = self._exhibit_data_key(exhibit)
+        data = self._exhibit_data.get(key)
+        if data is None:
+            data = self._exhibit_data[key] = self._compute_exhibit_data(exhibit)
+        return data
+
+    def get_icon_source(self, exhibit) -> Optional[str]:
+        """Path, data URI or URL of the exhibit icon."""
+        if exhibit.get("icon"):
+            return exhibit["icon"]
+        homepage = exhibit.get("homepage")
+        if homepage and homepage.startswith("https://github.com/"):
+            repository_name = extract_repository_name(exhibit["git"])
+            repository_owner = extract_repository_owner(homepage)
+            return f"https://opengraph.githubassets.com/1/{repository_owner}/{repository_name}"
+        return None
 
-        if "icon" not in exhibit or not exhibit["icon"]:
-            homepage = exhibit.get("homepage")
-            if homepage and homepage.startswith("https://github.com/"):
-                repository_name = extract_repository_name(exhibit["git"])
-                repository_owner = extract_repository_owner(homepage)
-                data["icon"] = (
-                    f"https://opengraph.githubassets.com/1/{repository_owner}/{repository_name}"
+    def get_icon_url(self, exhibit) -> Optional[str]:
+        """URL of the exhibit icon served by `IconHandler`."""
+        source = self.get_icon_source(exhibit)
+        if source is None:
+            return None
+        key = hashlib.sha256(f"{source}\n{self.icon_max_size}".encode()).hexdigest()
+        self._icon_sources[key] = source
+        return url_path_join(self.base_url, "jupyterlab-gallery", "icons", key)
+
+    async def get_icon(self, key: str) -> Optional[Icon]:
+        """Icon for a key from `get_icon_url`, resolved once and then cached."""
+        source = self._icon_sources.get(key)
+        if source is None:
+            return None
+        cache = IconCache(self.icon_cache_dir, max_bytes=self.icon_cache_max_bytes)
+        async with self._icon_locks.hold(key):
+            icon = cache.get(key)
+            if icon is not None:
+                return icon
+            if key in self._icon_failures:
+                return None
+            if self._icon_fetcher is None:
+                self._icon_fetcher = self.icon_fetcher_class(parent=self)
+            try:
+                data, content_type = await load_icon(
+                    source, fetcher=self._icon_fetcher, root_dir=self.root_dir
+                )
+            except Exception as e:
+                self.log.warning(f"Could not load icon {source[:100]}: {e}")
+                self._icon_failures[key] = True
+                return None
+            if self.icon_max_size:
+                data, content_type = make_thumbnail(
+                    data, content_type, max_size=self.icon_max_size
                 )
+            self._icon_failures.pop(key, None)
+            return cache.put(key, data, content_type)
+
+    def _compute_exhibit_data(self, exhibit):
+        data = {}
+
+        if self.icon_proxy:
+            icon_url = self.get_icon_url(exhibit)
+            if icon_url:
+                data["icon"] = icon_url
+        elif not exhibit.get("icon"):
+            icon_source = self.get_icon_source(exhibit)
+            if icon_source:
+                data["icon"] = icon_source
 
         local_path = self.get_local_path(exhibit)
 
         data["localPath"] = str(local_path)
+        data["prefetching"] = local_path in self._prefetching
         exists = local_path.exists()
         data["isCloned"] = exists
         if exists:
@@ -118,10 +873,207 @@ class GalleryManager(LoggingConfigurable):
                 data["lastUpdated"] = datetime.fromtimestamp(
                     date_head.stat().st_mtime
                 ).isoformat()
-            data["updatesAvailable"] = self._has_updates[local_path]
+            data["updatesAvailable"] = self._update_states.get(
+                local_path, UpdateState()
+            ).updates_available
+        return data
 
-            def check_updates():
-                self._check_updates(exhibit)
+    def start_update_checks(self):
+        """Start the background loop checking cloned exhibits for updates."""
+        if self._update_scheduler is not None:
+            return
+        self._git_runner = AsyncGitRunner(
+            concurrency=self.update_check_concurrency,
+            timeout=self.update_check_timeout,
+        )
+        self._ref_cache = RemoteRefCache(
+            ttl=self.update_check_ref_cache_ttl, path=self.update_check_ref_cache_dir
+        )
+        self._update_scheduler_wakeup = asyncio.Event()
+        self._update_scheduler = asyncio.create_task(self._schedule_update_checks())
 
-            Thread(target=check_updates).start()
-        return data
+    async def stop_update_checks(self):
+        for scheduler in [
+            self._update_scheduler,
+            self._shared_cache_task,
+            self._maintenance_task,
+        ]:
+            if scheduler is None:
+                continue
+            scheduler.cancel()
+            try:
+                await scheduler
+            except asyncio.CancelledError:
+                pass
+        self._update_scheduler = None
+        self._update_scheduler_wakeup = None
+        self._shared_cache_task = None
+        self._maintenance_task = None
+        for task in list(self._background_tasks):
+            task.cancel()
+        await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        self.save_state()
+
+    def schedule_update_checks(self):
+        """Submit an update check for every cloned exhibit which is due.
+
+        Exhibits sharing a local path are checked only once and a path
+        is never checked again while a previous check is still running.
+        """
+        now = time.monotonic()
+        for exhibit in self.exhibits:
+            local_path = self.get_local_path(exhibit)
+            if local_path in self._update_checks_pending:
+                continue
+            if self._update_states.get(local_path, UpdateState()).next_check > now:
+                continue
+            if not local_path.exists():
+                continue
+            self._update_checks_pending.add(local_path)
+            task = asyncio.create_task(self._check_updates(exhibit))
+            self._background_tasks.add(task)
+            task.add_done_callback(
+                lambda task, local_path=local_path: self._update_check_done(
+                    local_path, task
+                )
+            )
+
+    def _update_check_done(self, local_path: Path, task: asyncio.Task):
+        self._background_tasks.discard(task)
+        self._update_checks_pending.discard(local_path)
+        delay = self.update_check_interval * (
+            1 + random.uniform(0, self.update_check_jitter)
+        )
+        self._update_states[local_path] = self._update_states.get(
+            local_path, UpdateState()
+        )._replace(next_check=time.monotonic() + delay)
+        self._wake_update_scheduler()
+        if not task.cancelled() and task.exception():
+            self.log.warning(
+                f"Checking updates for {local_path} failed: {task.exception()}"
+            )
+        else:
+            self.save_state()
+
+    def record_pull(self, exhibit):
+        """Note that the exhibit was pulled successfully, so is up to date."""
+        local_path = self.get_local_path(exhibit)
+        self._update_states[local_path] = self._update_states.get(
+            local_path, UpdateState()
+        )._replace(updates_available=False, last_pulled=time.time())
+        self.save_state()
+        # a new clone has to be checked on schedule from now on
+        self._wake_update_scheduler()
+
+    def get_state_path(self) -> Optional[Path]:
+        if not self.state_file:
+            return None
+        return (
+            Path(os.path.expanduser(self.root_dir or ""))
+            / os.getenv("NBGITPULLER_PARENTPATH", "")
+            / self.destination
+            / self.state_file
+        )
+
+    def load_state(self):
+        """Restore the update status of exhibits saved by a previous server.
+
+        Exhibits checked less than `update_check_interval` ago are only
+        checked again once the interval elapsed.
+        """
+        path = self.get_state_path()
+        if path is None:
+            return
+        try:
+            saved = json.loads(path.read_text())["exhibits"]
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self.log.warning(f"Could not load the gallery state from {path}: {e}")
+            return
+        now = time.time()
+        for exhibit in self.exhibits:
+            local_path = self.get_local_path(exhibit)
+            entry = saved.get(str(local_path))
+            # the directory may now be used by another repository
+            if not entry or entry.get("git") != exhibit["git"]:
+                continue
+            checked_at = entry.get("checked_at")
+            next_check = 0.0
+            if checked_at:
+                delay = self.update_check_interval * (
+                    1 + random.uniform(0, self.update_check_jitter)
+                )
+                next_check = time.monotonic() + checked_at + delay - now
+            self._update_states[local_path] = UpdateState(
+                updates_available=entry.get("updates_available"),
+                next_check=next_check,
+                checked_at=checked_at,
+                remote_sha=entry.get("remote_sha"),
+                last_pulled=entry.get("last_pulled"),
+            )
+        self.invalidate_exhibit_data()
+
+    def save_state(self):
+        """Write the update status of exhibits for the next server to load.
+
+        The file is replaced atomically, so it is never read partially written.
+        """
+        path = self.get_state_path()
+        if path is None:
+            return
+        exhibits = {}
+        for exhibit in self.exhibits:
+            local_path = self.get_local_path(exhibit)
+            state = self._update_states.get(local_path)
+            if state is None or (
+                state.checked_at is None and state.last_pulled is None
+            ):
+                continue
+            exhibits[str(local_path)] = {
+                "git": exhibit["git"],
+                "updates_available": state.updates_available,
+                "remote_sha": state.remote_sha,
+                "checked_at": state.checked_at,
+                "last_pulled": state.last_pulled,
+            }
+        if not exhibits and not path.exists():
+            return
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            atomic_write(path, json.dumps({"version": 1, "exhibits": exhibits}))
+        except OSError as e:
+            self.log.warning(f"Could not save the gallery state to {path}: {e}")
+
+    def _wake_update_scheduler(self):
+        if self._update_scheduler_wakeup is not None:
+            self._update_scheduler_wakeup.set()
+
+    def _seconds_until_next_check(self) -> Optional[float]:
+        """Seconds until a cloned exhibit is due, None if no exhibit is cloned.
+
+        Paths being checked are left out, the scheduler is woken up
+        when their check completes.
+        """
+        local_paths = {self.get_local_path(exhibit) for exhibit in self.exhibits}
+        next_checks = [
+            self._update_states.get(local_path, UpdateState()).next_check
+            for local_path in local_paths
+            if local_path not in self._update_checks_pending and local_path.exists()
+        ]
+        if not next_checks:
+            return None
+        delay = min(next_checks) - time.monotonic()
+        return max(1, min(delay, self.update_check_interval))
+
+    async def _schedule_update_checks(self):
+        wakeup = self._update_scheduler_wakeup
+        while True:
+            wakeup.clear()
+            self.schedule_update_checks()
+            try:
+                await asyncio.wait_for(
+                    wakeup.wait(), timeout=self._seconds_until_next_check()
+                )
+            except asyncio.TimeoutError:
+                pass
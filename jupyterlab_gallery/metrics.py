@@ -0,0 +1,67 @@
+# Prometheus metrics of the gallery git operations; these are collected
+# in a separate registry exposed by `MetricsHandler` (`jupyterlab-gallery/metrics`).
+
+import re
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+
+REGISTRY = CollectorRegistry()
+
+GIT_OPERATION_DURATION = Histogram(
+    "jupyterlab_gallery_git_operation_duration_seconds",
+    "Duration of git operations (clone, pull, fetch, ls-remote)",
+    ["operation", "exhibit"],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, float("inf")),
+    registry=REGISTRY,
+)
+
+GIT_OPERATION_FAILURES = Counter(
+    "jupyterlab_gallery_git_operation_failures_total",
+    "Number of failed git operations (clone, pull, fetch, ls-remote)",
+    ["operation", "exhibit"],
+    registry=REGISTRY,
+)
+
+GIT_RECEIVED_BYTES = Counter(
+    "jupyterlab_gallery_git_received_bytes_total",
+    "Approximate number of bytes received when cloning or fetching, as reported by git",
+    ["exhibit"],
+    registry=REGISTRY,
+)
+
+LOCK_WAIT_DURATION = Histogram(
+    "jupyterlab_gallery_pull_lock_wait_seconds",
+    "Time pulls waited for the repository lock and a free pull slot",
+    ["exhibit"],
+    registry=REGISTRY,
+)
+
+UPDATE_CHECK_LAST_SUCCESS = Gauge(
+    "jupyterlab_gallery_update_check_last_success_timestamp_seconds",
+    "Time of the last successful update check (staleness is time() minus this)",
+    ["exhibit"],
+    registry=REGISTRY,
+)
+
+EVENT_STREAMS = Gauge(
+    "jupyterlab_gallery_event_streams",
+    "Number of connected pull progress event streams",
+    registry=REGISTRY,
+)
+
+PROGRESS_QUEUE_DEPTH = Gauge(
+    "jupyterlab_gallery_progress_queue_depth",
+    "Number of progress messages waiting to be sent to event streams",
+    registry=REGISTRY,
+)
+
+_UNITS = {"byte": 1, "bytes": 1, "KiB": 1024, "MiB": 1024**2, "GiB": 1024**3}
+_received_re = re.compile(r"^([\d.]+) (bytes?|KiB|MiB|GiB)\b")
+
+
+def parse_received_bytes(message: str) -> int:
+    """Parse git progress message such as `1.50 MiB | 2.00 MiB/s`."""
+    match = _received_re.match(message.strip())
+    if not match:
+        return 0
+    return int(float(match.group(1)) * _UNITS[match.group(2)])
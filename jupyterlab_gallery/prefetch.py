@@ -0,0 +1,43 @@
+from typing import Optional
+
+from .handlers import GalleryPullMixin
+from .manager import GalleryManager
+
+
+class ExhibitPrefetcher(GalleryPullMixin):
+    """Clones or updates exhibits with a `prefetch_priority` in the background.
+
+    Pulls go through the same locks and progress stream as pulls requested
+    by users, so that a user opening a prefetching exhibit joins its pull.
+    """
+
+    def __init__(self, settings: dict, gallery_manager: GalleryManager):
+        self.settings = settings
+        self.gallery_manager = gallery_manager
+        super().__init__()
+
+    def start(self) -> Optional[int]:
+        """Start prefetching; returns the id of the batch pull, if any."""
+        exhibits = self.gallery_manager.get_exhibits()
+        # stable sort: exhibits of the same priority are pulled in config order
+        exhibit_ids = sorted(
+            (
+                exhibit_id
+                for exhibit_id, exhibit in exhibits.items()
+                if exhibit.get("prefetch_priority") is not None
+            ),
+            key=lambda exhibit_id: -exhibits[exhibit_id]["prefetch_priority"],
+        )
+        if not exhibit_ids:
+            return None
+        for exhibit_id in exhibit_ids:
+            self.gallery_manager.set_prefetching(
+                self.gallery_manager.get_local_path(exhibits[exhibit_id]), True
+            )
+        return self._pull_batch(
+            {
+                exhibit_id: self._pull_options(exhibits[exhibit_id])
+                for exhibit_id in exhibit_ids
+            },
+            parallelism=self.gallery_manager.prefetch_concurrency,
+        )
@@ -0,0 +1,577 @@
+# Git operations of a pull, kept apart from `gitpuller` so that GitPython
+# and nbgitpuller are only imported once the first pull runs.
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import threading
+from collections import deque
+from queue import Queue
+from typing import Generator, Optional
+
+import git
+from nbgitpuller.errors import BranchExistError, BranchResolveError
+from nbgitpuller.pull import GitPuller
+
+from .git_utils import credentials_env
+from .gitpuller import (
+    ProgressThrottle,
+    PullCancellation,
+    PullTimeoutError,
+    Update,
+    _kill_process_group,
+)
+from .metrics import GIT_RECEIVED_BYTES, parse_received_bytes
+from .timeline import Timeline
+
+
+class CloneProgress(git.RemoteProgress):
+    # recent git versions report checkout as "Updating files" which
+    # GitPython does not recognise (it expects "Checking out files")
+    re_checkout = re.compile(r"^Updating files:\s+\d+% \((\d+)/(\d+)\)(.*)$")
+    # small fetches unpack objects instead of receiving a pack
+    re_unpacking = re.compile(r"^Unpacking objects:.*?\),(.*)$")
+
+    # names of the stages in pull timelines
+    stage_names = {
+        git.RemoteProgress.COUNTING: "counting",
+        git.RemoteProgress.COMPRESSING: "compressing",
+        git.RemoteProgress.RECEIVING: "receiving",
+        git.RemoteProgress.RESOLVING: "resolving-deltas",
+        git.RemoteProgress.CHECKING_OUT: "checkout",
+    }
+
+    def __init__(
+        self,
+        min_interval: float = 0.1,
+        min_delta: float = 0.01,
+        timeline: Optional[Timeline] = None,
+    ):
+        self.queue = Queue()
+        self.timeline = timeline
+        self.max_stage = 0.01
+        self.prev_stage = 0
+        self.progress = 0.0
+        self.received_bytes = 0
+        self._stage_op = 0
+        self._seen_checkout = False
+        self._throttle = ProgressThrottle(
+            min_interval=min_interval, min_delta=min_delta
+        )
+        super().__init__()
+
+    def update(self, op_code: int, cur_count, max_count=None, message=""):
+        stage_changed = False
+        if op_code & git.RemoteProgress.BEGIN:
+            new_stage = None
+            if op_code & git.RemoteProgress.COUNTING:
+                new_stage = 0.05
+            elif op_code & git.RemoteProgress.COMPRESSING:
+                new_stage = 0.10
+            elif op_code & git.RemoteProgress.RECEIVING:
+                new_stage = 0.80
+            elif op_code & git.RemoteProgress.RESOLVING:
+                new_stage = 0.90
+            elif op_code & git.RemoteProgress.CHECKING_OUT:
+                new_stage = 1
+
+            # stages can repeat, e.g. when a partial clone fetches
+            # missing blobs during checkout; never move backwards
+            if new_stage and new_stage > self.max_stage:
+                self.prev_stage = self.max_stage
+                self.max_stage = new_stage
+                self._stage_op = op_code & git.RemoteProgress.OP_MASK
+                stage_changed = True
+                if self.timeline:
+                    self.timeline.mark(self.stage_names[self._stage_op])
+
+        if op_code & git.RemoteProgress.RECEIVING:
+            # the message reports the total received so far
+            self.received_bytes = max(
+                self.received_bytes, parse_received_bytes(message)
+            )
+
+        if (
+            isinstance(cur_count, (int, float))
+            and isinstance(max_count, (int, float))
+            and max_count
+        ):
+            if op_code & git.RemoteProgress.OP_MASK == self._stage_op:
+                progress = self.prev_stage + cur_count / max_count * (
+                    self.max_stage - self.prev_stage
+                )
+            else:
+                # repeated earlier stage, only the message is updated
+                progress = self.progress
+            progress = self.progress = max(progress, self.progress)
+            stage_ended = bool(op_code & git.RemoteProgress.END)
+            if self._throttle.should_emit(progress, force=stage_changed or stage_ended):
+                self.queue.put(
+                    Update(
+                        progress=progress,
+                        message=message,
+                    )
+                )
+
+    def line_dropped(self, line: str):
+        match = self.re_unpacking.match(line.strip())
+        if match:
+            self.received_bytes = max(
+                self.received_bytes, parse_received_bytes(match.group(1))
+            )
+            return
+        match = self.re_checkout.match(line.strip())
+        if not match:
+            return
+        cur_count, max_count, message = match.groups()
+        op_code = git.RemoteProgress.CHECKING_OUT
+        if not self._seen_checkout:
+            self._seen_checkout = True
+            op_code |= git.RemoteProgress.BEGIN
+        message = message.strip().strip(",")
+        if message.endswith(self.DONE_TOKEN):
+            op_code |= git.RemoteProgress.END
+        self.update(op_code, int(cur_count), int(max_count), "Updating files")
+
+
+class ProgressGitPuller(GitPuller):
+    def __init__(
+        self,
+        git_url,
+        repo_dir,
+        token: Optional[str],
+        account: Optional[str],
+        progress_min_interval: float = 0.1,
+        progress_min_delta: float = 0.01,
+        reference: Optional[str] = None,
+        dissociate: bool = False,
+        filter_spec: Optional[str] = None,
+        sparse_paths: Optional[list[str]] = None,
+        cancellation: Optional[PullCancellation] = None,
+        connect_timeout: Optional[float] = None,
+        snapshot: Optional[str] = None,
+        timeline: Optional[Timeline] = None,
+        **kwargs,
+    ):
+        self._cancellation = cancellation or PullCancellation()
+        self._timeline = timeline or Timeline("pull", os.path.basename(repo_dir))
+        self._snapshot = snapshot
+        self._connect_timeout = connect_timeout
+        self._reference = reference
+        self._dissociate = dissociate
+        self._filter_spec = filter_spec
+        self._sparse_paths = sparse_paths
+        self._progress_min_interval = progress_min_interval
+        self._progress_min_delta = progress_min_delta
+        # credentials are passed to each git process rather than set in
+        # `os.environ` so that private repositories can be pulled concurrently
+        self._env = credentials_env(token=token, account=account)
+        # it will attempt to resolve default branch which requires credentials too
+        self._timeline.mark("resolve-branch")
+        super().__init__(git_url, repo_dir, **kwargs)
+
+    def _git(
+        self, *args: str, cwd: Optional[str] = None, remote: bool = False
+    ) -> Generator[str, None, str]:
+        """Run git, yielding lines of its standard error and returning its output.
+
+        The process is killed when the pull is cancelled, or for commands
+        contacting the `remote`, unless git writes to standard error (as it
+        does once connected) or exits within `connect_timeout` seconds.
+        """
+        self._cancellation.check()
+        process = subprocess.Popen(
+            ["git", *args],
+            cwd=cwd,
+            # output is parsed, so it must not be translated
+            env={**os.environ, **self._env, "LANG": "C"},
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=os.name == "posix",
+        )
+        # read the output in another thread so that git never blocks on it
+        stdout: list[bytes] = []
+        stdout_reader = threading.Thread(
+            target=lambda: stdout.append(process.stdout.read())
+        )
+        stdout_reader.start()
+        connect_timer = None
+        if remote and self._connect_timeout:
+            connect_timer = threading.Timer(
+                self._connect_timeout,
+                self._cancellation.cancel,
+                [
+                    PullTimeoutError(
+                        f"git {args[0]} did not connect to the remote"
+                        f" within {self._connect_timeout} seconds"
+                    )
+                ],
+            )
+            connect_timer.start()
+        last_lines: deque[str] = deque(maxlen=20)
+        try:
+            with self._cancellation.track(process):
+                buffer = b""
+                while True:
+                    chunk = process.stderr.read1(65536)
+                    if not chunk:
+                        break
+                    # progress lines are terminated with carriage returns
+                    *lines, buffer = re.split(rb"[\r\n]", buffer + chunk)
+                    for line in lines:
+                        if not line:
+                            continue
+                        text = line.decode("utf-8", errors="replace")
+                        if connect_timer and not text.startswith("Cloning into"):
+                            connect_timer.cancel()
+                        last_lines.append(text)
+                        yield text
+                process.wait()
+        finally:
+            if connect_timer:
+                connect_timer.cancel()
+            if process.returncode is None:
+                # the generator was closed early
+                _kill_process_group(process)
+                process.wait()
+            stdout_reader.join()
+            process.stdout.close()
+            process.stderr.close()
+        self._cancellation.check()
+        if process.returncode != 0:
+            raise git.GitCommandError(
+                ["git", *args],
+                process.returncode,
+                "\n".join(last_lines),
+                stdout[0].decode("utf-8", errors="replace") if stdout else "",
+            )
+        return stdout[0].decode("utf-8") if stdout else ""
+
+    def _run(self, *args: str, cwd: Optional[str] = None, remote: bool = False) -> str:
+        """Run git (as `_git`) and return its output."""
+        lines = self._git(*args, cwd=cwd, remote=remote)
+        while True:
+            try:
+                next(lines)
+            except StopIteration as result:
+                return result.value
+
+    def _stream(
+        self, *args: str, cwd: Optional[str] = None, remote: bool = False
+    ) -> Generator[str, None, str]:
+        """Run git (as `_git`), yielding its progress as pull messages."""
+        yield "$ git {}\n".format(" ".join(args))
+        lines = self._git(*args, cwd=cwd, remote=remote)
+        while True:
+            try:
+                yield next(lines) + "\n"
+            except StopIteration as result:
+                return result.value
+
+    def _ls_remote(self, *args: str) -> str:
+        return self._run("ls-remote", *args, remote=True)
+
+    def resolve_default_branch(self):
+        try:
+            output = self._ls_remote("--symref", "--", self.git_url, "HEAD")
+        except git.GitCommandError:
+            error = BranchResolveError()
+            logging.exception(error)
+            raise error
+        for line in output.splitlines():
+            if line.startswith("ref:"):
+                # line resembles --> ref: refs/heads/main HEAD
+                _, ref, head = line.split()
+                refs, heads, branch_name = ref.split("/", 2)
+                return branch_name
+        raise BranchResolveError()
+
+    def branch_exists(self, branch):
+        output = self._ls_remote("--heads", "--tags", "--", self.git_url)
+        for line in output.splitlines():
+            _, ref = line.split()
+            refs, kind, branch_name = ref.split("/", 2)
+            if branch_name == branch:
+                return
+        raise BranchExistError()
+
+    def initialize_repo(self):
+        logging.info("Repo {} doesn't exist. Cloning...".format(self.repo_dir))
+        progress = CloneProgress(
+            min_interval=self._progress_min_interval,
+            min_delta=self._progress_min_delta,
+            timeline=self._timeline,
+        )
+        restored = yield from self.restore_snapshot(progress)
+        if restored:
+            # fetch and merge what was pushed since the snapshot was made
+            yield from self.update()
+            logging.info("Repo {} restored".format(self.repo_dir))
+            return
+
+        self._timeline.mark("clone")
+        clone_args = ["clone", "--progress"]
+        if self.branch_name:
+            clone_args += ["--branch", self.branch_name]
+        if self.depth:
+            clone_args += ["--depth", str(self.depth)]
+        if self._reference:
+            # borrow objects from the shared cache, only fetching missing ones
+            clone_args.append(f"--reference-if-able={self._reference}")
+            if self._dissociate:
+                clone_args.append("--dissociate")
+        if self._filter_spec:
+            # partial clone: objects excluded by the filter are fetched on demand
+            clone_args.append(f"--filter={self._filter_spec}")
+        if self._sparse_paths:
+            # only check out files in the root until sparse checkout is configured
+            clone_args.append("--sparse")
+
+        parse_progress = progress.new_message_handler()
+        try:
+            for line in self._git(
+                *clone_args, "--", self.git_url, self.repo_dir, remote=True
+            ):
+                parse_progress(line)
+                while not progress.queue.empty():
+                    yield progress.queue.get()
+        except BaseException:
+            # a partial clone would be mistaken for a complete one later
+            shutil.rmtree(self.repo_dir, ignore_errors=True)
+            raise
+
+        GIT_RECEIVED_BYTES.labels(os.path.basename(self.repo_dir)).inc(
+            progress.received_bytes
+        )
+        yield from self.apply_sparse_checkout()
+        logging.info("Repo {} initialized".format(self.repo_dir))
+
+    def restore_snapshot(self, progress: CloneProgress) -> Generator:
+        """Restore the repository from a git bundle or a tarball of a clone.
+
+        Returns whether it was restored; if the snapshot is missing or
+        unusable the repository should be cloned from the remote instead.
+        """
+        if not self._snapshot:
+            return False
+        if not os.path.isfile(self._snapshot):
+            logging.warning(f"Snapshot {self._snapshot} not found")
+            return False
+        self._timeline.mark("restore-snapshot")
+        try:
+            if tarfile.is_tarfile(self._snapshot):
+                yield from self._extract_snapshot(progress)
+            else:
+                parse_progress = progress.new_message_handler()
+                clone_args = ["clone", "--progress", "--branch", self.branch_name]
+                if self._sparse_paths:
+                    clone_args.append("--sparse")
+                for line in self._git(*clone_args, "--", self._snapshot, self.repo_dir):
+                    parse_progress(line)
+                    while not progress.queue.empty():
+                        yield progress.queue.get()
+            branch = self._run("branch", "--show-current", cwd=self.repo_dir)
+            if branch.strip() != self.branch_name:
+                raise ValueError(
+                    f"{branch.strip() or 'HEAD'} is checked out"
+                    f" instead of {self.branch_name}"
+                )
+            self._run("remote", "set-url", "origin", self.git_url, cwd=self.repo_dir)
+        except Exception as e:
+            shutil.rmtree(self.repo_dir, ignore_errors=True)
+            if self._cancellation.cancelled:
+                raise
+            logging.warning(
+                f"Could not restore {self.repo_dir} from {self._snapshot}: {e}"
+            )
+            yield f"Could not use snapshot ({e}), cloning from the remote\n"
+            return False
+        except BaseException:
+            shutil.rmtree(self.repo_dir, ignore_errors=True)
+            raise
+        return True
+
+    def _extract_snapshot(self, progress: CloneProgress):
+        """Extract a tarball of a clone (optionally in a single top directory)."""
+        parent = os.path.dirname(os.path.abspath(self.repo_dir))
+        os.makedirs(parent, exist_ok=True)
+        # extract next to the destination, so that it can be moved in place
+        staging = tempfile.mkdtemp(prefix=".snapshot-", dir=parent)
+        try:
+            size = os.path.getsize(self._snapshot)
+            op_code = git.RemoteProgress.RECEIVING | git.RemoteProgress.BEGIN
+            with open(self._snapshot, "rb") as file, tarfile.open(
+                fileobj=file, mode="r|*"
+            ) as archive:
+                if hasattr(tarfile, "data_filter"):
+                    # refuse absolute paths, links outside of the archive, etc.
+                    archive.extraction_filter = tarfile.data_filter
+                for member in archive:
+                    self._cancellation.check()
+                    if os.path.isabs(member.name) or ".." in member.name.split("/"):
+                        raise ValueError(f"unsafe path {member.name}")
+                    if member.issym() or member.islnk():
+                        self._check_link(member, staging)
+                    archive.extract(member, staging)
+                    progress.update(
+                        op_code,
+                        file.tell(),
+                        size,
+                        f"Restoring snapshot ({file.tell() / 2**20:.1f} MiB)",
+                    )
+                    op_code = git.RemoteProgress.RECEIVING
+                    while not progress.queue.empty():
+                        yield progress.queue.get()
+            root = staging
+            entries = os.listdir(staging)
+            if len(entries) == 1 and entries[0] != ".git":
+                root = os.path.join(staging, entries[0])
+            if not os.path.isdir(os.path.join(root, ".git")):
+                raise ValueError("the tarball does not contain a clone")
+            os.rename(root, self.repo_dir)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        yield Update(progress=0.8, message="Restored snapshot")
+
+    @staticmethod
+    def _check_link(member: tarfile.TarInfo, staging: str):
+        """Refuse links to outside of the extraction directory.
+
+        Only needed where `tarfile.data_filter` is not available; a file
+        could be written anywhere through such a link otherwise.
+        """
+        if member.issym():
+            base = os.path.join(staging, os.path.dirname(member.name))
+        else:
+            # hard links are relative to the root of the archive
+            base = staging
+        root = os.path.realpath(staging)
+        target = os.path.realpath(os.path.join(base, member.linkname))
+        if os.path.commonpath([root, target]) != root:
+            raise ValueError(f"unsafe link {member.name} -> {member.linkname}")
+
+    def apply_sparse_checkout(self):
+        """Restrict the working tree to configured paths (if any).
+
+        With a partial clone this fetches the blobs needed for these paths.
+        """
+        if not self._sparse_paths:
+            return
+        self._timeline.mark("sparse-checkout")
+        yield Update(
+            progress=1,
+            message="Checking out {}".format(", ".join(self._sparse_paths)),
+        )
+        self._run(
+            "sparse-checkout",
+            "set",
+            "--cone",
+            "--",
+            *self._sparse_paths,
+            cwd=self.repo_dir,
+        )
+
+    def update(self):
+        try:
+            # the paths may have been changed in the configuration since the clone
+            yield from self.apply_sparse_checkout()
+            yield from super().update()
+        except BaseException:
+            if self._cancellation.cancelled:
+                self.recover_interrupted_update()
+            raise
+
+    def recover_interrupted_update(self):
+        """Remove what git left behind when stopped during an update.
+
+        Otherwise nbgitpuller would refuse to update the repository
+        until the lock file is old enough to be considered stale.
+        """
+        git_dir = os.path.join(self.repo_dir, ".git")
+        try:
+            # git was killed, rather than terminated, while holding the lock
+            os.remove(os.path.join(git_dir, "index.lock"))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f"Could not remove the index lock of {self.repo_dir}: {e}")
+        if os.path.exists(os.path.join(git_dir, "MERGE_HEAD")):
+            subprocess.run(
+                ["git", "merge", "--abort"],
+                cwd=self.repo_dir,
+                stdin=subprocess.DEVNULL,
+                capture_output=True,
+            )
+
+    def update_remotes(self):
+        self._timeline.mark("fetch")
+        # only parsed to count the received bytes, the lines are output as is
+        progress = CloneProgress()
+        parse_progress = progress.new_message_handler()
+        for line in self._stream("fetch", "--progress", cwd=self.repo_dir, remote=True):
+            parse_progress(line.rstrip("\n"))
+            yield line
+        GIT_RECEIVED_BYTES.labels(os.path.basename(self.repo_dir)).inc(
+            progress.received_bytes
+        )
+        # nbgitpuller then commits local changes and merges
+        self._timeline.mark("merge")
+
+    # nbgitpuller runs git without the credentials of the exhibit, but
+    # in a partial clone checking out files fetches missing blobs
+
+    def find_upstream_changed(self, kind):
+        # rename detection would compare (and so fetch) blobs
+        output = self._run(
+            "diff",
+            "--no-renames",
+            "..origin/{}".format(self.branch_name),
+            "--name-status",
+            cwd=self.repo_dir,
+        )
+        return [
+            line.split("\t", 1)[1]
+            for line in output.split("\n")
+            if line.startswith(kind)
+        ]
+
+    def reset_deleted_files(self):
+        yield from self.ensure_lock()
+        output = self._run("ls-files", "--deleted", "-z", cwd=self.repo_dir)
+        upstream_deleted = self.find_upstream_changed("D")
+        for filename in output.strip().split("\0"):
+            if not filename:
+                continue
+            # restore files deleted locally; those also deleted upstream are
+            # checked out from HEAD to avoid a conflict with git 2.40
+            ref = (
+                "HEAD"
+                if filename in upstream_deleted
+                else "origin/{}".format(self.branch_name)
+            )
+            yield from self._stream("checkout", ref, "--", filename, cwd=self.repo_dir)
+
+    def merge(self):
+        try:
+            output = yield from self._stream(
+                "-c",
+                "user.email=nbgitpuller@nbgitpuller.link",
+                "-c",
+                "user.name=nbgitpuller",
+                "merge",
+                "-Xours",
+                "origin/{}".format(self.branch_name),
+                cwd=self.repo_dir,
+            )
+        except git.GitCommandError as e:
+            if "CONFLICT (modify/delete)" not in (e.stdout or ""):
+                raise
+            # keep files modified locally but deleted upstream
+            yield "Caught modify/delete conflict, trying to resolve\n"
+            yield from self.commit_all()
+            return
+        yield output
@@ -0,0 +1,43 @@
+import re
+from bisect import bisect_left
+
+_word_re = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    return _word_re.findall(text.casefold())
+
+
+class ExhibitIndex:
+    """Inverted index of the titles and descriptions of exhibits.
+
+    An exhibit matches a query if every word of the query is
+    the beginning of a word of its title or description.
+    """
+
+    def __init__(self, exhibits: dict[int, dict]):
+        self._ids = set(exhibits)
+        self._postings: dict[str, set[int]] = {}
+        for exhibit_id, exhibit in exhibits.items():
+            text = " ".join(exhibit.get(key) or "" for key in ["title", "description"])
+            for word in tokenize(text):
+                self._postings.setdefault(word, set()).add(exhibit_id)
+        # sorted, so that words with a given prefix are contiguous
+        self._words = sorted(self._postings)
+
+    def _prefixed(self, prefix: str) -> set[int]:
+        matches: set[int] = set()
+        position = bisect_left(self._words, prefix)
+        while position < len(self._words) and self._words[position].startswith(prefix):
+            matches |= self._postings[self._words[position]]
+            position += 1
+        return matches
+
+    def search(self, query: str) -> set[int]:
+        """Ids of exhibits matching the query (all exhibits for an empty query)."""
+        result = set(self._ids)
+        for term in tokenize(query):
+            result &= self._prefixed(term)
+            if not result:
+                break
+        return result
@@ -0,0 +1,163 @@
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from pathlib import Path
+from threading import Lock
+from typing import Callable, Generic, Hashable, Iterator, Optional, TypeVar, Union
+import os
+import tempfile
+import time
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class StateStore(Generic[K, V]):
+    """Thread-safe mapping bounded in size and in age of entries.
+
+    Entries expire `ttl` seconds after they were last set; when more than
+    `max_size` entries are stored, the least recently set are evicted.
+    Expired entries are removed whenever the store is accessed.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 1000,
+        ttl: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        # values with the time they were set, least recently set first
+        self._entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        self._lock = Lock()
+
+    def _evict(self):
+        if self.ttl is not None:
+            expired_before = self._clock() - self.ttl
+            while self._entries:
+                key, (set_at, _) = next(iter(self._entries.items()))
+                if set_at > expired_before:
+                    break
+                del self._entries[key]
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def get(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        with self._lock:
+            self._evict()
+            entry = self._entries.get(key)
+        return default if entry is None else entry[1]
+
+    def __getitem__(self, key: K) -> V:
+        with self._lock:
+            self._evict()
+            return self._entries[key][1]
+
+    def __setitem__(self, key: K, value: V):
+        with self._lock:
+            self._entries[key] = (self._clock(), value)
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def setdefault(self, key: K, default: V) -> V:
+        with self._lock:
+            self._evict()
+            if key not in self._entries:
+                self._entries[key] = (self._clock(), default)
+                self._evict()
+                return default
+            return self._entries[key][1]
+
+    def pop(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def retain(self, keys: set[K]):
+        """Remove all entries except these with given keys."""
+        with self._lock:
+            for key in [key for key in self._entries if key not in keys]:
+                del self._entries[key]
+
+    def __contains__(self, key: K) -> bool:
+        with self._lock:
+            self._evict()
+            return key in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._evict()
+            return len(self._entries)
+
+    def __iter__(self) -> Iterator[K]:
+        return iter(self.keys())
+
+    def keys(self) -> list[K]:
+        with self._lock:
+            self._evict()
+            return list(self._entries)
+
+    def values(self) -> list[V]:
+        with self._lock:
+            self._evict()
+            return [value for _, value in self._entries.values()]
+
+    def items(self) -> list[tuple[K, V]]:
+        with self._lock:
+            self._evict()
+            return [(key, value) for key, (_, value) in self._entries.items()]
+
+
+class KeyedLocks(Generic[K]):
+    """Asyncio locks by key, dropped once no task holds or waits for them."""
+
+    def __init__(self):
+        # locks with the number of tasks holding or waiting for them
+        self._locks: dict[K, tuple[asyncio.Lock, int]] = {}
+
+    def locked(self, key: K) -> bool:
+        return key in self._locks and self._locks[key][0].locked()
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def hold(self, key: K):
+        lock, users = self._locks.get(key, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self._locks[key] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._locks[key]
+            if users == 1:
+                del self._locks[key]
+            else:
+                self._locks[key] = (lock, users - 1)
+
+
+def atomic_write(path: Path, data: Union[str, bytes]):
+    """Replace the file at `path` with `data`.
+
+    Data is written to a temporary file in the same directory which is then
+    renamed, so that readers (possibly in other processes) never see a
+    partially written file; the temporary file is removed if writing fails.
+    """
+    # hidden, so that it is skipped when listing the directory
+    fd, temporary = tempfile.mkstemp(
+        dir=path.parent, prefix=f".{path.name}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(data.encode("utf-8") if isinstance(data, str) else data)
+        os.replace(temporary, path)
+    except BaseException:
+        try:
+            os.unlink(temporary)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,128 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+import pytest
+
+from jupyterlab_gallery.git_utils import (
+    AsyncGitRunner,
+    GitTimeoutError,
+    RemoteRefCache,
+    check_updates,
+    credentials_env,
+    has_remote_updates,
+    has_updates,
+)
+
+
+async def test_has_updates(tmp_path, git_remote):
+    clone = tmp_path / "clone"
+    subprocess.run(["git", "clone", git_remote.url, str(clone)], check=True)
+    runner = AsyncGitRunner()
+
+    assert not await has_updates(clone, runner=runner)
+
+    git_remote.push_commit("second")
+    assert await has_updates(clone, runner=runner)
+
+
+async def test_check_updates_fails_when_fetch_fails(tmp_path, git_remote):
+    clone = tmp_path / "clone"
+    subprocess.run(["git", "clone", git_remote.url, str(clone)], check=True)
+    git_remote.push_commit("second")
+    subprocess.run(["git", "fetch", "--quiet"], cwd=clone, check=True)
+    # the remote-tracking branch and FETCH_HEAD must not be reported as current
+    subprocess.run(
+        ["git", "remote", "set-url", "origin", str(tmp_path / "missing")],
+        cwd=clone,
+        check=True,
+    )
+    with pytest.raises(RuntimeError, match="git fetch failed"):
+        await check_updates(clone, runner=AsyncGitRunner())
+
+
+async def test_has_remote_updates(tmp_path, git_remote):
+    clone = tmp_path / "clone"
+    subprocess.run(["git", "clone", git_remote.url, str(clone)], check=True)
+    runner = AsyncGitRunner()
+    fetch_head = clone / ".git" / "FETCH_HEAD"
+
+    assert not await has_remote_updates(
+        clone, git_remote.url, runner=runner, ref_cache=RemoteRefCache(ttl=0)
+    )
+
+    git_remote.push_commit("second")
+    ref_cache = RemoteRefCache(ttl=60, path=tmp_path / "refs")
+    assert await has_remote_updates(
+        clone, git_remote.url, runner=runner, ref_cache=ref_cache
+    )
+    assert not fetch_head.exists()
+
+    # once pulled, the cached remote head is the local HEAD
+    subprocess.run(["git", "pull", "--quiet"], cwd=clone, check=True)
+    assert not await has_remote_updates(
+        clone, git_remote.url, runner=runner, ref_cache=ref_cache
+    )
+
+
+async def test_ref_cache_queries_remote_once(tmp_path, git_remote):
+    runner = AsyncGitRunner()
+    ref_cache = RemoteRefCache(ttl=60, path=tmp_path / "refs")
+    first, second = await asyncio.gather(
+        ref_cache.get(git_remote.url, runner=runner, cwd=tmp_path),
+        ref_cache.get(git_remote.url, runner=runner, cwd=tmp_path),
+    )
+    assert first == second
+    assert list(first) == ["main"]
+
+    # another server sharing the cache directory reuses the result
+    git_remote.push_commit("second")
+    shared = RemoteRefCache(ttl=60, path=tmp_path / "refs")
+    assert await shared.get(git_remote.url, runner=runner, cwd=tmp_path) == first
+    assert (
+        await RemoteRefCache(ttl=0).get(git_remote.url, runner=runner, cwd=tmp_path)
+        != first
+    )
+
+
+async def test_runner_kills_process_on_timeout(tmp_path):
+    # an alias running a slow shell command stands in for a hung remote
+    runner = AsyncGitRunner(timeout=0.1)
+    with pytest.raises(GitTimeoutError):
+        await runner.run(
+            "-c",
+            f"alias.hang=!{sys.executable} -c 'import time; time.sleep(10)'",
+            "hang",
+            cwd=tmp_path,
+        )
+
+
+async def test_runner_terminates_process_before_killing(tmp_path):
+    # git removes its lock files when terminated, as this shell removes its own
+    (tmp_path / "index.lock").touch()
+    runner = AsyncGitRunner(timeout=0.5)
+    with pytest.raises(GitTimeoutError):
+        await runner.run(
+            "-c",
+            "alias.hang=!trap 'rm index.lock; exit 1' TERM; sleep 10 & wait",
+            "hang",
+            cwd=tmp_path,
+        )
+    assert not (tmp_path / "index.lock").exists()
+
+
+def test_credentials_env_is_scoped_to_process(tmp_path):
+    env = credentials_env(token="secret-token", account="my-account")
+    result = subprocess.run(
+        ["git", "-c", "credential.helper=", "credential", "fill"],
+        input="protocol=https\nhost=example.com\n\n",
+        env={**os.environ, **env},
+        cwd=tmp_path,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert "username=my-account" in result.stdout
+    assert "password=secret-token" in result.stdout
+    assert "GIT_PULLER_TOKEN" not in os.environ
@@ -0,0 +1,194 @@
+import asyncio
+import io
+import tarfile
+import threading
+from functools import partial
+
+import git
+import pytest
+
+from jupyterlab_gallery.gitpuller import (
+    OutputCoalescer,
+    ProgressBus,
+    PullTimeoutError,
+    Update,
+)
+from jupyterlab_gallery.puller import CloneProgress, ProgressGitPuller
+
+
+async def test_progress_bus_replays_last_message():
+    bus = ProgressBus()
+    bus.publish(0, Update(progress=0.5, message="Receiving"))
+    bus.publish(0, None)
+    queue = bus.subscribe()
+    assert queue.get_nowait() == (2, {"phase": "finished", "exhibit_id": 0})
+    assert queue.empty()
+
+
+async def test_output_published_from_thread():
+    bus = ProgressBus()
+    queue = bus.subscribe()
+    output = OutputCoalescer(partial(bus.publish, 1))
+    thread = threading.Thread(target=output.publish_threadsafe, args=("line",))
+    thread.start()
+    event = await asyncio.wait_for(queue.get(), timeout=5)
+    thread.join()
+    assert event.message == {"output": "line", "phase": "syncing", "exhibit_id": 1}
+
+
+async def test_progress_bus_bounded_queue():
+    bus = ProgressBus(max_queue_size=2)
+    queue = bus.subscribe()
+    for i in range(3):
+        bus.publish(0, Update(progress=i / 3, message=str(i)))
+    assert queue.qsize() == 2
+    assert queue.get_nowait().message["output"]["message"] == "1"
+    bus.unsubscribe(queue)
+    assert queue.get_nowait().message["output"]["message"] == "2"
+    assert queue.get_nowait() is None
+
+
+async def test_progress_bus_replays_after_last_event_id():
+    bus = ProgressBus(history_size=2)
+    for i in range(3):
+        bus.publish(0, Update(progress=i / 3, message=str(i)))
+    bus.publish(1, RuntimeError("failed"))
+    bus.publish(0, None)
+
+    queue = bus.subscribe(last_event_id=1)
+    events = [queue.get_nowait() for _ in range(queue.qsize())]
+    # the first event of exhibit 0 fell out of its history
+    assert [event.id for event in events] == [3, 4, 5]
+    assert events[1].message["phase"] == "error"
+
+    # ids from before a server restart are ignored
+    queue = bus.subscribe(last_event_id=100)
+    assert [queue.get_nowait().id for _ in range(queue.qsize())] == [4, 5]
+
+
+def drain(queue):
+    items = []
+    while not queue.empty():
+        items.append(queue.get_nowait())
+    return items
+
+
+def test_clone_progress_is_throttled():
+    progress = CloneProgress(min_interval=60, min_delta=0.01)
+    receiving = git.RemoteProgress.RECEIVING
+    progress.update(git.RemoteProgress.BEGIN | receiving, 0, 10000, "Receiving")
+    for i in range(1, 10000):
+        progress.update(receiving, i, 10000, "Receiving")
+    progress.update(git.RemoteProgress.END | receiving, 10000, 10000, "Done")
+    updates = drain(progress.queue)
+    # only the phase transition and the final event
+    assert [update["message"] for update in updates] == ["Receiving", "Done"]
+    assert updates[-1]["progress"] == 0.8
+
+
+def test_clone_progress_emits_on_delta():
+    progress = CloneProgress(min_interval=0, min_delta=0.1)
+    receiving = git.RemoteProgress.RECEIVING
+    progress.update(git.RemoteProgress.BEGIN | receiving, 0, 1000)
+    for i in range(1, 1000):
+        progress.update(receiving, i, 1000)
+    updates = drain(progress.queue)
+    assert 5 < len(updates) < 20
+
+
+async def test_output_coalescer_preserves_order():
+    published = []
+    output = OutputCoalescer(published.append, min_interval=60)
+    error = RuntimeError("failed")
+    for update in ["a\n", "b\n", "c\n", Update(progress=0.5, message=""), "d\n"]:
+        output.publish(update)
+    output.publish(error)
+    assert published == [
+        "a\n",
+        "b\nc\n",
+        Update(progress=0.5, message=""),
+        "d\n",
+        error,
+    ]
+
+
+async def test_output_coalescer_flushes_on_timer():
+    published = []
+    output = OutputCoalescer(published.append, min_interval=0.05)
+    output.publish("$ git fetch\n")
+    output.publish("$ git merge\n")
+    assert published == ["$ git fetch\n"]
+    # published although nothing follows, e.g. during a long silent fetch
+    await asyncio.sleep(0.1)
+    assert published == ["$ git fetch\n", "$ git merge\n"]
+
+
+def test_clone_progress_reports_checkout():
+    progress = CloneProgress(min_interval=0, min_delta=0)
+    progress._parse_progress_line("Receiving objects: 100% (10/10), done.")
+    progress._parse_progress_line("Updating files:  50% (1/2)")
+    progress._parse_progress_line("Receiving objects: 100% (1/1), done.")
+    progress._parse_progress_line("Updating files: 100% (2/2), done.")
+    updates = drain(progress.queue)
+    assert [update["progress"] for update in updates] == [0.8, 0.9, 0.9, 1]
+
+
+def test_clone_progress_counts_received_bytes():
+    progress = CloneProgress()
+    progress._parse_progress_line(
+        "Receiving objects:  50% (5/10), 1.50 MiB | 3.00 MiB/s"
+    )
+    progress._parse_progress_line(
+        "Receiving objects: 100% (10/10), 3.00 MiB | 3.00 MiB/s, done."
+    )
+    assert progress.received_bytes == 3 * 1024**2
+
+    # small fetches unpack objects, reporting sizes in bytes
+    progress = CloneProgress()
+    progress._parse_progress_line(
+        "Unpacking objects: 100% (3/3), 234 bytes | 234.00 KiB/s, done."
+    )
+    assert progress.received_bytes == 234
+
+
+def test_connect_timeout_only_applies_to_remote_commands(tmp_path, git_remote):
+    puller = ProgressGitPuller(
+        git_remote.url,
+        str(tmp_path / "clone"),
+        token=None,
+        account=None,
+        branch="main",
+        connect_timeout=0.1,
+    )
+    # a silent local command, e.g. sparse checkout fetching blobs
+    wait = ["-c", "alias.wait=!sleep 0.5", "wait"]
+    puller._run(*wait, cwd=str(tmp_path))
+    with pytest.raises(PullTimeoutError):
+        puller._run(*wait, cwd=str(tmp_path), remote=True)
+
+
+def test_snapshot_links_must_stay_inside(tmp_path, git_remote, monkeypatch):
+    # as on Python versions without extraction filters
+    monkeypatch.delattr(tarfile, "data_filter", raising=False)
+    snapshot = tmp_path / "snapshot.tar"
+    with tarfile.open(snapshot, "w") as archive:
+        link = tarfile.TarInfo("remote/escape")
+        link.type = tarfile.SYMTYPE
+        link.linkname = "../../../outside"
+        archive.addfile(link)
+        data = b"written through the link"
+        member = tarfile.TarInfo("remote/escape/file")
+        member.size = len(data)
+        archive.addfile(member, io.BytesIO(data))
+    (tmp_path / "outside").mkdir()
+    puller = ProgressGitPuller(
+        git_remote.url,
+        str(tmp_path / "gallery" / "remote"),
+        token=None,
+        account=None,
+        branch="main",
+        snapshot=str(snapshot),
+    )
+    with pytest.raises(ValueError, match="unsafe link"):
+        list(puller._extract_snapshot(CloneProgress()))
+    assert not (tmp_path / "outside" / "file").exists()
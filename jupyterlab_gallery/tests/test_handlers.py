@@ -1,10 +1,22 @@
+import asyncio
+import base64
 import json
+import socket
+import subprocess
+import tarfile
+from pathlib import Path
 from unittest import mock
+import nbgitpuller.pull
 import pytest
 
 from jupyter_server.utils import url_path_join
+from tornado.httpclient import HTTPClientError
 
+from jupyterlab_gallery.gitpuller import ProgressBus
+from jupyterlab_gallery.icons import IconFetcher
 from jupyterlab_gallery.manager import GalleryManager
+from jupyterlab_gallery.metrics import REGISTRY
+from jupyterlab_gallery.prefetch import ExhibitPrefetcher
 
 
 async def test_exhibits(jp_fetch):
@@ -14,6 +26,59 @@ async def test_exhibits(jp_fetch):
     assert isinstance(payload["exhibits"], list)
 
 
+async def test_exhibits_search_and_pages(jp_serverapp, jp_fetch, monkeypatch):
+    exhibits = [
+        {"git": f"https://example.com/org/{name}.git", "title": title}
+        for name, title in [
+            ("intro", "Intro to Python"),
+            ("maps", "Maps with Python"),
+            ("rust", "Rust basics"),
+            ("advanced", "Advanced Python"),
+        ]
+    ]
+    (Path(jp_serverapp.root_dir) / "gallery" / "maps").mkdir(parents=True)
+    # local paths are relative to the working directory
+    monkeypatch.chdir(jp_serverapp.root_dir)
+    manager = jp_serverapp.web_app.settings["gallery_manager"]
+
+    async def get_page(**params):
+        response = await jp_fetch("jupyterlab-gallery", "exhibits", params=params)
+        return json.loads(response.body)
+
+    manager._exhibit_data.clear()
+
+    with mock.patch.object(GalleryManager, "exhibits", exhibits):
+        page = await get_page(q="python", fields="title", limit=2)
+        assert page["exhibits"] == [
+            {"title": "Intro to Python", "id": 0},
+            {"title": "Maps with Python", "id": 1},
+        ]
+        # only configuration fields were requested
+        assert not manager._exhibit_data
+        page = await get_page(
+            q="python", fields="title", limit=2, cursor=page["next_cursor"]
+        )
+        assert page["exhibits"] == [{"title": "Advanced Python", "id": 3}]
+        assert page["next_cursor"] is None
+
+        page = await get_page(cloned="true", fields="isCloned,localPath")
+        assert page["exhibits"] == [
+            {"isCloned": True, "localPath": "gallery/maps", "id": 1}
+        ]
+
+        manager._exhibit_data.clear()
+        page = await get_page(limit=1)
+        assert [exhibit["id"] for exhibit in page["exhibits"]] == [0]
+        assert page["next_cursor"] is not None
+        # the state is only computed for the returned page
+        assert len(manager._exhibit_data) == 1
+
+        for params in [{"fields": "git"}, {"limit": "-1"}, {"cursor": "x"}]:
+            with pytest.raises(HTTPClientError) as e:
+                await get_page(**params)
+            assert e.value.code == 400
+
+
 @pytest.mark.parametrize(
     "exhibit",
     [
@@ -29,7 +94,9 @@ async def test_exhibits(jp_fetch):
     ],
 )
 async def test_exhibit_generate_github_icon(jp_serverapp, jp_fetch, exhibit):
-    with mock.patch.object(GalleryManager, "exhibits", [exhibit]):
+    with mock.patch.object(GalleryManager, "exhibits", [exhibit]), mock.patch.object(
+        GalleryManager, "icon_proxy", False
+    ):
         response = await jp_fetch("jupyterlab-gallery", "exhibits")
     assert response.code == 200
     payload = json.loads(response.body)
@@ -40,6 +107,83 @@ async def test_exhibit_generate_github_icon(jp_serverapp, jp_fetch, exhibit):
     )
 
 
+class StubIconFetcher(IconFetcher):
+    fetched: list[str] = []
+
+    async def fetch(self, url):
+        self.fetched.append(url)
+        return b"\x89PNG\r\n\x1a\nicon", "application/octet-stream"
+
+
+async def test_icon_proxy(jp_fetch, tmp_path):
+    svg = b'<svg xmlns="http://www.w3.org/2000/svg"></svg>'
+    exhibits = [
+        {
+            "git": "https://github.com/nebari-dev/nebari.git",
+            "homepage": "https://github.com/nebari-dev/nebari",
+        },
+        {
+            "git": "https://example.com/org/repo.git",
+            "icon": "data:image/svg+xml;base64," + base64.b64encode(svg).decode(),
+        },
+    ]
+    with mock.patch.object(GalleryManager, "exhibits", exhibits), mock.patch.object(
+        GalleryManager, "icon_cache_dir", str(tmp_path / "icons")
+    ), mock.patch.object(GalleryManager, "icon_fetcher_class", StubIconFetcher):
+        response = await jp_fetch("jupyterlab-gallery", "exhibits")
+        payload = json.loads(response.body)
+        keys = [e["icon"].rsplit("/", 1)[1] for e in payload["exhibits"]]
+        assert payload["exhibits"][0]["icon"].endswith(
+            f"/jupyterlab-gallery/icons/{keys[0]}"
+        )
+
+        response = await jp_fetch("jupyterlab-gallery", "icons", keys[0])
+        assert response.body == b"\x89PNG\r\n\x1a\nicon"
+        assert response.headers["Content-Type"] == "image/png"
+        assert "max-age" in response.headers["Cache-Control"]
+        etag = response.headers["ETag"]
+        with pytest.raises(HTTPClientError) as e:
+            await jp_fetch(
+                "jupyterlab-gallery", "icons", keys[0], headers={"If-None-Match": etag}
+            )
+        assert e.value.code == 304
+        assert StubIconFetcher.fetched == [
+            "https://opengraph.githubassets.com/1/nebari-dev/nebari"
+        ]
+
+        response = await jp_fetch("jupyterlab-gallery", "icons", keys[1])
+        assert response.body == svg
+        assert response.headers["Content-Type"] == "image/svg+xml"
+
+        with pytest.raises(HTTPClientError) as e:
+            await jp_fetch("jupyterlab-gallery", "icons", "0123abc")
+        assert e.value.code == 404
+
+
+async def test_reload_config(jp_serverapp, jp_fetch, jp_config_dir):
+    (app,) = jp_serverapp.extension_manager.extension_apps["jupyterlab_gallery"]
+    settings = jp_serverapp.web_app.settings
+    bus = settings.setdefault("progress_bus", ProgressBus())
+    config_file = jp_config_dir / "jupyter_gallery_config.json"
+
+    async def reload(exhibits) -> dict:
+        config_file.write_text(json.dumps({"GalleryManager": {"exhibits": exhibits}}))
+        app.reload_config()
+        response = await jp_fetch("jupyterlab-gallery", "exhibits")
+        return {e["title"]: e["id"] for e in json.loads(response.body)["exhibits"]}
+
+    first = {"git": "https://example.com/org/first.git", "title": "first"}
+    second = {"git": "https://example.com/org/second.git", "title": "second"}
+    ids = await reload([first, second])
+    assert bus._history[("exhibits",)][-1].message["phase"] == "exhibits-changed"
+
+    third = {"git": "https://example.com/org/third.git", "title": "third"}
+    new_ids = await reload([third, second, {**first, "title": "renamed"}])
+    assert new_ids["second"] == ids["second"]
+    assert new_ids["renamed"] == ids["first"]
+    assert new_ids["third"] not in ids.values()
+
+
 async def test_gallery(jp_fetch):
     response = await jp_fetch("jupyterlab-gallery", "gallery")
     assert response.code == 200
@@ -61,3 +205,670 @@ async def test_pull_token_can_be_used_instead_of_xsrf(
     assert response.code == 406
     payload = json.loads(response.body)
     assert payload["message"] == "exhibit_id 100 not found"
+
+
+def last_message(bus: ProgressBus, exhibit_id: int) -> dict:
+    """Latest progress message published for the exhibit."""
+    history = bus._history.get(exhibit_id)
+    return history[-1].message if history else {}
+
+
+async def wait_for_pulls(settings, exhibit_ids):
+    bus = settings["progress_bus"]
+    for _ in range(500):
+        phases = {last_message(bus, i).get("phase") for i in exhibit_ids}
+        if phases <= {"finished", "error", "cancelled"}:
+            return
+        await asyncio.sleep(0.02)
+    raise TimeoutError(
+        f"Pulls did not finish: {[last_message(bus, i) for i in exhibit_ids]}"
+    )
+
+
+async def test_pull_exhibits_in_parallel(jp_serverapp, jp_fetch, make_git_remote):
+    exhibits = []
+    for name in ["one", "two"]:
+        remote = make_git_remote(name)
+        exhibits.append({"git": remote.url, "title": name})
+    settings = jp_serverapp.web_app.settings
+
+    with mock.patch.object(GalleryManager, "exhibits", exhibits), mock.patch.object(
+        GalleryManager, "max_concurrent_pulls", 2
+    ):
+        for exhibit_id in [0, 1, 0]:
+            response = await jp_fetch(
+                "jupyterlab-gallery",
+                "pull",
+                method="POST",
+                body=json.dumps({"exhibit_id": exhibit_id}),
+            )
+            assert response.code == 200
+        assert len(settings["active_pulls"]) == 2
+        await wait_for_pulls(settings, [0, 1])
+
+    assert last_message(settings["progress_bus"], 0)["phase"] == "finished"
+    assert last_message(settings["progress_bus"], 1)["phase"] == "finished"
+    root_dir = Path(jp_serverapp.root_dir)
+    assert (root_dir / "gallery" / "one" / "first").exists()
+    assert (root_dir / "gallery" / "two" / "first").exists()
+    assert not settings["active_pulls"]
+
+
+@pytest.fixture
+def unresponsive_remote():
+    """URL of a git server which accepts connections but never responds."""
+    # connections are established in the backlog, but are never answered
+    with socket.create_server(("127.0.0.1", 0), backlog=16) as server:
+        port = server.getsockname()[1]
+        yield f"git://127.0.0.1:{port}/exhibit.git"
+
+
+async def test_cancel_pull(jp_serverapp, jp_fetch, unresponsive_remote):
+    exhibits = [{"git": unresponsive_remote, "title": "stalled"}]
+    settings = jp_serverapp.web_app.settings
+
+    with mock.patch.object(GalleryManager, "exhibits", exhibits):
+        await jp_fetch(
+            "jupyterlab-gallery",
+            "pull",
+            method="POST",
+            body=json.dumps({"exhibit_id": 0}),
+        )
+        (active_pull,) = settings["active_pulls"].values()
+        # let git start and hang
+        await asyncio.sleep(0.5)
+        response = await jp_fetch(
+            "jupyterlab-gallery", "pull", method="DELETE", params={"exhibit_id": 0}
+        )
+        assert response.code == 202
+        assert await asyncio.wait_for(active_pull.task, 10) is False
+
+        with pytest.raises(HTTPClientError) as e:
+            await jp_fetch(
+                "jupyterlab-gallery", "pull", method="DELETE", params={"exhibit_id": 0}
+            )
+        assert e.value.code == 404
+
+    assert last_message(settings["progress_bus"], 0)["phase"] == "cancelled"
+    assert not settings["active_pulls"]
+    assert not settings["repo_locks"]
+    assert not (Path(jp_serverapp.root_dir) / "gallery" / "stalled").exists()
+
+
+async def test_cancel_update(jp_serverapp, jp_fetch, git_remote):
+    settings = jp_serverapp.web_app.settings
+    clone = Path(jp_serverapp.root_dir) / "gallery" / "remote"
+
+    async def pull():
+        await jp_fetch(
+            "jupyterlab-gallery",
+            "pull",
+            method="POST",
+            body=json.dumps({"exhibit_id": 0}),
+        )
+
+    with mock.patch.object(GalleryManager, "exhibits", [{"git": git_remote.url}]):
+        await pull()
+        await wait_for_pulls(settings, [0])
+        # checking out the new file hangs while holding the index lock
+        (clone / ".git" / "info").mkdir(exist_ok=True)
+        (clone / ".git" / "info" / "attributes").write_text("*.txt filter=slow\n")
+        subprocess.run(
+            ["git", "config", "filter.slow.smudge", "sleep 60; cat"],
+            cwd=clone,
+            check=True,
+        )
+        git_remote.push_commit("slow.txt")
+
+        await pull()
+        (active_pull,) = settings["active_pulls"].values()
+        for _ in range(500):
+            if (clone / ".git" / "index.lock").exists():
+                break
+            await asyncio.sleep(0.02)
+        else:
+            raise TimeoutError("The update did not start merging")
+        response = await jp_fetch(
+            "jupyterlab-gallery", "pull", method="DELETE", params={"exhibit_id": 0}
+        )
+        assert response.code == 202
+        assert await asyncio.wait_for(active_pull.task, 10) is False
+        assert last_message(settings["progress_bus"], 0)["phase"] == "cancelled"
+        assert not (clone / ".git" / "index.lock").exists()
+        assert not (clone / ".git" / "MERGE_HEAD").exists()
+
+        # the next update is not refused because of a stale lock
+        subprocess.run(
+            ["git", "config", "filter.slow.smudge", "cat"], cwd=clone, check=True
+        )
+        await pull()
+        await wait_for_pulls(settings, [0])
+
+    assert last_message(settings["progress_bus"], 0)["phase"] == "finished"
+    assert (clone / "slow.txt").read_text() == "slow.txt"
+
+
+async def test_pull_connect_timeout(jp_serverapp, jp_fetch, unresponsive_remote):
+    exhibits = [
+        {"git": unresponsive_remote, "title": "stalled", "connect_timeout": 0.5}
+    ]
+    settings = jp_serverapp.web_app.settings
+
+    with mock.patch.object(GalleryManager, "exhibits", exhibits):
+        await jp_fetch(
+            "jupyterlab-gallery",
+            "pull",
+            method="POST",
+            body=json.dumps({"exhibit_id": 0}),
+        )
+        await wait_for_pulls(settings, [0])
+
+    message = last_message(settings["progress_bus"], 0)
+    assert message["phase"] == "error"
+    assert "did not connect to the remote within 0.5 seconds" in message["message"]
+    assert not (Path(jp_serverapp.root_dir) / "gallery" / "stalled").exists()
+
+
+async def test_pull_without_timeout(jp_serverapp, jp_fetch, unresponsive_remote):
+    # 0 disables the timeouts for the exhibit, overriding the defaults
+    exhibits = [
+        {"git": unresponsive_remote, "timeout": 0, "connect_timeout": 0},
+    ]
+    settings = jp_serverapp.web_app.settings
+
+    with mock.patch.object(GalleryManager, "exhibits", exhibits), mock.patch.object(
+        GalleryManager, "pull_timeout", 0.2
+    ), mock.patch.object(GalleryManager, "pull_connect_timeout", 0.2):
+        await jp_fetch(
+            "jupyterlab-gallery",
+            "pull",
+            method="POST",
+            body=json.dumps({"exhibit_id": 0}),
+        )
+        (active_pull,) = settings["active_pulls"].values()
+        await asyncio.sleep(1)
+        assert not active_pull.task.done()
+        await jp_fetch(
+            "jupyterlab-gallery", "pull", method="DELETE", params={"exhibit_id": 0}
+        )
+        assert await asyncio.wait_for(active_pull.task, 10) is False
+
+
+async def test_batch_pull(jp_serverapp, jp_fetch, tmp_path, git_remote):
+    exhibits = [
+        {"git": git_remote.url, "title": "remote"},
+        {"git": (tmp_path / "missing.git").as_uri(), "title": "missing"},
+    ]
+    settings = jp_serverapp.web_app.settings
+
+    with mock.patch.object(GalleryManager, "exhibits", exhibits):
+        with pytest.raises(HTTPClientError) as e:
+            await jp_fetch(
+                "jupyterlab-gallery",
+                "batch-pull",
+                method="POST",
+                body=json.dumps({"exhibit_ids": [0, 2]}),
+            )
+        assert e.value.code == 406
+
+        response = await jp_fetch(
+            "jupyterlab-gallery",
+            "batch-pull",
+            method="POST",
+            body=json.dumps({"exhibit_ids": "all"}),
+        )
+        payload = json.loads(response.body)
+        assert payload["exhibit_ids"] == [0, 1]
+        bus = settings["progress_bus"]
+        key = ("batch", payload["batch_id"])
+        for _ in range(500):
+            if key in bus._history:
+                break
+            await asyncio.sleep(0.02)
+
+    result = bus._history[key][-1].message
+    assert result["phase"] == "batch-finished"
+    assert result["succeeded"] == [0]
+    assert result["failed"] == [1]
+    assert last_message(bus, 1)["phase"] == "error"
+
+
+async def test_prefetch_exhibits(jp_serverapp, jp_fetch, make_git_remote):
+    exhibits = [
+        {"git": make_git_remote("low").url, "prefetch_priority": 0},
+        {"git": make_git_remote("skipped").url},
+        {"git": make_git_remote("high").url, "prefetch_priority": 10},
+    ]
+    settings = jp_serverapp.web_app.settings
+    manager = settings["gallery_manager"]
+
+    with mock.patch.object(GalleryManager, "exhibits", exhibits), mock.patch.object(
+        GalleryManager, "prefetch_concurrency", 1
+    ):
+        ExhibitPrefetcher(settings=settings, gallery_manager=manager).start()
+        assert manager.prefetching
+        assert [manager.get_exhibit_data(e)["prefetching"] for e in exhibits] == [
+            True,
+            False,
+            True,
+        ]
+
+        await wait_for_pulls(settings, [0, 2])
+        response = await jp_fetch("jupyterlab-gallery", "exhibits")
+        payload = json.loads(response.body)
+        assert not any(e["prefetching"] for e in payload["exhibits"])
+        assert not manager.prefetching
+
+    root_dir = Path(jp_serverapp.root_dir)
+    assert (root_dir / "gallery" / "low" / "first").exists()
+    assert not (root_dir / "gallery" / "skipped").exists()
+    assert (root_dir / "gallery" / "high" / "first").exists()
+
+    bus = settings["progress_bus"]
+    # exhibit with the higher priority was pulled first
+    assert bus._history[2][-1].id < bus._history[0][-1].id
+
+
+async def test_pull_progress_stream(
+    jp_serverapp, jp_fetch, jp_base_url, http_server_client, git_remote
+):
+    token = jp_serverapp.identity_provider.token
+    events = []
+    finished = asyncio.Event()
+
+    def on_chunk(chunk: bytes):
+        for line in chunk.decode().splitlines():
+            if line.startswith("data: "):
+                event = json.loads(line[len("data: ") :])
+                events.append(event)
+                if event["phase"] in {"finished", "error"}:
+                    finished.set()
+
+    stream = asyncio.ensure_future(
+        http_server_client.fetch(
+            url_path_join(jp_base_url, "jupyterlab-gallery", "pull"),
+            headers={"Authorization": f"token {token}"},
+            streaming_callback=on_chunk,
+            request_timeout=0,
+            raise_error=False,
+        )
+    )
+    with mock.patch.object(GalleryManager, "exhibits", [{"git": git_remote.url}]):
+        await jp_fetch(
+            "jupyterlab-gallery",
+            "pull",
+            method="POST",
+            body=json.dumps({"exhibit_id": 0}),
+        )
+        await asyncio.wait_for(finished.wait(), timeout=10)
+    stream.cancel()
+
+    assert events[0] == {"phase": "connected"}
+    assert events[-1] == {"phase": "finished", "exhibit_id": 0}
+    assert any(event["phase"] == "progress" for event in events)
+
+
+async def test_exhibits_etag(jp_fetch):
+    response = await jp_fetch("jupyterlab-gallery", "exhibits")
+    etag = response.headers["ETag"]
+    with pytest.raises(HTTPClientError) as e:
+        await jp_fetch(
+            "jupyterlab-gallery", "exhibits", headers={"If-None-Match": etag}
+        )
+    assert e.value.code == 304
+
+
+async def test_exhibits_invalidated_when_cloned(jp_serverapp, jp_fetch, tmp_path):
+    exhibit = {"git": "https://github.com/nebari-dev/nebari.git"}
+    manager = jp_serverapp.web_app.settings["gallery_manager"]
+    with mock.patch.object(GalleryManager, "exhibits", [exhibit]), mock.patch.object(
+        GalleryManager, "destination", str(tmp_path)
+    ):
+        response = await jp_fetch("jupyterlab-gallery", "exhibits")
+        payload = json.loads(response.body)
+        assert not payload["exhibits"][0]["isCloned"]
+
+        (tmp_path / "nebari").mkdir()
+        response = await jp_fetch("jupyterlab-gallery", "exhibits")
+        new_payload = json.loads(response.body)
+        assert new_payload["exhibits"][0]["isCloned"]
+        assert new_payload["version"] > payload["version"]
+
+        # long polling returns as soon as the state changes
+        waiting = asyncio.ensure_future(
+            jp_fetch(
+                "jupyterlab-gallery",
+                "exhibits",
+                params={"after_version": new_payload["version"]},
+            )
+        )
+        await asyncio.sleep(0.1)
+        assert not waiting.done()
+        manager.invalidate_exhibit_data()
+        response = await asyncio.wait_for(waiting, timeout=5)
+        assert json.loads(response.body)["version"] > new_payload["version"]
+
+
+async def test_pull_borrows_objects_from_shared_cache(
+    jp_serverapp, jp_fetch, tmp_path, git_remote
+):
+    settings = jp_serverapp.web_app.settings
+    manager = settings["gallery_manager"]
+    exhibit = {"git": git_remote.url}
+    with mock.patch.object(GalleryManager, "exhibits", [exhibit]), mock.patch.object(
+        GalleryManager, "shared_cache_dir", str(tmp_path / "cache")
+    ):
+        await manager.update_shared_cache()
+        mirror = manager.get_shared_cache_path(exhibit)
+        assert (mirror / "HEAD").exists()
+        gc_auto = subprocess.run(
+            ["git", "config", "gc.auto"],
+            cwd=mirror,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        assert gc_auto.stdout.strip() == "0"
+        # refreshing fetches into the existing mirror
+        await manager.update_shared_cache()
+
+        await jp_fetch(
+            "jupyterlab-gallery",
+            "pull",
+            method="POST",
+            body=json.dumps({"exhibit_id": 0}),
+        )
+        await wait_for_pulls(settings, [0])
+
+    assert last_message(settings["progress_bus"], 0)["phase"] == "finished"
+    clone = Path(jp_serverapp.root_dir) / "gallery" / "remote"
+    alternates = clone / ".git" / "objects" / "info" / "alternates"
+    assert alternates.read_text().strip() == str(mirror / "objects")
+
+
+async def test_pull_partial_sparse_clone(jp_serverapp, jp_fetch, git_remote):
+    git_remote.push_commit("notebooks/intro.ipynb")
+    git_remote.push_commit("data/large.csv")
+    settings = jp_serverapp.web_app.settings
+    exhibit = {
+        "git": git_remote.url,
+        "filter": "blob:none",
+        "sparse_paths": ["notebooks"],
+    }
+    with mock.patch.object(GalleryManager, "exhibits", [exhibit]):
+        await jp_fetch(
+            "jupyterlab-gallery",
+            "pull",
+            method="POST",
+            body=json.dumps({"exhibit_id": 0}),
+        )
+        await wait_for_pulls(settings, [0])
+
+    assert last_message(settings["progress_bus"], 0)["phase"] == "finished"
+    clone = Path(jp_serverapp.root_dir) / "gallery" / "remote"
+    assert (clone / "notebooks" / "intro.ipynb").exists()
+    assert not (clone / "data").exists()
+
+    # updating fetches the blobs of new and deleted files
+    git_remote.push_commit("notebooks/next.ipynb")
+    (clone / "notebooks" / "intro.ipynb").unlink()
+    with mock.patch.object(GalleryManager, "exhibits", [exhibit]), mock.patch(
+        "nbgitpuller.pull.execute_cmd", wraps=nbgitpuller.pull.execute_cmd
+    ) as execute_cmd:
+        await jp_fetch(
+            "jupyterlab-gallery",
+            "pull",
+            method="POST",
+            body=json.dumps({"exhibit_id": 0}),
+        )
+        await wait_for_pulls(settings, [0])
+
+    assert last_message(settings["progress_bus"], 0)["phase"] == "finished"
+    assert (clone / "notebooks" / "intro.ipynb").exists()
+    assert (clone / "notebooks" / "next.ipynb").exists()
+    assert not (clone / "data").exists()
+    # git commands fetching blobs run with the credentials of the exhibit
+    commands = [call.args[0] for call in execute_cmd.call_args_list]
+    assert not [command for command in commands if {"merge", "checkout"} & set(command)]
+
+
+def commit_notes(git_remote, name: str, text: str):
+    """Push a commit writing `name` and removing deleted files."""
+    (git_remote.author / name).write_text(text)
+    for args in [
+        ["add", "--all"],
+        ["-c", "user.name=test", "-c", "user.email=test@example.com"]
+        + ["commit", "-m", name],
+        ["push", "origin", "main"],
+    ]:
+        subprocess.run(
+            ["git", *args], cwd=git_remote.author, check=True, capture_output=True
+        )
+
+
+async def test_update_private_partial_clone_after_rename(
+    jp_serverapp, jp_fetch, git_remote, monkeypatch
+):
+    # a remote which only answers when given the credentials of the exhibit
+    monkeypatch.setenv("GIT_CONFIG_COUNT", "1")
+    monkeypatch.setenv("GIT_CONFIG_KEY_0", "protocol.ext.allow")
+    monkeypatch.setenv("GIT_CONFIG_VALUE_0", "always")
+    subprocess.run(
+        ["git", "config", "uploadpack.allowAnySHA1InWant", "true"],
+        cwd=git_remote.path,
+        check=True,
+    )
+    url = (
+        'ext::sh -c test% "$GIT_PULLER_TOKEN"% =% secret% &&% exec% %S%'
+        f" {git_remote.path}"
+    )
+    notes = "\n".join(map(str, range(100)))
+    commit_notes(git_remote, "notes.txt", notes)
+    settings = jp_serverapp.web_app.settings
+    exhibit = {
+        "git": url,
+        "filter": "blob:none",
+        "account": "user",
+        "token": "secret",
+    }
+
+    async def pull():
+        with mock.patch.object(GalleryManager, "exhibits", [exhibit]):
+            await jp_fetch(
+                "jupyterlab-gallery",
+                "pull",
+                method="POST",
+                body=json.dumps({"exhibit_id": 0}),
+            )
+            await wait_for_pulls(settings, [0])
+        return last_message(settings["progress_bus"], 0)
+
+    assert (await pull())["phase"] == "finished"
+
+    # renamed and modified, so that rename detection would need both blobs
+    (git_remote.author / "notes.txt").unlink()
+    commit_notes(git_remote, "renamed.txt", notes + "\n100")
+    message = await pull()
+    assert message["phase"] == "finished", message
+    clone = Path(jp_serverapp.root_dir) / "gallery" / "remote"
+    assert (clone / "renamed.txt").exists()
+    assert not (clone / "notes.txt").exists()
+
+
+def make_snapshot(kind, tmp_path, git_remote):
+    if kind == "missing":
+        return tmp_path / "missing.bundle"
+    if kind == "bundle":
+        snapshot = tmp_path / "remote.bundle"
+        subprocess.run(
+            ["git", "bundle", "create", str(snapshot), "--all"],
+            cwd=git_remote.path,
+            check=True,
+            capture_output=True,
+        )
+        return snapshot
+    clone = tmp_path / "snapshot" / "remote"
+    subprocess.run(["git", "clone", "--quiet", git_remote.url, str(clone)], check=True)
+    snapshot = tmp_path / "remote.tar.gz"
+    with tarfile.open(snapshot, "w:gz") as archive:
+        archive.add(clone, arcname="remote")
+    return snapshot
+
+
+@pytest.mark.parametrize("kind", ["bundle", "tarball", "missing"])
+async def test_pull_from_snapshot(jp_serverapp, jp_fetch, tmp_path, git_remote, kind):
+    snapshot = make_snapshot(kind, tmp_path, git_remote)
+    # pushed after the snapshot was made
+    git_remote.push_commit("second")
+    settings = jp_serverapp.web_app.settings
+    exhibit = {"git": git_remote.url, "snapshot": str(snapshot)}
+    with mock.patch.object(GalleryManager, "exhibits", [exhibit]):
+        await jp_fetch(
+            "jupyterlab-gallery",
+            "pull",
+            method="POST",
+            body=json.dumps({"exhibit_id": 0}),
+        )
+        await wait_for_pulls(settings, [0])
+
+    assert last_message(settings["progress_bus"], 0)["phase"] == "finished"
+    clone = Path(jp_serverapp.root_dir) / "gallery" / "remote"
+    assert (clone / "first").exists()
+    assert (clone / "second").exists()
+    origin = subprocess.run(
+        ["git", "remote", "get-url", "origin"],
+        cwd=clone,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    assert origin.stdout.strip() == git_remote.url
+    assert not list(clone.parent.glob(".snapshot-*"))
+    outputs = [
+        str(event.message.get("output"))
+        for event in settings["progress_bus"]._history[0]
+    ]
+    # restoring is followed by an update, which fetches from the remote
+    assert any("git fetch" in output for output in outputs) == (kind != "missing")
+
+
+async def test_timelines(jp_serverapp, jp_fetch, git_remote):
+    settings = jp_serverapp.web_app.settings
+    with mock.patch.object(GalleryManager, "exhibits", [{"git": git_remote.url}]):
+        for _ in range(2):
+            await jp_fetch(
+                "jupyterlab-gallery",
+                "pull",
+                method="POST",
+                body=json.dumps({"exhibit_id": 0}),
+            )
+            await wait_for_pulls(settings, [0])
+            while settings["active_pulls"]:
+                await asyncio.sleep(0.01)
+
+    response = await jp_fetch("jupyterlab-gallery", "debug", "timelines")
+    pull, clone = json.loads(response.body)["timelines"]
+    assert clone["operation"] == "clone"
+    assert clone["exhibit"] == "remote"
+    assert clone["outcome"] == "succeeded"
+    phases = [phase["name"] for phase in clone["phases"]]
+    assert phases[:4] == ["queued", "start", "resolve-branch", "clone"]
+    assert [phase["name"] for phase in pull["phases"]][-2:] == ["fetch", "merge"]
+
+    response = await jp_fetch(
+        "jupyterlab-gallery", "debug", "timelines", params={"operation": "pull"}
+    )
+    assert [t["operation"] for t in json.loads(response.body)["timelines"]] == ["pull"]
+
+
+async def test_metrics(jp_serverapp, jp_fetch, git_remote, monkeypatch):
+    # report progress of small transfers, as a pack rather than unpacked objects
+    monkeypatch.setenv("GIT_PROGRESS_DELAY", "0")
+    monkeypatch.setenv("GIT_CONFIG_COUNT", "1")
+    monkeypatch.setenv("GIT_CONFIG_KEY_0", "transfer.unpackLimit")
+    monkeypatch.setenv("GIT_CONFIG_VALUE_0", "1")
+    settings = jp_serverapp.web_app.settings
+    with mock.patch.object(GalleryManager, "exhibits", [{"git": git_remote.url}]):
+        await jp_fetch(
+            "jupyterlab-gallery",
+            "pull",
+            method="POST",
+            body=json.dumps({"exhibit_id": 0}),
+        )
+        await wait_for_pulls(settings, [0])
+    response = await jp_fetch("jupyterlab-gallery", "metrics")
+    assert response.code == 200
+    metrics = response.body.decode()
+    assert (
+        'jupyterlab_gallery_git_operation_duration_seconds_count{exhibit="remote",operation="clone"}'
+        in metrics
+    )
+    assert (
+        'jupyterlab_gallery_pull_lock_wait_seconds_count{exhibit="remote"}' in metrics
+    )
+    assert "jupyterlab_gallery_event_streams 0.0" in metrics
+
+    # bytes received by fetches are counted as well
+    received = REGISTRY.get_sample_value(
+        "jupyterlab_gallery_git_received_bytes_total", {"exhibit": "remote"}
+    )
+    git_remote.push_commit("data/large.csv")
+    with mock.patch.object(GalleryManager, "exhibits", [{"git": git_remote.url}]):
+        await jp_fetch(
+            "jupyterlab-gallery",
+            "pull",
+            method="POST",
+            body=json.dumps({"exhibit_id": 0}),
+        )
+        await wait_for_pulls(settings, [0])
+    assert (
+        REGISTRY.get_sample_value(
+            "jupyterlab_gallery_git_received_bytes_total", {"exhibit": "remote"}
+        )
+        > received
+    )
+
+
+async def test_pull_stream_resumes_after_last_event_id(
+    jp_serverapp, jp_fetch, jp_base_url, http_server_client, git_remote
+):
+    settings = jp_serverapp.web_app.settings
+    with mock.patch.object(GalleryManager, "exhibits", [{"git": git_remote.url}]):
+        await jp_fetch(
+            "jupyterlab-gallery",
+            "pull",
+            method="POST",
+            body=json.dumps({"exhibit_id": 0}),
+        )
+        await wait_for_pulls(settings, [0])
+
+    token = jp_serverapp.identity_provider.token
+    chunks = []
+    finished = asyncio.Event()
+
+    def on_chunk(chunk: bytes):
+        chunks.append(chunk.decode())
+        if '"finished"' in chunk.decode():
+            finished.set()
+
+    stream = asyncio.ensure_future(
+        http_server_client.fetch(
+            url_path_join(jp_base_url, "jupyterlab-gallery", "pull"),
+            headers={"Authorization": f"token {token}", "Last-Event-ID": "1"},
+            streaming_callback=on_chunk,
+            request_timeout=0,
+            raise_error=False,
+        )
+    )
+    await asyncio.wait_for(finished.wait(), timeout=10)
+    stream.cancel()
+
+    ids = [
+        int(line[len("id: ") :])
+        for line in "".join(chunks).splitlines()
+        if line.startswith("id: ")
+    ]
+    # every event after the first one is replayed, in order
+    assert ids[0] == 2
+    assert ids == sorted(ids)
+    assert len(ids) > 2
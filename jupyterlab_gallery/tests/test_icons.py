@@ -0,0 +1,33 @@
+import base64
+import os
+
+from jupyterlab_gallery.icons import IconCache, decode_data_uri, sniff_content_type
+
+
+def test_decode_data_uri():
+    assert decode_data_uri(
+        "data:image/png;base64," + base64.b64encode(b"\x89PNG\r\n\x1a\n").decode()
+    ) == (b"\x89PNG\r\n\x1a\n", "image/png")
+    assert decode_data_uri("data:,%3Csvg%3E") == (b"<svg>", None)
+
+
+def test_sniff_content_type():
+    assert sniff_content_type(b"\x89PNG\r\n\x1a\n...") == "image/png"
+    assert sniff_content_type(b'<?xml version="1.0"?>\n<svg>') == "image/svg+xml"
+    assert sniff_content_type(b"???", fallback="image/x-icon; a=b") == "image/x-icon"
+
+
+def test_icon_cache_evicts_least_recently_used(tmp_path):
+    cache = IconCache(tmp_path, max_bytes=25)
+    first = cache.put("first", b"1" * 10, "image/png")
+    cache.put("second", b"2" * 10, "image/png")
+    # make sure that the access times differ
+    os.utime(tmp_path / "first", (0, 0))
+    os.utime(tmp_path / "second", (1, 1))
+    assert cache.get("first") == first
+
+    cache.put("third", b"3" * 10, "image/png")
+    assert cache.get("second") is None
+    assert cache.get("first") == first
+    assert cache.get("third").data == b"3" * 10
+    assert first.etag == cache.put("copy", b"1" * 10, "image/png").etag
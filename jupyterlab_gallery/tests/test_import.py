@@ -0,0 +1,48 @@
+import subprocess
+import sys
+
+# Budgets (in seconds) for importing the package, as done by every tool
+# listing lab extensions, and for loading the server extension on top of
+# jupyter_server, as done by every spawned server; generous enough for
+# slow machines but far below the cost of importing the whole stack.
+PACKAGE_IMPORT_BUDGET = 0.25
+EXTENSION_IMPORT_BUDGET = 0.5
+
+
+def import_times(code: str) -> dict[str, float]:
+    """Cumulative import times (in seconds) of modules imported by `code`."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, module = line[len("import time:") :].split("|")
+        try:
+            times[module.strip()] = int(cumulative) / 1e6
+        except ValueError:
+            # header
+            continue
+    return times
+
+
+def test_package_import_time():
+    times = import_times("import jupyterlab_gallery")
+    assert "jupyter_server.serverapp" not in times
+    assert times["jupyterlab_gallery"] < PACKAGE_IMPORT_BUDGET
+
+
+def test_extension_import_time():
+    # jupyter_server is imported by the server before loading extensions
+    times = import_times(
+        "import jupyter_server.serverapp, jupyter_server.extension.application;"
+        " import jupyterlab_gallery.app"
+    )
+    # only imported once the first pull runs
+    assert "git" not in times
+    assert "nbgitpuller" not in times
+    assert times["jupyterlab_gallery.app"] < EXTENSION_IMPORT_BUDGET
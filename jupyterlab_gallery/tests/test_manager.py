@@ -0,0 +1,228 @@
+import asyncio
+import json
+import logging
+import subprocess
+from unittest import mock
+
+from jupyterlab_gallery.git_utils import UpdateCheck
+from jupyterlab_gallery.manager import GalleryManager
+
+
+def make_manager(tmp_path, exhibits, **kwargs):
+    manager = GalleryManager(
+        root_dir=str(tmp_path), destination=str(tmp_path / "gallery"), **kwargs
+    )
+    manager.exhibits = exhibits
+    return manager
+
+
+def make_clone(tmp_path, name):
+    local_path = tmp_path / "gallery" / name
+    (local_path / ".git").mkdir(parents=True)
+    (local_path / ".git" / "HEAD").write_text("ref: refs/heads/main\n")
+    return local_path
+
+
+async def test_exhibit_data_does_not_check_updates(tmp_path):
+    make_clone(tmp_path, "repo")
+    manager = make_manager(tmp_path, [{"git": "https://example.com/org/repo.git"}])
+    with mock.patch("jupyterlab_gallery.manager.check_remote_updates") as has_updates:
+        data = manager.get_exhibit_data(manager.exhibits[0])
+    assert data["isCloned"]
+    assert data["updatesAvailable"] is None
+    has_updates.assert_not_called()
+
+
+async def test_update_checks_are_deduplicated(tmp_path):
+    local_path = make_clone(tmp_path, "repo")
+    manager = make_manager(
+        tmp_path,
+        [
+            {"git": "https://example.com/org/repo.git"},
+            {"git": "https://example.com/fork/repo.git"},
+            {"git": "https://example.com/org/not-cloned.git"},
+        ],
+        update_check_interval=60,
+    )
+    manager.start_update_checks()
+    try:
+        with mock.patch(
+            "jupyterlab_gallery.manager.check_remote_updates",
+            return_value=UpdateCheck(updates_available=True, remote_sha="abc"),
+        ) as has_updates:
+            manager.schedule_update_checks()
+            # a second pass while the first check is pending or fresh is a no-op
+            manager.schedule_update_checks()
+            while manager._update_checks_pending:
+                await asyncio.sleep(0.01)
+            manager.schedule_update_checks()
+        has_updates.assert_called_once()
+        assert has_updates.call_args.args == (local_path,)
+        assert manager.get_exhibit_data(manager.exhibits[0])["updatesAvailable"]
+
+        # a check with the same result does not invalidate the state
+        version = manager.state_version
+        with mock.patch(
+            "jupyterlab_gallery.manager.check_remote_updates",
+            return_value=UpdateCheck(updates_available=True, remote_sha="abc"),
+        ):
+            await manager._check_updates(manager.exhibits[0])
+        assert manager.state_version == version
+    finally:
+        await manager.stop_update_checks()
+
+
+async def test_update_scheduler_sleeps_without_clones(tmp_path):
+    exhibit = {"git": "https://example.com/org/repo.git"}
+    manager = make_manager(tmp_path, [exhibit], update_check_interval=60)
+    assert manager._seconds_until_next_check() is None
+    local_path = make_clone(tmp_path, "repo")
+    manager._update_check_done(local_path, mock.Mock())
+    assert 1 <= manager._seconds_until_next_check() <= 60
+    # a deleted clone is not checked, so does not wake up the scheduler
+    (local_path / ".git" / "HEAD").unlink()
+    (local_path / ".git").rmdir()
+    local_path.rmdir()
+    assert manager._seconds_until_next_check() is None
+
+
+async def test_fetch_update_check_waits_for_pulls(tmp_path):
+    exhibit = {"git": "https://example.com/org/repo.git"}
+    make_clone(tmp_path, "repo")
+    manager = make_manager(tmp_path, [exhibit], update_check_method="fetch")
+    with mock.patch(
+        "jupyterlab_gallery.manager.check_updates",
+        return_value=UpdateCheck(updates_available=True),
+    ) as check:
+        async with manager.repo_locks.hold(manager.get_repo_dir(exhibit)):
+            task = asyncio.create_task(manager._check_updates(exhibit))
+            await asyncio.sleep(0.05)
+            check.assert_not_called()
+        await task
+    check.assert_called_once()
+
+
+def test_exhibit_ids_are_stable(tmp_path):
+    first = {"git": "https://example.com/org/first.git"}
+    second = {"git": "https://example.com/org/second.git"}
+    manager = make_manager(tmp_path, [first, second])
+    make_clone(tmp_path, "second")
+    data = manager.get_exhibit_data(second)
+    assert manager.get_exhibits() == {0: first, 1: second}
+
+    branch = {**first, "branch": "dev"}
+    manager.exhibits = [second, branch, first]
+    assert manager.get_exhibits() == {1: second, 2: branch, 0: first}
+    # data of unchanged exhibits is kept
+    assert manager.get_exhibit_data(second) is data
+
+
+def test_state_is_dropped_with_exhibits(tmp_path):
+    manager = make_manager(tmp_path, [])
+    for i in range(10):
+        exhibit = {"git": f"https://example.com/org/repo-{i}.git"}
+        manager.exhibits = [exhibit]
+        manager._update_check_done(manager.get_local_path(exhibit), mock.Mock())
+        manager.get_exhibits()
+        manager.get_exhibit_data(exhibit)
+    assert len(manager._exhibit_ids) == 1
+    assert len(manager._exhibit_data) == 1
+    assert len(manager._update_states) == 1
+
+
+async def test_shared_cache_failures_are_logged(tmp_path, caplog):
+    # the cache directory cannot be created below a file
+    (tmp_path / "cache").write_text("")
+    exhibits = [
+        {"git": "https://example.com/org/repo.git"},
+        {"git": "https://example.com/org/repo.git", "branch": "dev"},
+    ]
+    manager = make_manager(
+        tmp_path,
+        exhibits,
+        shared_cache_dir=str(tmp_path / "cache" / "mirrors"),
+        log=logging.getLogger("gallery-test"),
+    )
+    with caplog.at_level(logging.WARNING, logger="gallery-test"):
+        await manager.update_shared_cache()
+    # both exhibits share one mirror
+    (record,) = caplog.records
+    assert record.getMessage().startswith(
+        f"Updating shared cache {manager.get_shared_cache_path(exhibits[0])} failed"
+    )
+
+
+async def test_maintenance_waits_for_pulls(tmp_path, git_remote):
+    exhibit = {"git": git_remote.url}
+    manager = make_manager(tmp_path, [exhibit], maintenance_budget=1.5)
+    repo_dir = manager.get_repo_dir(exhibit)
+    subprocess.run(["git", "clone", "--quiet", git_remote.url, repo_dir], check=True)
+    commit_graph = tmp_path / "gallery" / "remote" / ".git" / "objects" / "info"
+
+    async with manager.repo_locks.hold(repo_dir):
+        await manager.run_maintenance()
+    assert not (commit_graph / "commit-graph").exists()
+    assert not (commit_graph / "commit-graphs").exists()
+
+    await manager.run_maintenance()
+    assert (commit_graph / "commit-graph").exists() or (
+        commit_graph / "commit-graphs"
+    ).exists()
+
+
+async def test_update_state_survives_restart(tmp_path):
+    make_clone(tmp_path, "repo")
+    make_clone(tmp_path, "stale")
+    exhibits = [
+        {"git": "https://example.com/org/repo.git"},
+        {"git": "https://example.com/org/stale.git"},
+    ]
+    manager = make_manager(tmp_path, exhibits, update_check_interval=60)
+    manager.start_update_checks()
+    try:
+        with mock.patch(
+            "jupyterlab_gallery.manager.check_remote_updates",
+            return_value=UpdateCheck(updates_available=True, remote_sha="abc"),
+        ):
+            manager.schedule_update_checks()
+            while manager._update_checks_pending:
+                await asyncio.sleep(0.01)
+    finally:
+        await manager.stop_update_checks()
+    manager.record_pull(exhibits[1])
+    state_path = tmp_path / "gallery" / ".jupyterlab-gallery-state.json"
+    saved = json.loads(state_path.read_text())["exhibits"]
+    assert saved[str(manager.get_local_path(exhibits[0]))]["remote_sha"] == "abc"
+    # the second exhibit was last checked long ago
+    saved[str(manager.get_local_path(exhibits[1]))]["checked_at"] -= 3600
+    state_path.write_text(json.dumps({"version": 1, "exhibits": saved}))
+
+    restarted = make_manager(tmp_path, exhibits, update_check_interval=60)
+    restarted.load_state()
+    assert restarted.get_exhibit_data(exhibits[0])["updatesAvailable"] is True
+    assert restarted.get_exhibit_data(exhibits[1])["updatesAvailable"] is False
+    restarted.start_update_checks()
+    try:
+        with mock.patch(
+            "jupyterlab_gallery.manager.check_remote_updates",
+            return_value=UpdateCheck(updates_available=False),
+        ) as check:
+            restarted.schedule_update_checks()
+            while restarted._update_checks_pending:
+                await asyncio.sleep(0.01)
+        # only the stale exhibit is checked again
+        check.assert_called_once()
+        assert check.call_args.args == (restarted.get_local_path(exhibits[1]),)
+    finally:
+        await restarted.stop_update_checks()
+
+
+def test_state_of_replaced_repository_is_not_loaded(tmp_path):
+    exhibit = {"git": "https://example.com/org/repo.git"}
+    manager = make_manager(tmp_path, [exhibit])
+    manager.record_pull(exhibit)
+
+    fork = {"git": "https://example.com/fork/repo.git"}
+    restarted = make_manager(tmp_path, [fork])
+    restarted.load_state()
+    assert restarted.get_local_path(fork) not in restarted._update_states
@@ -0,0 +1,16 @@
+from jupyterlab_gallery.search import ExhibitIndex
+
+
+def test_exhibit_index_matches_all_words_as_prefixes():
+    index = ExhibitIndex(
+        {
+            0: {"title": "Intro to Python", "description": "Basics of programming"},
+            1: {"title": "Advanced Python", "description": None},
+            2: {"title": "Geospatial data", "description": "Maps with Python"},
+        }
+    )
+    assert index.search("python") == {0, 1, 2}
+    assert index.search("PYTH prog") == {0}
+    assert index.search("python map") == {2}
+    assert index.search("rust") == set()
+    assert index.search("  ") == {0, 1, 2}
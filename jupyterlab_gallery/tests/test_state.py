@@ -0,0 +1,61 @@
+import asyncio
+import os
+
+import pytest
+
+from jupyterlab_gallery.state import KeyedLocks, StateStore, atomic_write
+
+
+def test_state_store_evicts_expired_and_oldest():
+    now = [0.0]
+    store = StateStore(max_size=2, ttl=10, clock=lambda: now[0])
+    store["a"] = 1
+    now[0] = 5
+    store["b"] = 2
+    store["c"] = 3
+    # "a" was set least recently
+    assert store.keys() == ["b", "c"]
+
+    now[0] = 12
+    store["c"] = 4
+    now[0] = 16
+    # "b" expired, while setting "c" again postponed its expiry
+    assert store.items() == [("c", 4)]
+    assert store.get("b", "missing") == "missing"
+
+    store.retain(set())
+    assert len(store) == 0
+
+
+async def test_keyed_locks_are_dropped_when_released():
+    locks = KeyedLocks()
+    order = []
+
+    async def hold(name):
+        async with locks.hold("repo"):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    first = asyncio.ensure_future(hold("first"))
+    await asyncio.sleep(0)
+    assert locks.locked("repo")
+    await asyncio.gather(first, hold("second"))
+    assert order == ["first", "second"]
+    assert len(locks) == 0
+    assert not locks.locked("repo")
+
+
+def test_atomic_write_removes_temporary_file_on_failure(tmp_path, monkeypatch):
+    path = tmp_path / "state.json"
+    atomic_write(path, "old")
+    atomic_write(path, b"new")
+    assert path.read_text() == "new"
+
+    def fail(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "replace", fail)
+    with pytest.raises(OSError):
+        atomic_write(path, "newer")
+    assert path.read_text() == "new"
+    assert os.listdir(tmp_path) == ["state.json"]
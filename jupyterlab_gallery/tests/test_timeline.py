@@ -0,0 +1,40 @@
+import logging
+
+from jupyterlab_gallery.timeline import Timeline, TimelineLog
+
+
+def test_timeline_phases_last_until_the_next_one():
+    now = [10.0]
+    timeline = Timeline("clone", "repo", clock=lambda: now[0])
+    timeline.mark("queued")
+    now[0] = 12
+    timeline.mark("receiving")
+    now[0] = 17
+    timeline.finish("succeeded")
+    # ignored once finished
+    timeline.mark("late")
+
+    data = timeline.to_dict()
+    assert data["outcome"] == "succeeded"
+    assert data["duration"] == 7
+    assert data["phases"] == [
+        {"name": "queued", "start": 0, "duration": 2},
+        {"name": "receiving", "start": 2, "duration": 5},
+    ]
+
+
+def test_timeline_log_keeps_recent_and_logs_slow(caplog):
+    now = [0.0]
+    log = TimelineLog(max_size=2, slow_threshold=5)
+    for name, duration in [("first", 1), ("second", 6), ("third", 1)]:
+        timeline = Timeline("pull", name, clock=lambda: now[0])
+        timeline.mark("fetch")
+        now[0] += duration
+        timeline.finish("succeeded")
+        with caplog.at_level(logging.WARNING):
+            log.record(timeline)
+
+    assert [timeline.exhibit for timeline in log.recent()] == ["third", "second"]
+    assert len(caplog.records) == 1
+    assert "Slow pull of second" in caplog.records[0].getMessage()
+    assert '"name": "fetch"' in caplog.records[0].getMessage()
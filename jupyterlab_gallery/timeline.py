@@ -0,0 +1,97 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+
+class Timeline:
+    """Consecutive named phases of an operation (a pull or an update check).
+
+    Each phase lasts until the next one starts or the operation finishes;
+    phases may be marked from another thread than the one finishing it.
+    """
+
+    def __init__(
+        self,
+        operation: str,
+        exhibit: str,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.operation = operation
+        self.exhibit = exhibit
+        self.outcome: Optional[str] = None
+        self.started_at = time.time()
+        self._clock = clock
+        self._start = clock()
+        self._end: Optional[float] = None
+        # phase names with their start (`clock` time)
+        self._phases: list[tuple[str, float]] = []
+        self._lock = threading.Lock()
+
+    def mark(self, phase: str):
+        """Start `phase`, ending the current one."""
+        with self._lock:
+            if self._end is None:
+                self._phases.append((phase, self._clock()))
+
+    def finish(self, outcome: str):
+        with self._lock:
+            if self._end is None:
+                self._end = self._clock()
+                self.outcome = outcome
+
+    @property
+    def duration(self) -> float:
+        with self._lock:
+            end = self._clock() if self._end is None else self._end
+        return end - self._start
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            end = self._clock() if self._end is None else self._end
+            phases = list(self._phases)
+        ends = [start for _, start in phases[1:]] + [end]
+        return {
+            "operation": self.operation,
+            "exhibit": self.exhibit,
+            "outcome": self.outcome,
+            "started_at": self.started_at,
+            "duration": end - self._start,
+            "phases": [
+                {
+                    "name": name,
+                    "start": start - self._start,
+                    "duration": phase_end - start,
+                }
+                for (name, start), phase_end in zip(phases, ends)
+            ],
+        }
+
+
+class TimelineLog:
+    """Keeps the timelines of recent operations and logs the slow ones."""
+
+    def __init__(
+        self,
+        max_size: int = 100,
+        slow_threshold: float = 10,
+        log: Optional[logging.Logger] = None,
+    ):
+        self.slow_threshold = slow_threshold
+        self.log = log or logging.getLogger(__name__)
+        self._timelines: deque[Timeline] = deque(maxlen=max_size)
+
+    def record(self, timeline: Timeline):
+        """Keep a finished timeline, logging it if slower than the threshold."""
+        self._timelines.append(timeline)
+        if self.slow_threshold and timeline.duration >= self.slow_threshold:
+            self.log.warning(
+                f"Slow {timeline.operation} of {timeline.exhibit}"
+                f" ({timeline.duration:.1f}s): {json.dumps(timeline.to_dict())}"
+            )
+
+    def recent(self) -> list[Timeline]:
+        """Recorded timelines, most recent first."""
+        return list(reversed(self._timelines))
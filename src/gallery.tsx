@@ -3,6 +3,7 @@ import { ReactWidget, showErrorMessage } from '@jupyterlab/apputils';
 import {
   Button,
   UseSignal,
+  closeIcon,
   folderIcon,
   downloadIcon,
   refreshIcon
@@ -23,6 +24,7 @@ import { repositoryIcon } from './icons';
 
 interface IActions {
   download(exhibit: IExhibit): Promise<void>;
+  cancel(exhibit: IExhibit): Promise<void>;
   open(exhibit: IExhibit): Promise<void>;
 }
 
@@ -50,7 +52,7 @@ export class GalleryWidget extends ReactWidget {
         const done = new Promise<void>((resolve, reject) => {
           const promiseResolver = (_: GalleryWidget, e: IStreamMessage) => {
             if (e.exhibit_id === exhibit.id) {
-              if (e.phase === 'finished') {
+              if (e.phase === 'finished' || e.phase === 'cancelled') {
                 resolve();
                 this._stream.disconnect(promiseResolver);
               } else if (e.phase === 'error') {
@@ -73,6 +75,13 @@ export class GalleryWidget extends ReactWidget {
           body: JSON.stringify(args)
         });
         await done;
+      },
+      cancel: async (exhibit: IExhibit) => {
+        await requestAPI(
+          `pull?exhibit_id=${exhibit.id}`,
+          this.options.serverAPI,
+          { method: 'DELETE' }
+        );
       }
     };
     // if user deletes a directory, reload the state
@@ -106,6 +115,8 @@ export class GalleryWidget extends ReactWidget {
     if (e.phase === 'finished') {
       await this._load();
       await this.options.refreshFileBrowser();
+    } else if (e.phase === 'exhibits-changed' && e.version > this._version) {
+      await this._load();
     }
   };
 
@@ -118,12 +129,9 @@ export class GalleryWidget extends ReactWidget {
         this.options.serverAPI
       );
       this.exhibits = data.exhibits;
-      const allStatusesKnown = this.exhibits.every(
-        exhibit =>
-          !exhibit.isCloned || typeof exhibit.updatesAvailable === 'boolean'
-      );
-      if (!allStatusesKnown) {
-        setTimeout(() => this._load(), 1000);
+      this._version = data.version;
+      if (!this._allStatusesKnown()) {
+        void this._waitForChanges();
       }
     } catch (reason) {
       this._status = `jupyterlab_gallery server failed:\n${reason}`;
@@ -131,6 +139,41 @@ export class GalleryWidget extends ReactWidget {
     this.update();
   }
 
+  /**
+   * Long-poll the server until update status of all exhibits is known
+   * and prefetching finished.
+   */
+  private async _waitForChanges() {
+    if (this._waitingForChanges) {
+      return;
+    }
+    this._waitingForChanges = true;
+    try {
+      while (!this.isDisposed && !this._allStatusesKnown()) {
+        // the server replies once the state changes (or after a timeout)
+        const data = await requestAPI<IExhibitReply>(
+          `exhibits?after_version=${this._version}`,
+          this.options.serverAPI
+        );
+        this.exhibits = data.exhibits;
+        this._version = data.version;
+        this.update();
+      }
+    } catch (reason) {
+      console.warn('Could not wait for gallery changes', reason);
+    } finally {
+      this._waitingForChanges = false;
+    }
+  }
+
+  private _allStatusesKnown(): boolean {
+    return (this.exhibits ?? []).every(
+      exhibit =>
+        !exhibit.prefetching &&
+        (!exhibit.isCloned || typeof exhibit.updatesAvailable === 'boolean')
+    );
+  }
+
   get exhibits(): IExhibit[] | null {
     return this._exhibits;
   }
@@ -168,6 +211,8 @@ export class GalleryWidget extends ReactWidget {
   private _trans: TranslationBundle;
   private _update = new Signal<GalleryWidget, void>(this);
   private _exhibits: IExhibit[] | null = null;
+  private _version = 0;
+  private _waitingForChanges = false;
   private _status: string;
   private _actions: IActions;
   private _stream: Stream<GalleryWidget, IStreamMessage> = new Stream(this);
@@ -227,6 +272,7 @@ function Exhibit(props: {
           setProgressMessage(message.output.message);
           break;
         case 'finished':
+        case 'cancelled':
           setProgress(null);
           break;
         default:
@@ -255,7 +301,11 @@ function Exhibit(props: {
           {!exhibit.isCloned ? (
             <Button
               minimal={true}
-              title={props.trans.__('Set up')}
+              title={
+                exhibit.prefetching
+                  ? props.trans.__('Downloading in the background')
+                  : props.trans.__('Set up')
+              }
               onClick={async () => {
                 setProgressMessage('Downloading');
                 setProgress({
@@ -337,6 +387,19 @@ function Exhibit(props: {
               style={{ width: progress.progress * 100 + '%' }}
             ></div>
             <div className="jp-Exhibit-progressMessage">{progressMessage}</div>
+            {progress.state !== 'error' ? (
+              <Button
+                minimal={true}
+                small={true}
+                className="jp-Exhibit-cancel"
+                title={props.trans.__('Cancel')}
+                onClick={() => {
+                  void actions.cancel(exhibit);
+                }}
+              >
+                <closeIcon.react />
+              </Button>
+            ) : null}
           </div>
         ) : null}
         <div className="jp-Exhibit-description">{exhibit.description}</div>
@@ -56,11 +56,29 @@ export interface IProgressStreamMessage {
 
 export interface ITextStreamMessage {
   output?: string;
-  phase: 'error' | 'finished' | 'syncing';
+  phase: 'error' | 'finished' | 'syncing' | 'cancelled';
   exhibit_id: number;
 }
 
-export type IStreamMessage = IProgressStreamMessage | ITextStreamMessage;
+export interface IBatchStreamMessage {
+  phase: 'batch-finished';
+  batch_id: number;
+  succeeded: number[];
+  failed: number[];
+  exhibit_id?: undefined;
+}
+
+export interface IExhibitsChangedMessage {
+  phase: 'exhibits-changed';
+  version: number;
+  exhibit_id?: undefined;
+}
+
+export type IStreamMessage =
+  | IProgressStreamMessage
+  | ITextStreamMessage
+  | IBatchStreamMessage
+  | IExhibitsChangedMessage;
 
 export interface IEventStream {
   close: () => void;
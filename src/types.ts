@@ -3,10 +3,12 @@ export interface IGalleryReply {
   apiVersion: string;
   exhibitsConfigured: boolean;
   hideGalleryWithoutExhibits: boolean;
+  prefetching: boolean;
 }
 
 export interface IExhibitReply {
   exhibits: IExhibit[];
+  version: number;
 }
 
 export interface IExhibit {
@@ -22,4 +24,5 @@ export interface IExhibit {
   revision: string;
   lastUpdated: string;
   updatesAvailable?: boolean;
+  prefetching: boolean;
 }